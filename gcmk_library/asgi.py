@@ -0,0 +1,54 @@
+"""
+ASGI config for gcmk_library project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+The pages and the API are served by the WSGI application, each request in a
+thread of its own, and the live event stream (see library.event_stream) by
+an asynchronous application, so that thousands of idle streams don't each
+hold a thread. Run it with an ASGI server, for example
+
+    uvicorn gcmk_library.asgi:application
+
+Events are passed from the requests that make them to the streams within the
+process, so serve the whole site from a single process; the Procfile does.
+That gives up what gunicorn's several workers were for: the pages and the
+API share one process's threads and, because of the GIL, one CPU core. Run
+more processes only if the live events can go without, and then give them
+a shared cache (see CACHES in the settings).
+"""
+
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gcmk_library.settings')
+
+django_application = WsgiToAsgi(get_wsgi_application())
+
+# Imported once Django is set up
+from library.event_stream import EVENTS_PATH, stream_events  # noqa: E402
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    # Without a context of their own, requests would all take turns in one thread
+    async with ThreadSensitiveContext():
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            await stream_events(scope, receive, send)
+        else:
+            await django_application(scope, receive, send)
@@ -56,6 +56,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Report the queries of each request in X-DB-* headers and library.queries.log
+if DEBUG:
+    MIDDLEWARE.append('library.instrumentation.QueryInstrumentationMiddleware')
+
 ROOT_URLCONF = 'gcmk_library.urls'
 
 TEMPLATES = [
@@ -90,6 +94,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Local memory is private to each process, so gunicorn's workers each have
+# their own: the library keeps things in it only for a short time, so that a
+# change made through one worker reaches the others soon (see
+# library.configuration). Use a shared cache, such as memcached, to keep
+# things for longer.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -111,6 +130,9 @@ AUTH_PASSWORD_VALIDATORS = [
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
+# Users' permissions are cached; see library.permissions
+AUTHENTICATION_BACKENDS = ['library.permissions.CachedModelBackend']
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.1/topics/i18n/
 
@@ -148,10 +170,19 @@ DATABASES['default'].update(db_from_env)
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # See library.authentication; Basic stays first so that unauthenticated
+    # responses still ask for Basic credentials
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'library.authentication.MeasuredBasicAuthentication',
+        'library.authentication.MeasuredSessionAuthentication',
+        'library.authentication.SignedTokenAuthentication',
+        'library.authentication.CachedTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        # ?format=compact; see library.renderers
+        'library.renderers.CompactJSONRenderer',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAdminUser',),
@@ -168,12 +199,30 @@ LOGGING = {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'queries_file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'library.queries.log'),
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'timestamped',
+        },
+    },
+    'formatters': {
+        'timestamped': {
+            'format': '%(asctime)s - %(levelname)s - %(message)s',
+        },
     },
     'loggers': {
         'django': {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
         },
+        'library.queries': {
+            'handlers': ['queries_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -3,11 +3,13 @@ from rest_framework.authtoken.admin import TokenAdmin
 
 # Register your models here.
 
-from library.models import Book, Copy, Loan, Configuration, UserMicrobit, Category
+from library.models import ArchivedLoan, Book, Copy, Loan, LoanReminder, Configuration, UserMicrobit, Category
 
 admin.site.register(Book)
 admin.site.register(Copy)
 admin.site.register(Loan)
+admin.site.register(ArchivedLoan)
+admin.site.register(LoanReminder)
 admin.site.register(UserMicrobit)
 admin.site.register(Configuration)
 admin.site.register(Category)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class LibraryConfig(AppConfig):
     name = 'library'
+
+    def ready(self):
+        # Register the signal receivers
+        import library.signals  # noqa: F401
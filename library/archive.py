@@ -0,0 +1,74 @@
+"""
+Archiving of closed loans.
+
+Loans returned more than LIBRARY_ARCHIVE_LOANS_AFTER_DAYS ago are moved, a
+batch at a time, from Loan to ArchivedLoan, which has the same fields. Loan
+then holds little more than the loans in circulation and those recently
+returned, so the open loan queries don't slow down as the history grows.
+
+Lists of closed loans read both tables: closed_loans() gives a queryset for
+each, and KeysetPaginator pages through them as one list. Incremental sync
+(library.sync) doesn't: archived loans leave tombstones, so clients drop
+them as they would deleted loans.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+
+from library import sync
+from library.models import ArchivedLoan, Loan, LoanReminder
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 500
+
+
+def archive_after_days():
+    return getattr(settings, 'LIBRARY_ARCHIVE_LOANS_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+
+
+def default_cutoff():
+    """Loans returned before this date are due to be archived."""
+    return datetime.date.today() - datetime.timedelta(days=archive_after_days())
+
+
+def archive_loans(returned_before, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Moves loans returned before returned_before to the archive, oldest first
+    and batch_size in each transaction, yielding the number moved in each
+    batch.
+    """
+    fields = [field.attname for field in ArchivedLoan._meta.concrete_fields]
+    loans = (Loan.objects.filter(date_returned__lt=returned_before)
+        .order_by('date_returned', 'id'))
+    while True:
+        with transaction.atomic():
+            batch = list(loans.select_for_update().values(*fields)[:batch_size])
+            if not batch:
+                return
+            ids = [loan['id'] for loan in batch]
+            ArchivedLoan.objects.bulk_create([ArchivedLoan(**loan) for loan in batch])
+            # Reminders are only about open loans
+            LoanReminder.objects.filter(loan_id__in=ids).delete()
+            sync.record_deletions(Loan, batch)
+            # A closed loan counts towards neither availability, the
+            # statistics nor any cached response, so there's nothing else for
+            # the post_delete receivers to do: delete the rows without
+            # loading them to send the signals
+            Loan.objects.filter(pk__in=ids)._raw_delete(Loan.objects.db)
+        yield len(batch)
+
+
+def closed_loans(borrower_id=None):
+    """
+    Querysets of the closed loans still in Loan and of the archived loans,
+    most recently returned first, to be paged through together with
+    library.pagination.KeysetPaginator.
+    """
+    querysets = [
+        Loan.objects.filter(date_returned__isnull=False),
+        ArchivedLoan.objects.all(),
+    ]
+    if borrower_id is not None:
+        querysets = [loans.filter(borrower_id=borrower_id) for loans in querysets]
+    return [loans.order_by('-date_returned') for loans in querysets]
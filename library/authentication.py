@@ -0,0 +1,227 @@
+"""
+API authentication that doesn't cost a password hash or a query per request.
+
+Checking a password runs a deliberately slow PBKDF2 hash, so clients that
+call the API often, like the micro:bit gateways, shouldn't send Basic
+credentials with every request. Instead they trade them once, at
+api/v1/tokens/, for a signed token that is good for LIBRARY_API_TOKEN_SECONDS
+(default an hour), and send it as `Authorization: Bearer <token>`.
+SignedTokenAuthentication checks the token's signature and age, then finds
+its user in the cache. A token carries a fingerprint of its user's password
+hash, so changing the password revokes it, as does deactivating the user.
+
+CachedTokenAuthentication is DRF's TokenAuthentication with each token's
+user remembered in the cache, for clients with long-lived tokens.
+
+Users are cached under the per-user version kept by library.permissions,
+which is bumped whenever a user is saved or deleted. Only the fields needed
+to authenticate them are cached, with the fingerprint of their password
+rather than its hash; any other field is loaded from the database if used.
+The default cache is local to each gunicorn worker (see CACHES in the
+settings), so a worker only sees a user deactivated, or their password or
+token changed, through another worker once its own entry expires. Users and
+tokens are therefore only cached for LIBRARY_USER_CACHE_SECONDS (default
+30): raise it only if CACHES is a cache all the workers share, such as
+memcached.
+
+Each scheme counts, in this process, how often it authenticates or rejects a
+request and the CPU time it spends doing so; see metrics().
+"""
+from collections import Counter, OrderedDict
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import authentication, exceptions
+
+from library import caching, permissions
+
+TOKEN_SALT = 'library.authentication.token'
+DEFAULT_TOKEN_SECONDS = 60 * 60
+
+USER_KEY = 'library:user:{}:{}'
+TOKEN_KEY = 'library:token:{}'
+DEFAULT_USER_SECONDS = 30
+# What is cached of a user, besides a fingerprint of their password: enough
+# to authenticate them and check their permissions, and never the hash
+USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+# thread_time() is new in Python 3.7
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+_metrics = OrderedDict()
+_metrics_lock = threading.Lock()
+
+
+def token_seconds():
+    return getattr(settings, 'LIBRARY_API_TOKEN_SECONDS', DEFAULT_TOKEN_SECONDS)
+
+
+def user_cache_seconds():
+    """How long users and tokens are cached, in seconds."""
+    return getattr(settings, 'LIBRARY_USER_CACHE_SECONDS', DEFAULT_USER_SECONDS)
+
+
+def _cached_account(user_id):
+    """
+    The USER_FIELDS of the active user with this id and their password's
+    fingerprint, as a dict, or None if there isn't one.
+    """
+    key = USER_KEY.format(user_id,
+        *caching.get_versions(permissions.USER_SCOPE.format(user_id)))
+    account = cache.get(key)
+    if account is None:
+        user = User.objects.filter(pk=user_id, is_active=True).only('password', *USER_FIELDS).first()
+        # Remember missing users too, as False
+        account = False
+        if user is not None:
+            account = {name: getattr(user, name) for name in USER_FIELDS}
+            account['password'] = password_fingerprint(user)
+        cache.set(key, account, user_cache_seconds())
+    return account or None
+
+
+def _user(account):
+    """A User with the fields of an account, loading any others if they're used."""
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in USER_FIELDS]
+    return User.from_db(User.objects.db, names, [account[name] for name in names])
+
+
+def cached_user(user_id):
+    """The active user with this id, or None if there isn't one."""
+    account = _cached_account(user_id)
+    return None if account is None else _user(account)
+
+
+def password_fingerprint(user):
+    return salted_hmac(TOKEN_SALT, user.password).hexdigest()[:16]
+
+
+def issue_token(user):
+    """A signed token standing for user, until it expires or their password changes."""
+    return signing.dumps({'user': user.pk, 'password': password_fingerprint(user)},
+        salt=TOKEN_SALT)
+
+
+def token_user(token):
+    """The user a token from issue_token() stands for, if it is still good."""
+    try:
+        claims = signing.loads(token, salt=TOKEN_SALT, max_age=token_seconds())
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+
+    account = _cached_account(claims['user'])
+    if account is None or not constant_time_compare(account['password'], claims['password']):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    return _user(account)
+
+
+def forget_token(key):
+    """Forget the cached user of a DRF token that has been deleted."""
+    cache.delete(TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest()))
+
+
+def record(scheme, authenticated, cpu_seconds):
+    with _metrics_lock:
+        counts = _metrics.setdefault(scheme, Counter())
+        counts['authenticated' if authenticated else 'rejected'] += 1
+        counts['cpu_seconds'] += cpu_seconds
+
+
+def metrics():
+    """How often each scheme authenticated or rejected a request in this process, and its CPU time."""
+    with _metrics_lock:
+        snapshot = OrderedDict()
+        for scheme, counts in _metrics.items():
+            requests = counts['authenticated'] + counts['rejected']
+            snapshot[scheme] = OrderedDict([
+                ('authenticated', counts['authenticated']),
+                ('rejected', counts['rejected']),
+                ('cpu_seconds', round(counts['cpu_seconds'], 6)),
+                ('cpu_ms_per_request', round(counts['cpu_seconds'] * 1000 / requests, 3)),
+            ])
+        return snapshot
+
+
+def measured(scheme, authenticate, request):
+    """Call an authenticate() method, recording its outcome and CPU time under scheme."""
+    started = _cpu_time()
+    try:
+        result = authenticate(request)
+    except exceptions.APIException:
+        record(scheme, False, _cpu_time() - started)
+        raise
+    # None means the request didn't use this scheme
+    if result is not None:
+        record(scheme, True, _cpu_time() - started)
+    return result
+
+
+class MeasuredAuthentication:
+    """Records the requests an authentication class deals with in metrics()."""
+    scheme = None
+
+    def authenticate(self, request):
+        return measured(self.scheme, super().authenticate, request)
+
+
+class MeasuredBasicAuthentication(MeasuredAuthentication, authentication.BasicAuthentication):
+    scheme = 'basic'
+
+
+class MeasuredSessionAuthentication(MeasuredAuthentication, authentication.SessionAuthentication):
+    scheme = 'session'
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticates `Authorization: Bearer <token>` headers, with tokens from
+    issue_token().
+    """
+    scheme = 'signed_token'
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        return measured(self.scheme, self.authenticate_token, request)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+    def authenticate_token(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = header[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        return (token_user(token), token)
+
+
+class CachedTokenAuthentication(MeasuredAuthentication, authentication.TokenAuthentication):
+    """DRF's TokenAuthentication, looking up each token's user in the cache."""
+    scheme = 'token'
+
+    def authenticate_credentials(self, key):
+        token_key = TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+        user_id = cache.get(token_key)
+        if user_id is None:
+            user_id = self.get_model().objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            cache.set(token_key, user_id, user_cache_seconds())
+
+        user = cached_user(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return (user, self.get_model()(key=key, user=user))
@@ -0,0 +1,95 @@
+"""
+Maintains the stored availability state on Copy and Book.
+
+Copy.has_open_loan and Book.available_copies are denormalised from the Loan
+table so that listing books doesn't need a query per copy. The functions here
+recompute the state of just the rows touched by a change; the receivers in
+library.signals call them whenever a Loan or Copy is saved or deleted.
+Changes in a book's available copies are passed on to library.statistics.
+The updates set updated_at, as saving would, for library.sync.
+"""
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from library import statistics
+from library.models import Book, Copy, Loan
+
+
+def open_loans():
+    """Loans that have not been returned yet."""
+    return Loan.objects.filter(date_returned__isnull=True)
+
+
+def refresh_book(book_id):
+    """Recount the available copies of one book."""
+    with transaction.atomic():
+        # Lock the book row so concurrent recounts for the same book serialise
+        previous = (Book.objects.select_for_update()
+            .filter(pk=book_id)
+            .values_list('available_copies', flat=True)
+            .first())
+        if previous is None:
+            return
+        count = (Copy.objects
+            .filter(book_id=book_id, has_open_loan=False)
+            .exclude(condition__in=Copy.UNAVAILABLE_CONDITIONS)
+            .count())
+        if count != previous:
+            Book.objects.filter(pk=book_id).update(available_copies=count, updated_at=timezone.now())
+            statistics.adjust(available_copies=count - previous)
+
+
+def refresh_copy(copy_id):
+    """Recompute the open loan flag of one copy, and its book's count."""
+    with transaction.atomic():
+        book_id = Copy.objects.filter(pk=copy_id).values_list('book_id', flat=True).first()
+        if book_id is None:
+            # The copy has gone, e.g. its loans are being deleted in a cascade
+            return
+        has_open_loan = open_loans().filter(loaned_copy_id=copy_id).exists()
+        (Copy.objects
+            .filter(pk=copy_id)
+            .exclude(has_open_loan=has_open_loan)
+            .update(has_open_loan=has_open_loan, updated_at=timezone.now()))
+        refresh_book(book_id)
+
+
+def _rebuild(books):
+    """Rebuild the state of the given books and their copies, in a few set-based queries."""
+    # Only the copies whose flag is wrong, so the others keep their updated_at
+    copies = Copy.objects.filter(book__in=books)
+    lent = open_loans().values('loaned_copy')
+    (copies.filter(has_open_loan=False, pk__in=lent)
+        .update(has_open_loan=True, updated_at=timezone.now()))
+    (copies.filter(has_open_loan=True).exclude(pk__in=lent)
+        .update(has_open_loan=False, updated_at=timezone.now()))
+    available = (Copy.objects
+        .filter(book=OuterRef('pk'), has_open_loan=False)
+        .exclude(condition__in=Copy.UNAVAILABLE_CONDITIONS)
+        .order_by()
+        .values('book')
+        .annotate(count=Count('pk'))
+        .values('count'))
+    count = Coalesce(Subquery(available, output_field=IntegerField()), Value(0))
+    # Likewise only the books whose count is wrong
+    (books.exclude(available_copies=count)
+        .update(available_copies=count, updated_at=timezone.now()))
+
+
+def refresh_books(book_ids):
+    """Recompute the state of many books and their copies, e.g. after a bulk_create."""
+    with transaction.atomic():
+        books = Book.objects.filter(pk__in=list(book_ids))
+        previous = books.aggregate(total=Sum('available_copies'))['total'] or 0
+        _rebuild(books)
+        count = books.aggregate(total=Sum('available_copies'))['total'] or 0
+        statistics.adjust(available_copies=count - previous)
+
+
+def rebuild():
+    """Rebuild the availability state of every copy and book from the Loan table."""
+    with transaction.atomic():
+        _rebuild(Book.objects.all())
+        statistics.recompute()
@@ -0,0 +1,144 @@
+"""
+Performance benchmarks of every page and API endpoint in library.urls.
+
+measure() requests a URL with the test client and records its median wall
+time, number of queries and peak memory allocated by Python. compare()
+checks results against a baseline of budgets: the query count may not grow
+at all, while time and memory may exceed the baseline by a tolerance, as
+they vary from run to run. `manage.py benchmark` runs the whole suite on a
+freshly seeded test database.
+"""
+import re
+from statistics import median
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver
+
+from library import urls
+from library.models import Book, Category, Copy, Loan, UserMicrobit
+
+URL_PREFIX = '/library/'
+
+# The model of the objects named in URLs, by a word of the URL name
+SAMPLE_MODELS = {
+    'book': Book,
+    'copy': Copy,
+    'loan': Loan,
+    'user': User,
+    'usermicrobit': UserMicrobit,
+    'category': Category,
+    }
+
+# Namespaces of URLs not worth benchmarking (e.g. the API's log in and out)
+SKIPPED_NAMESPACES = ('rest_framework',)
+
+PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>|\(\?P<(\w+)>[^)]*\)')
+
+
+def url_patterns(patterns=None, prefix=''):
+    """(route, name) of every URL pattern, routes like 'book/{pk}/update/'."""
+    for pattern in urls.urlpatterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern).replace('^', '').replace('$', '')
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace not in SKIPPED_NAMESPACES:
+                yield from url_patterns(pattern.url_patterns, route)
+        else:
+            route = PARAMETER.sub(lambda match: '{' + (match.group(1) or match.group(2)) + '}', route)
+            # Skip the API's format suffix variants
+            if '{format}' not in route:
+                yield route.replace('\\', ''), pattern.name
+
+
+def sample_model(name):
+    for word in re.split('[-_]', name):
+        if word in SAMPLE_MODELS:
+            return SAMPLE_MODELS[word]
+    return None
+
+
+def sample_pk(model):
+    """The pk of a typical object to request: an open loan, a lent book, a reader."""
+    queryset = model.objects.order_by('pk')
+    if model is Loan:
+        queryset = queryset.filter(date_returned__isnull=True)
+    elif model is Book:
+        queryset = queryset.filter(copies__has_open_loan=True)
+    elif model is Copy:
+        queryset = queryset.filter(has_open_loan=True)
+    elif model is User:
+        queryset = queryset.filter(groups__name='Library user')
+    return queryset.values_list('pk', flat=True).first()
+
+
+def benchmark_urls():
+    """(route, name, path) of every URL to benchmark, with sample objects filled in."""
+    pks = {}
+    for route, name in url_patterns():
+        if '{' in route:
+            model = sample_model(name)
+            if model is None:
+                continue
+            if model not in pks:
+                pks[model] = sample_pk(model)
+            if pks[model] is None:
+                continue
+            path = route.format(pk=pks[model], user_pk=pks[model])
+        else:
+            path = route
+        yield route, name, URL_PREFIX + path
+
+
+def measure(client, path, repeat=5):
+    """Median time (ms), queries and peak memory (KiB) of GET requests for path."""
+    # Warm up, e.g. compiling templates and serializers the first time they're used
+    client.get(path)
+    times = []
+    for _ in range(repeat):
+        # Measure the uncached work
+        cache.clear()
+        start = time.perf_counter()
+        client.get(path)
+        times.append((time.perf_counter() - start) * 1000)
+
+    cache.clear()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'time_ms': round(median(times), 2),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+        }
+
+
+# Timings of a few milliseconds are noisy; allow them this much leeway as well
+TIME_SLACK_MS = 10
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.5):
+    """Messages describing each result over its budget in baseline."""
+    failures = []
+    for route, result in sorted(results.items()):
+        budget = baseline.get(route)
+        if budget is None:
+            continue
+        if result['queries'] > budget['queries']:
+            failures.append('{}: {} queries, budget {}'.format(
+                route, result['queries'], budget['queries']))
+        if result['time_ms'] > budget['time_ms'] * (1 + time_tolerance) + TIME_SLACK_MS:
+            failures.append('{}: {}ms, budget {}ms'.format(
+                route, result['time_ms'], budget['time_ms']))
+        if result['peak_kb'] > budget['peak_kb'] * (1 + memory_tolerance):
+            failures.append('{}: {}KiB, budget {}KiB'.format(
+                route, result['peak_kb'], budget['peak_kb']))
+    return failures
@@ -0,0 +1,177 @@
+"""
+Caching of API responses for the catalogue.
+
+Cached responses are keyed by version numbers kept in the cache: one for each
+kind of object (`'book'`) and one for each object (`'book:12'`). Lists of
+books are keyed by the `book` version, and each book's detail by its own
+version. The receivers in library.signals bump the versions whenever a book,
+or the copies, loans or category that its representation depends on, change,
+so cached responses are never served after the data behind them has changed;
+stale entries just age out of the cache. After bulk changes that skip signals,
+call `bump_books(book_ids)`.
+
+The catalogue pages cache each book's card and copy list as template
+fragments under the same per-book versions; see book_versions().
+
+A version that isn't in the cache, e.g. after a restart, starts from the
+current time, so it can't coincide with a version a stale response was
+stored under.
+"""
+from collections import OrderedDict
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from library.renderers import is_compact
+
+VERSION_KEY = 'library:version:{}'
+RESPONSE_KEY = 'library:response:{}'
+LOCK_KEY = 'library:response-lock:{}'
+
+DEFAULT_TIMEOUT = 300
+
+# How long one request may spend filling a cache entry while others wait for it
+LOCK_SECONDS = 10
+LOCK_POLL_SECONDS = 0.05
+
+
+def _initial_version():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """The current version of each scope, as a list."""
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout=None)
+
+
+def bump(*scopes):
+    """
+    Invalidate the responses cached under these scopes. The versions are
+    bumped straight away and again when the transaction commits, so a response
+    cached from the old data in between is also discarded.
+    """
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def bump_books(book_ids):
+    """Invalidate the cached responses of some books, and every list of books."""
+    bump('book', *('book:{}'.format(book_id) for book_id in book_ids if book_id is not None))
+
+
+def book_versions(book_ids):
+    """The current version of each of these books, as a dict by book id."""
+    book_ids = list(book_ids)
+    return dict(zip(book_ids, get_versions(*('book:{}'.format(book_id) for book_id in book_ids))))
+
+
+def fragment_timeout():
+    """How long {% cache %} template fragments are kept, in seconds."""
+    return getattr(settings, 'LIBRARY_FRAGMENT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def cached_data(key, compute, timeout):
+    """
+    The value cached under key, computing and caching it on a miss. Only one
+    caller at a time computes a missing value; the others wait for its result.
+    """
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    lock_key = LOCK_KEY.format(key)
+    deadline = time.time() + LOCK_SECONDS
+    while not cache.add(lock_key, 1, timeout=LOCK_SECONDS):
+        # Someone else is computing this value
+        time.sleep(LOCK_POLL_SECONDS)
+        data = cache.get(key)
+        if data is not None:
+            return data
+        if time.time() > deadline:
+            # They've probably failed; compute it ourselves
+            return compute()
+    try:
+        data = compute()
+        if data is not None:
+            cache.set(key, data, timeout)
+        return data
+    finally:
+        cache.delete(lock_key)
+
+
+def plain_data(data):
+    """
+    Serialized data as plain dicts, lists and strings. DRF's Hyperlink strings
+    hold on to their objects, which would be pickled into the cache.
+    """
+    if isinstance(data, dict):
+        return OrderedDict((key, plain_data(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+class CachedResponseMixin:
+    """
+    For ModelViewSets: serve list and retrieve responses from the cache.
+
+    The responses are cached under the versions of cache_scope (list) or
+    cache_scope:<pk> (retrieve). Permissions are checked before the cache is
+    read, so responses must be the same for every user allowed to see them.
+    Bump representation_version when the serializer's output changes.
+    """
+    cache_scope = None
+    representation_version = 1
+
+    def get_cache_timeout(self):
+        return getattr(settings, 'LIBRARY_API_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+    def cached_response(self, request, scope, view_method, *args, **kwargs):
+        version, = get_versions(scope)
+        # The compact representation can be asked for by an Accept header,
+        # so isn't always in the URL
+        key = RESPONSE_KEY.format(hashlib.md5('{}|{}|{}|{}|{}'.format(
+            self.representation_version, scope, version, request.build_absolute_uri(),
+            is_compact(request),
+            ).encode()).hexdigest())
+
+        responses = []
+
+        def compute():
+            response = view_method(request, *args, **kwargs)
+            responses.append(response)
+            # Don't cache errors
+            return plain_data(response.data) if response.status_code == 200 else None
+
+        data = cached_data(key, compute, self.get_cache_timeout())
+        if data is None:
+            return responses[-1]
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.cache_scope, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        scope = '{}:{}'.format(self.cache_scope, kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return self.cached_response(request, scope, super().retrieve, *args, **kwargs)
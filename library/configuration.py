@@ -0,0 +1,65 @@
+"""
+Cached access to the library's Configuration: its loan policies.
+
+The configuration is a single row that changes perhaps once a term, but it
+is needed by every issue and renewal. get() keeps it in each process for
+LIBRARY_CONFIGURATION_LOCAL_SECONDS (default 60) and in Django's cache for
+LIBRARY_CONFIGURATION_CACHE_SECONDS (default 60), so the hot paths seldom
+query for it. Saving the configuration, e.g. in the admin, clears both
+caches in the saving process (see library.signals); other processes notice
+when their own copies expire.
+
+The default cache (see CACHES in the settings) is local memory, which isn't
+shared between gunicorn's workers, so a change can take up to both timeouts
+to reach every worker. Don't make the cache timeout longer unless CACHES is
+a cache all the workers share, such as memcached.
+
+Rolling back a transaction doesn't clear the caches, so tests that change
+the configuration should call clear() when they finish.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from library.models import Configuration
+
+CACHE_KEY = 'library:configuration'
+DEFAULT_LOCAL_SECONDS = 60
+DEFAULT_CACHE_SECONDS = 60
+
+_local = {'configuration': None, 'expires': 0}
+
+
+def get():
+    """The Configuration, which is shared, so treat it as read-only."""
+    now = time.monotonic()
+    if _local['configuration'] is not None and now < _local['expires']:
+        return _local['configuration']
+
+    configuration = cache.get(CACHE_KEY)
+    if configuration is None:
+        # Without a stored configuration, the defaults apply and there is
+        # no limit on books on loan
+        configuration = (Configuration.objects.order_by('pk').first()
+            or Configuration(maxbooksonloan=None))
+        cache.set(CACHE_KEY, configuration, getattr(
+            settings, 'LIBRARY_CONFIGURATION_CACHE_SECONDS', DEFAULT_CACHE_SECONDS))
+    _local['configuration'] = configuration
+    _local['expires'] = now + getattr(
+        settings, 'LIBRARY_CONFIGURATION_LOCAL_SECONDS', DEFAULT_LOCAL_SECONDS)
+    return configuration
+
+
+def _clear():
+    _local['configuration'] = None
+    cache.delete(CACHE_KEY)
+
+
+def clear():
+    """Forget the cached configuration, now and when the current transaction commits."""
+    _clear()
+    # A request reading the configuration before the change commits would
+    # cache the old one again
+    transaction.on_commit(_clear)
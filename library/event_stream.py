@@ -0,0 +1,171 @@
+"""
+A server-sent event stream of the live events in library.events, for the
+micro:bit gateways and the librarian dashboard to hear about loans and copies
+as they change instead of polling the loan and copy lists.
+
+Served by the ASGI application in gcmk_library.asgi, at EVENTS_PATH:
+
+    GET /library/api/v1/events/?borrower=<user ID>&copy=<copy ID>
+    Authorization: Bearer <signed token from api/v1/tokens/>
+
+A browser's EventSource can't send headers, so the token may be given as
+?token= instead, or the stream read with the librarian's session cookie.
+Users who can view all loans get every event, filtered by borrower or copy
+if they ask; anyone else gets only the events of their own loans.
+
+Each event is sent as
+
+    id: 42
+    event: loan.returned
+    data: {"loan":"...","copy":3,"book":1,"borrower":7,...}
+
+and a comment line every LIBRARY_EVENTS_HEARTBEAT_SECONDS (default 15)
+keeps an idle connection open through proxies. A client that reconnects is
+sent the events it missed, from the Last-Event-ID header.
+"""
+from importlib import import_module
+from urllib.parse import parse_qs
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from rest_framework import exceptions
+
+from library import authentication, events
+
+EVENTS_PATH = '/library/api/v1/events/'
+DEFAULT_HEARTBEAT_SECONDS = 15
+# How long a client waits before reconnecting
+RETRY_MILLISECONDS = 5000
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'LIBRARY_EVENTS_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)
+
+
+def format_event(event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event.id, event.type, _encoder.encode(event.data)).encode()
+
+
+def _user(headers, query):
+    authorization = headers.get(b'authorization', b'').split()
+    if authorization and authorization[0].lower() == b'bearer':
+        if len(authorization) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        return authentication.token_user(authorization[1].decode('latin-1'))
+    if 'token' in query:
+        return authentication.token_user(query['token'])
+
+    session_key = parse_cookie(headers.get(b'cookie', b'').decode('latin-1')).get(
+        settings.SESSION_COOKIE_NAME)
+    if session_key:
+        request = HttpRequest()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        user = get_user(request)
+        if user.is_authenticated:
+            return user
+    raise exceptions.NotAuthenticated()
+
+
+def _id_parameter(query, name):
+    if name not in query:
+        return None
+    try:
+        return int(query[name])
+    except ValueError:
+        raise exceptions.ParseError('{} must be an ID.'.format(name))
+
+
+def subscription_filter(scope):
+    """The filter for the events the request in scope may and wants to see."""
+    close_old_connections()
+    try:
+        headers = dict(scope['headers'])
+        query = {name: values[-1] for name, values
+            in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        user = _user(headers, query)
+        borrower_id = _id_parameter(query, 'borrower')
+        copy_id = _id_parameter(query, 'copy')
+        if not user.has_perm('library.can_view_all_loans'):
+            if borrower_id not in (None, user.pk):
+                raise exceptions.PermissionDenied()
+            borrower_id = user.pk
+        return events.matcher(borrower_id=borrower_id, copy_id=copy_id)
+    finally:
+        close_old_connections()
+
+
+def _last_event_id(scope):
+    try:
+        return int(dict(scope['headers'])[b'last-event-id'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _send_error(send, error):
+    headers = [(b'content-type', b'application/json')]
+    if isinstance(error, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers.append((b'www-authenticate', b'Bearer'))
+    await send({'type': 'http.response.start', 'status': error.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': _encoder.encode({'detail': error.detail}).encode()})
+
+
+async def _disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(scope, receive, send):
+    """The ASGI application for EVENTS_PATH."""
+    if scope['method'] not in ('GET', 'HEAD'):
+        await _send_error(send, exceptions.MethodNotAllowed(scope['method']))
+        return
+    try:
+        matches = await sync_to_async(subscription_filter)(scope)
+    except exceptions.APIException as error:
+        await _send_error(send, error)
+        return
+
+    subscription = events.hub.subscribe(matches, _last_event_id(scope))
+    disconnected = asyncio.ensure_future(_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            # Stop nginx holding events back to fill its buffer
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'more_body': True,
+            'body': 'retry: {}\n\n'.format(RETRY_MILLISECONDS).encode()})
+        if subscription.missed:
+            await send({'type': 'http.response.body', 'more_body': True,
+                'body': b''.join(format_event(event) for event in subscription.missed)})
+        while True:
+            next_event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait([next_event, disconnected],
+                timeout=heartbeat_seconds(), return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_event.cancel()
+                return
+            if next_event in done:
+                event = next_event.result()
+                if event is None:
+                    # Too slow to keep up; the client reconnects and catches up
+                    break
+                body = format_event(event)
+            else:
+                next_event.cancel()
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        events.hub.unsubscribe(subscription)
+        disconnected.cancel()
@@ -0,0 +1,174 @@
+"""
+Live events about loans and copies, for the server-sent event stream in
+library.event_stream.
+
+The signal receivers, and the batch functions in library.loans that send no
+signals, publish an Event whenever a loan is lent, returned or renewed and
+whenever a copy's condition changes. Events are published when the
+transaction that made the change commits, to the in-process Hub, which hands
+each event to the subscribers whose filters match it. A subscriber is a
+queue on its stream's event loop, so an idle stream costs no queries and
+next to no CPU, however many there are.
+
+The hub only hears about changes made in its own process, so the site should
+be served entirely by gcmk_library.asgi in one process for the stream to
+see every change. The most recent events are kept, so a client reconnecting
+with the ID of the last event it saw misses none of them.
+"""
+from collections import OrderedDict, deque, namedtuple
+import asyncio
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+LOAN_CREATED = 'loan.created'
+LOAN_RETURNED = 'loan.returned'
+LOAN_RENEWED = 'loan.renewed'
+COPY_CONDITION = 'copy.condition'
+
+DEFAULT_HISTORY = 1000
+DEFAULT_QUEUE_SIZE = 100
+
+Event = namedtuple('Event', 'id type data')
+
+
+class Subscription:
+    """
+    The events for one stream: those it missed, to be sent straight away,
+    then the ones published since, queued on its event loop.
+    """
+
+    def __init__(self, matches, queue_size, missed=()):
+        self.matches = matches
+        self.missed = [event for event in missed if matches(event)]
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event):
+        """Queue an event; called on the subscription's event loop."""
+        if self.queue.full():
+            # A client too slow to keep up is disconnected, to reconnect
+            # and catch up from the hub's history
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = None
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        """The next event, or None if the client fell too far behind."""
+        return await self.queue.get()
+
+
+class Hub:
+    """Hands published events to the subscriptions they match, from any thread."""
+
+    def __init__(self, history=None, queue_size=None):
+        self.history = history or getattr(settings, 'LIBRARY_EVENTS_HISTORY', DEFAULT_HISTORY)
+        self.queue_size = queue_size or getattr(settings, 'LIBRARY_EVENTS_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=self.history)
+        self._subscriptions = set()
+
+    def publish(self, type, data):
+        with self._lock:
+            event = Event(next(self._ids), type, data)
+            self._recent.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                except RuntimeError:
+                    # Its event loop has closed
+                    self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self, matches, last_event_id=None):
+        """
+        A Subscription to the events matches() accepts, starting with the
+        recent ones after last_event_id. Call from the subscriber's event loop.
+
+        The missed events are kept apart, in subscription.missed, rather than
+        queued: there may be more of them than the queue holds.
+        """
+        with self._lock:
+            missed = [] if last_event_id is None else self._after(last_event_id)
+            subscription = Subscription(matches, self.queue_size, missed)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def _after(self, event_id):
+        return [event for event in self._recent if event.id > event_id]
+
+    def recent(self, after_id=0):
+        """The events kept from those published after the one with after_id."""
+        with self._lock:
+            return self._after(after_id)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+hub = Hub()
+
+
+def matcher(borrower_id=None, copy_id=None):
+    """A filter for subscribe(): with a borrower, only the events of their loans."""
+    def matches(event):
+        if copy_id is not None and event.data['copy'] != copy_id:
+            return False
+        if borrower_id is not None and event.data.get('borrower') != borrower_id:
+            return False
+        return True
+    return matches
+
+
+def publish_on_commit(type, data):
+    transaction.on_commit(lambda: hub.publish(type, data))
+
+
+def loan_event_type(loan, created, previous_date_returned, previous_return_due):
+    """The kind of event a loan being saved makes, if any."""
+    if loan.date_returned is None:
+        # Including a returned loan being opened again
+        if created or previous_date_returned is not None:
+            return LOAN_CREATED
+        if loan.return_due != previous_return_due:
+            return LOAN_RENEWED
+    elif not created and previous_date_returned is None:
+        return LOAN_RETURNED
+    return None
+
+
+def loan_data(loan, book_id):
+    return OrderedDict([
+        ('loan', str(loan.pk)),
+        ('copy', loan.loaned_copy_id),
+        ('book', book_id),
+        ('borrower', loan.borrower_id),
+        ('loan_start', loan.loan_start),
+        ('return_due', loan.return_due),
+        ('date_returned', loan.date_returned),
+    ])
+
+
+def loans_changed(type, loans):
+    """Publish an event of the given type for each of (loan, book_id) pairs."""
+    for loan, book_id in loans:
+        publish_on_commit(type, loan_data(loan, book_id))
+
+
+def copy_condition_changed(copy):
+    publish_on_commit(COPY_CONDITION, OrderedDict([
+        ('copy', copy.pk),
+        ('book', copy.book_id),
+        ('condition', copy.condition),
+    ]))
@@ -0,0 +1,117 @@
+"""
+Exports of the whole loan history and catalogue, as CSV or NDJSON.
+
+Rows are read with a database cursor a chunk at a time and written out as
+they come, so an export of millions of rows starts straight away and uses
+the same little memory however long it is. Each export reads just the
+columns it writes, joining the tables it needs, rather than loading model
+instances.
+
+Used by the api/v1/exports/ endpoints and `manage.py export_library`.
+"""
+from collections import OrderedDict, namedtuple
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from library.models import ArchivedLoan, Book, Copy, Loan
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_CHUNK_SIZE = 2000
+# Rows written out at a time
+LINES_PER_WRITE = 500
+
+Export = namedtuple('Export', 'querysets columns permissions')
+
+# Each export's rows are read from each of its querysets in turn, and its
+# columns are (heading, field lookup) pairs
+EXPORTS = OrderedDict([
+    ('loans', Export(
+        # Loans in no particular order: sorting them all would have to
+        # finish before the first row could be sent. Archived loans follow
+        # the rest (see library.archive).
+        querysets=lambda: (Loan.objects.order_by(), ArchivedLoan.objects.order_by()),
+        columns=(
+            ('id', 'id'),
+            ('loan_start', 'loan_start'),
+            ('return_due', 'return_due'),
+            ('date_returned', 'date_returned'),
+            ('copy_id', 'loaned_copy_id'),
+            ('copy_number', 'loaned_copy__copy_number'),
+            ('book_id', 'loaned_copy__book_id'),
+            ('title', 'loaned_copy__book__title'),
+            ('isbn', 'loaned_copy__book__isbn'),
+            ('borrower_id', 'borrower_id'),
+            ('borrower', 'borrower__username'),
+        ),
+        permissions=('library.can_view_all_loans',))),
+    ('books', Export(
+        querysets=lambda: (Book.objects.order_by('pk'),),
+        columns=(
+            ('id', 'id'),
+            ('title', 'title'),
+            ('author', 'author'),
+            ('edition', 'edition'),
+            ('isbn', 'isbn'),
+            ('publication_date', 'publication_date'),
+            ('category', 'category__category'),
+            ('available_copies', 'available_copies'),
+        ),
+        permissions=('library.view_book',))),
+    ('copies', Export(
+        querysets=lambda: (Copy.objects.order_by('pk'),),
+        columns=(
+            ('id', 'id'),
+            ('book_id', 'book_id'),
+            ('title', 'book__title'),
+            ('copy_number', 'copy_number'),
+            ('condition', 'condition'),
+            ('acquisition_date', 'acquisition_date'),
+            ('on_loan', 'has_open_loan'),
+            ('microbit_id', 'microbit_id'),
+        ),
+        permissions=('library.view_copy',))),
+])
+
+
+class _Line:
+    """A file-like object for csv.writer, handing back each line written."""
+
+    def write(self, line):
+        return line
+
+
+def rows(name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The rows of an export, as tuples in the order of its columns."""
+    export = EXPORTS[name]
+    lookups = [lookup for heading, lookup in export.columns]
+    for queryset in export.querysets():
+        yield from queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(name, chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.writer(_Line())
+    yield writer.writerow([heading for heading, lookup in EXPORTS[name].columns])
+    for row in rows(name, chunk_size):
+        yield writer.writerow(row)
+
+
+def ndjson_lines(name, chunk_size=DEFAULT_CHUNK_SIZE):
+    headings = [heading for heading, lookup in EXPORTS[name].columns]
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows(name, chunk_size):
+        yield encoder.encode(OrderedDict(zip(headings, row))) + '\n'
+
+
+def stream(name, format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """An export as text, a few hundred lines at a time."""
+    lines = (csv_lines if format == 'csv' else ndjson_lines)(name, chunk_size)
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= LINES_PER_WRITE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
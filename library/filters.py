@@ -0,0 +1,14 @@
+from rest_framework import filters
+
+from library.search import search_books
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on the Book API that uses the
+    full-text index in library.search, with results ranked by relevance.
+    Terms are split as for SearchFilter and must all match.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return search_books(queryset, self.get_search_terms(request))
@@ -1,25 +1,27 @@
-import datetime
-
 from django import forms
 from django.core.exceptions import ValidationError
-from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 
-from library.models import Copy
+from library import configuration, loans
+from library.models import Copy, Loan
+from library.widgets import LookupWidget
     
 class RenewLoanForm(forms.Form):
-    renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
+    renewal_date = forms.DateField()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.policies = configuration.get()
+        self.fields['renewal_date'].help_text = 'Enter a date between now and {} weeks (default {}).'.format(
+            self.policies.max_renewal_weeks, self.policies.default_loan_weeks)
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
         
-        # Check if a date is not in the past. 
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - renewal in past'))
-
-        # Check if a date is in the allowed range (+4 weeks from today).
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
+        # Check the date is neither in the past nor beyond the renewal window from today.
+        error = loans.renewal_date_error(data)
+        if error is not None:
+            raise ValidationError(error)
 
         # Remember to always return the cleaned data.
         return data
@@ -30,30 +32,42 @@ class ReturnLoanForm(forms.Form):
     def clean_return_date(self):
         data = self.cleaned_data['return_date']
         
-        # Check if a date is not in the past. 
-        if data > datetime.date.today():
-            raise ValidationError(_('Invalid date - return in future'))
+        # Check if a date is not in the future. 
+        error = loans.return_date_error(data)
+        if error is not None:
+            raise ValidationError(error)
 
         # Remember to always return the cleaned data.
         return data
 
 class IssueFindUserForm(forms.Form):
     selected_user = forms.ModelChoiceField(
-        queryset=User.objects.filter(groups__name='Library user').order_by('username')
+        queryset=User.objects.filter(groups__name='Library user').order_by('username'),
+        widget=LookupWidget('user_lookup'),
         )
 
-
-def get_copies():
-    copy_choices = [(c.pk, str(c)) for c in Copy.objects.all() if c.available]
-    return copy_choices
-    # for province in ProvinceCode.objects.filter(country_code_id=1).order_by('code'):
-    #     province_choices.append((province.code, province.code))
-    # return province_choices
-
 class IssueToUserForm(forms.Form):
-    selected_copy = forms.ChoiceField(choices=get_copies)
+    selected_copy = forms.ModelChoiceField(
+        queryset=Copy.objects.available().select_related('book'),
+        widget=LookupWidget('copy_lookup'),
+        )
     return_due = forms.DateField()
 
+class LoanForm(forms.ModelForm):
+    """Loan form for librarians, picking the copy and borrower by searching."""
+    class Meta:
+        model = Loan
+        fields = '__all__'
+        widgets = {
+            'loaned_copy': LookupWidget('copy_lookup'),
+            'borrower': LookupWidget('user_lookup'),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Label the current choices without a query per row
+        self.fields['loaned_copy'].queryset = Copy.objects.select_related('book')
+
 class BookSearchForm(forms.Form):
 
     q = forms.CharField(required=False)
@@ -63,6 +77,7 @@ class BookSearchForm(forms.Form):
         (2, "Author Z-A"), 
         (3, "Title A-Z"),
         (4, "Title Z-A"),
+        (5, "Relevance"),
         ]
     order = forms.ChoiceField(choices=order_choices, label='Sort order', 
         required=False, initial=3)
@@ -0,0 +1,170 @@
+"""
+Per-request SQL instrumentation and N+1 query detection.
+
+record_queries() records every query run on a connection, with its duration,
+a fingerprint (the SQL with its IN lists collapsed, as parameters are already
+separate) and the place that caused it: the template line or serializer field
+being rendered, or else the innermost line of the project's own code.
+
+A fingerprint repeated from the same place at least
+LIBRARY_NPLUSONE_THRESHOLD times is reported as an N+1 pattern: usually a
+loop lazily loading a related object per row, which select_related() or
+prefetch_related() would replace with one query.
+
+QueryInstrumentationMiddleware records each request, adds X-DB-* headers to
+the response and logs a summary to the `library.queries` logger. With
+LIBRARY_RAISE_ON_NPLUSONE set, e.g. in a test, it raises NPlusOneError
+instead of returning a response with an N+1 pattern.
+"""
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+import logging
+import os
+import re
+import sys
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.template.base import Node
+from rest_framework.fields import Field
+
+logger = logging.getLogger('library.queries')
+
+DEFAULT_NPLUSONE_THRESHOLD = 3
+
+RecordedQuery = namedtuple('RecordedQuery', 'sql fingerprint duration origin')
+NPlusOne = namedtuple('NPlusOne', 'fingerprint origin count')
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+WHITESPACE = re.compile(r'\s+')
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THIS_FILE = os.path.abspath(__file__)
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """The SQL with IN lists of any length made alike."""
+    return IN_LIST.sub('IN (...)', WHITESPACE.sub(' ', sql)).strip()
+
+
+def _is_project_code(filename):
+    filename = os.path.abspath(filename)
+    return (filename.startswith(PROJECT_DIR) and filename != THIS_FILE
+        and 'site-packages' not in filename)
+
+
+def query_origin():
+    """Where the query being run came from, as a short description."""
+    project_line = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        instance = frame.f_locals.get('self')
+        # type() rather than isinstance(), which would evaluate lazy objects
+        instance_type = type(instance)
+        if code.co_name == 'render_annotated' and issubclass(instance_type, Node):
+            # A template node; the innermost is the one being rendered
+            origin = getattr(instance, 'origin', None)
+            return '{}:{}'.format(
+                getattr(origin, 'template_name', None) or getattr(origin, 'name', '<template>'),
+                instance.token.lineno)
+        if issubclass(instance_type, Field) and code.co_name in ('to_representation', 'get_attribute'):
+            if instance.parent is not None and instance.field_name:
+                return '{}.{}'.format(type(instance.parent).__name__, instance.field_name)
+        if project_line is None and _is_project_code(code.co_filename):
+            project_line = '{}:{}'.format(
+                os.path.relpath(code.co_filename, PROJECT_DIR), frame.f_lineno)
+        frame = frame.f_back
+    return project_line or '<unknown>'
+
+
+class QueryRecorder:
+    """An execute wrapper recording the queries run through it."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        origin = query_origin()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(RecordedQuery(
+                sql, fingerprint(sql), time.perf_counter() - start, origin))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        """Total time in the database, in seconds."""
+        return sum(query.duration for query in self.queries)
+
+    def duplicates(self):
+        """Fingerprints run more than once, and how many times, most frequent first."""
+        counts = Counter(query.fingerprint for query in self.queries)
+        return OrderedDict((sql, count) for sql, count in counts.most_common() if count > 1)
+
+    def nplusones(self, threshold=None):
+        """The NPlusOne patterns: fingerprints repeated from the same origin."""
+        if threshold is None:
+            threshold = getattr(settings, 'LIBRARY_NPLUSONE_THRESHOLD', DEFAULT_NPLUSONE_THRESHOLD)
+        counts = Counter((query.fingerprint, query.origin) for query in self.queries)
+        return [NPlusOne(sql, origin, count)
+            for (sql, origin), count in counts.most_common() if count >= threshold]
+
+    def check(self, threshold=None):
+        """Raise NPlusOneError if there are any N+1 patterns."""
+        patterns = self.nplusones(threshold)
+        if patterns:
+            raise NPlusOneError('\n'.join(
+                '{} queries from {}: {}'.format(pattern.count, pattern.origin, pattern.fingerprint)
+                for pattern in patterns))
+
+
+@contextmanager
+def record_queries(using=DEFAULT_DB_ALIAS, raise_on_nplusone=False, threshold=None):
+    """
+    Record the queries run in the block. With raise_on_nplusone, raise
+    NPlusOneError at the end of the block if there were N+1 patterns.
+    """
+    recorder = QueryRecorder()
+    with connections[using].execute_wrapper(recorder):
+        yield recorder
+    if raise_on_nplusone:
+        recorder.check(threshold)
+
+
+class QueryInstrumentationMiddleware:
+    """Reports the queries of each request in X-DB-* headers and the library.queries log."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        duplicates = recorder.duplicates()
+        patterns = recorder.nplusones()
+        response['X-DB-Query-Count'] = str(recorder.count)
+        response['X-DB-Time-Ms'] = '{:.1f}'.format(recorder.time * 1000)
+        response['X-DB-Duplicate-Queries'] = str(sum(duplicates.values()) - len(duplicates))
+        response['X-DB-NPlusOne'] = str(len(patterns))
+
+        logger.info('%s %s: %d queries in %.1fms, %d N+1 patterns', request.method,
+            request.get_full_path(), recorder.count, recorder.time * 1000, len(patterns))
+        for pattern in patterns:
+            logger.warning('N+1 in %s %s: %d queries from %s: %s', request.method,
+                request.get_full_path(), pattern.count, pattern.origin, pattern.fingerprint)
+
+        if patterns and getattr(settings, 'LIBRARY_RAISE_ON_NPLUSONE', False):
+            recorder.check()
+        return response
@@ -0,0 +1,369 @@
+"""
+Issuing, returning, renewing and editing loans.
+
+The web views and the API make every change to a loan's state through these
+functions, which check the library's rules inside the transaction that makes
+the change. Issuing a copy locks the copy's row and then the borrower's
+(always in that order, so two issues can't deadlock), so that of two
+librarians issuing the same copy at once, or issuing to the same borrower,
+the second waits for the first and then sees its loan. The
+loan_one_open_per_copy constraint is the last line of defence.
+
+Rules that are broken raise a ValidationError keyed by the field at fault,
+as model validation does. The batch functions, for a stack of scanned
+copies, check them all in a few set-based queries and report on each copy
+separately, making the changes that can be made in one transaction.
+
+SQLite has no row locks and makes a writer that collides with another fail
+at once, and PostgreSQL can abort a transaction to break a deadlock, so each
+function retries a few times when the database reports contention, unless
+it is already part of a larger transaction that would have to be retried
+as a whole.
+"""
+import datetime
+from functools import wraps
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from library import availability, caching, configuration, events, statistics
+from library.models import Copy, Loan
+
+CONTENTION_ATTEMPTS = 10
+CONTENTION_BACKOFF_SECONDS = 0.005
+
+# PostgreSQL's serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+
+def _is_contention(error):
+    if getattr(error.__cause__, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    # SQLite's 'database is locked' and 'database table is locked'
+    return connection.vendor == 'sqlite' and 'locked' in str(error)
+
+
+def retry_on_contention(function):
+    """Retry function, which makes its own transaction, if the database reports contention."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, CONTENTION_ATTEMPTS + 1):
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as error:
+                if (attempt == CONTENTION_ATTEMPTS or connection.in_atomic_block
+                        or not _is_contention(error)):
+                    raise
+            time.sleep(random.uniform(0, CONTENTION_BACKOFF_SECONDS * 2 ** attempt))
+    return wrapper
+
+
+def max_books_on_loan():
+    """The most loans a borrower may have open, or None if there's no limit."""
+    return configuration.get().maxbooksonloan
+
+
+def renewal_date_error(return_due):
+    """Why a loan can't be renewed until return_due, or None if it can."""
+    today = datetime.date.today()
+    if return_due < today:
+        return _('Invalid date - renewal in past')
+    policies = configuration.get()
+    if return_due > today + policies.renewal_window:
+        return _('Invalid date - renewal more than {} weeks ahead').format(policies.max_renewal_weeks)
+    return None
+
+
+def return_date_error(date_returned, loan_start=None):
+    """Why a loan started on loan_start can't be returned on date_returned, or None if it can."""
+    if date_returned > datetime.date.today():
+        return _('Invalid date - return in future')
+    if loan_start is not None and date_returned < loan_start:
+        return _('Invalid date - return before the loan started')
+    return None
+
+
+@retry_on_contention
+def issue(loaned_copy, borrower, return_due, loan_start=None, **fields):
+    """Lend a copy to a borrower, returning the new Loan."""
+    with transaction.atomic():
+        copy = Copy.objects.select_for_update().filter(pk=loaned_copy.pk).first()
+        if copy is None:
+            raise ValidationError({'loaned_copy': 'This copy no longer exists.'})
+        if copy.condition in Copy.UNAVAILABLE_CONDITIONS:
+            raise ValidationError({'loaned_copy': 'This copy is {} and cannot be lent.'.format(
+                copy.get_condition_display().lower())})
+        if Loan.objects.filter(loaned_copy=copy, date_returned__isnull=True).exists():
+            raise ValidationError({'loaned_copy': 'This copy is already on loan.'})
+
+        if borrower is not None:
+            # Locking the borrower serialises their loans, so the count stays true
+            User.objects.select_for_update().filter(pk=borrower.pk).exists()
+            limit = max_books_on_loan()
+            open_loans = Loan.objects.filter(borrower=borrower, date_returned__isnull=True).count()
+            if limit is not None and open_loans >= limit:
+                raise ValidationError({'borrower': '{} already has {} books on loan, the most allowed.'
+                    .format(borrower, open_loans)})
+
+        loan = Loan(loaned_copy=copy, borrower=borrower, return_due=return_due,
+            loan_start=loan_start or datetime.date.today(), **fields)
+        try:
+            # In a savepoint, so the transaction survives a clash to report it
+            with transaction.atomic():
+                loan.save()
+        except IntegrityError:
+            raise ValidationError({'loaned_copy': 'This copy is already on loan.'})
+    return loan
+
+
+def _open_loan(loan):
+    """The loan's row, locked, checking it hasn't been returned already."""
+    locked = Loan.objects.select_for_update().filter(pk=loan.pk).first()
+    if locked is None:
+        raise ValidationError('This loan no longer exists.')
+    if locked.date_returned is not None:
+        raise ValidationError({'date_returned': 'This loan was returned on {}.'.format(
+            locked.date_returned)})
+    return locked
+
+
+@retry_on_contention
+def return_loan(loan, date_returned=None):
+    """
+    Mark a loan as returned, by default today, returning the updated Loan.
+    The date can't be in the future or before the loan started.
+    """
+    with transaction.atomic():
+        loan = _open_loan(loan)
+        date_returned = date_returned or datetime.date.today()
+        error = return_date_error(date_returned, loan.loan_start)
+        if error is not None:
+            raise ValidationError({'date_returned': error})
+        loan.date_returned = date_returned
+        loan.save()
+    return loan
+
+
+@retry_on_contention
+def renew(loan, return_due):
+    """Move an open loan's due date to return_due, returning the updated Loan."""
+    with transaction.atomic():
+        loan = _open_loan(loan)
+        loan.return_due = return_due
+        loan.save()
+    return loan
+
+
+@retry_on_contention
+def update(loan, **fields):
+    """
+    Change a loan as a librarian editing it does, returning the updated Loan.
+    Returning an open loan or moving its due date goes through return_loan()
+    or renew(). Which copy is lent to whom can't be changed, nor a returned
+    loan opened again: return the loan and issue() the copy instead, so the
+    rules are checked.
+    """
+    with transaction.atomic():
+        locked = Loan.objects.select_for_update().filter(pk=loan.pk).first()
+        if locked is None:
+            raise ValidationError('This loan no longer exists.')
+        for name in ('loaned_copy', 'borrower'):
+            value = fields.pop(name, None)
+            if value is not None and value.pk != getattr(locked, name + '_id'):
+                raise ValidationError({name: 'This can\'t be changed; return the loan and lend the copy again.'})
+        if 'date_returned' in fields and fields['date_returned'] is None and locked.date_returned is not None:
+            raise ValidationError({'date_returned': 'A returned loan can\'t be opened again; lend the copy again.'})
+
+        if locked.date_returned is None:
+            if fields.get('return_due', locked.return_due) != locked.return_due:
+                locked = renew(locked, fields.pop('return_due'))
+            if fields.get('date_returned') is not None:
+                locked = return_loan(locked, fields.pop('date_returned'))
+        changed = [name for name, value in fields.items() if getattr(locked, name) != value]
+        if changed:
+            for name in changed:
+                setattr(locked, name, fields[name])
+            locked.save()
+    return locked
+
+
+class ScannedItem:
+    """One copy scanned in a batch: what it was scanned as, and what became of it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.copy = None
+        self.loan = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _scanned_copies(copy_ids=None, microbit_ids=None, lock=False):
+    """A ScannedItem for each copy ID (or micro:bit ID) in order, with its copy found."""
+    field, keys = ('microbit_id', microbit_ids) if microbit_ids is not None else ('pk', copy_ids)
+    copies = Copy.objects.filter(**{field + '__in': keys}).order_by('pk')
+    if lock:
+        copies = copies.select_for_update()
+    found = {}
+    for copy in copies:
+        found.setdefault(getattr(copy, field), []).append(copy)
+
+    items, seen = [], set()
+    for key in keys:
+        item = ScannedItem(key)
+        matches = found.get(key, [])
+        if key in seen:
+            item.error = 'Scanned more than once.'
+        elif not matches:
+            item.error = 'No copy has this ID.'
+        elif len(matches) > 1:
+            item.error = 'More than one copy has this micro:bit.'
+        else:
+            item.copy = matches[0]
+        seen.add(key)
+        items.append(item)
+    return items
+
+
+def _open_loans_of(items, borrower=None):
+    """Lock and attach the open loan of each item's copy, checking it has one."""
+    copy_ids = [item.copy.pk for item in items if item.ok]
+    open_loans = {loan.loaned_copy_id: loan for loan in Loan.objects
+        .select_for_update()
+        .filter(loaned_copy__in=copy_ids, date_returned__isnull=True)}
+    for item in items:
+        if not item.ok:
+            continue
+        item.loan = open_loans.get(item.copy.pk)
+        if item.loan is None:
+            item.error = 'This copy is not on loan.'
+        elif borrower is not None and item.loan.borrower_id != borrower.pk:
+            item.error = 'This copy is on loan to someone else.'
+
+
+def _loans_changed(items, states_before, availability_changed, event_type):
+    """
+    Bring the stored state up to date after loans were changed in bulk,
+    which sends no signals: the statistics, the books' availability and
+    their cached API responses, and publish the loans' live events.
+    """
+    changed = [item for item in items if item.ok]
+    states_after = [statistics.loan_state(item.loan.date_returned, item.loan.return_due)
+        for item in changed]
+    statistics.loans_changed(states_before, states_after)
+    book_ids = {item.copy.book_id for item in changed}
+    if availability_changed:
+        availability.refresh_books(book_ids)
+    caching.bump_books(book_ids)
+    events.loans_changed(event_type, [(item.loan, item.copy.book_id) for item in changed])
+
+
+@retry_on_contention
+def issue_batch(borrower, return_due, copy_ids=None, microbit_ids=None, loan_start=None):
+    """
+    Lend the copies with the given IDs (or micro:bit IDs) to a borrower, in
+    one transaction. Returns a ScannedItem for each ID, with its new loan,
+    or the error that stopped it being lent; the other copies are still lent.
+    """
+    with transaction.atomic():
+        items = _scanned_copies(copy_ids, microbit_ids, lock=True)
+        on_loan = set(Loan.objects
+            .filter(loaned_copy__in=[item.copy.pk for item in items if item.ok],
+                date_returned__isnull=True)
+            .values_list('loaned_copy_id', flat=True))
+
+        User.objects.select_for_update().filter(pk=borrower.pk).exists()
+        limit = max_books_on_loan()
+        room = None
+        if limit is not None:
+            room = limit - Loan.objects.filter(borrower=borrower, date_returned__isnull=True).count()
+
+        new_loans = []
+        for item in items:
+            if not item.ok:
+                continue
+            if item.copy.condition in Copy.UNAVAILABLE_CONDITIONS:
+                item.error = 'This copy is {} and cannot be lent.'.format(
+                    item.copy.get_condition_display().lower())
+            elif item.copy.pk in on_loan:
+                item.error = 'This copy is already on loan.'
+            elif room is not None and len(new_loans) >= room:
+                item.error = '{} would have more than {} books on loan.'.format(borrower, limit)
+            else:
+                item.loan = Loan(loaned_copy=item.copy, borrower=borrower, return_due=return_due,
+                    loan_start=loan_start or datetime.date.today())
+                new_loans.append(item.loan)
+
+        if new_loans:
+            try:
+                with transaction.atomic():
+                    Loan.objects.bulk_create(new_loans)
+            except IntegrityError:
+                raise ValidationError('A copy was lent by someone else at the same time.')
+            _loans_changed(items, [None] * len(new_loans), availability_changed=True,
+                event_type=events.LOAN_CREATED)
+    return items
+
+
+@retry_on_contention
+def return_batch(date_returned=None, copy_ids=None, microbit_ids=None, borrower=None):
+    """
+    Mark the open loans of the copies with the given IDs (or micro:bit IDs)
+    as returned, by default today, in one transaction. With a borrower, only
+    their loans. Returns a ScannedItem for each ID; a loan can't be returned
+    before it started or in the future, as with ReturnLoanForm.
+    """
+    date_returned = date_returned or datetime.date.today()
+    with transaction.atomic():
+        items = _scanned_copies(copy_ids, microbit_ids)
+        _open_loans_of(items, borrower)
+        for item in items:
+            if item.ok:
+                item.error = return_date_error(date_returned, item.loan.loan_start)
+        returned = [item.loan for item in items if item.ok]
+        if returned:
+            states_before = [statistics.loan_state(loan.date_returned, loan.return_due)
+                for loan in returned]
+            Loan.objects.filter(pk__in=[loan.pk for loan in returned]).update(
+                date_returned=date_returned, updated_at=timezone.now())
+            for loan in returned:
+                loan.date_returned = date_returned
+            _loans_changed(items, states_before, availability_changed=True,
+                event_type=events.LOAN_RETURNED)
+    return items
+
+
+@retry_on_contention
+def renew_batch(return_due, copy_ids=None, microbit_ids=None, borrower=None):
+    """
+    Move the due date of the open loans of the copies with the given IDs (or
+    micro:bit IDs) to return_due, in one transaction. With a borrower, only
+    their loans. Returns a ScannedItem for each ID; return_due must be within
+    the renewal window, as with RenewLoanForm.
+    """
+    error = renewal_date_error(return_due)
+    with transaction.atomic():
+        items = _scanned_copies(copy_ids, microbit_ids)
+        _open_loans_of(items, borrower)
+        for item in items:
+            if item.ok:
+                item.error = error
+        renewed = [item.loan for item in items if item.ok]
+        if renewed:
+            states_before = [statistics.loan_state(loan.date_returned, loan.return_due)
+                for loan in renewed]
+            Loan.objects.filter(pk__in=[loan.pk for loan in renewed]).update(
+                return_due=return_due, updated_at=timezone.now())
+            for loan in renewed:
+                loan.return_due = return_due
+            _loans_changed(items, states_before, availability_changed=False,
+                event_type=events.LOAN_RENEWED)
+    return items
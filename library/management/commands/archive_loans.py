@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import archive
+
+
+class Command(BaseCommand):
+    help = """Moves loans returned long ago from the Loan table to the archive.
+
+Loans returned more than --older-than-days ago (by default the
+LIBRARY_ARCHIVE_LOANS_AFTER_DAYS setting, or 365) are moved to ArchivedLoan a
+batch at a time, each batch in its own transaction, so the command can be
+stopped and rerun safely. Lists of closed loans, on the librarians' pages and
+with ?closed=true in the API, include archived loans. Meant to be run nightly."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+            help='Archive loans returned more than this many days ago (default {}).'.format(
+                archive.archive_after_days()))
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE,
+            help='Loans moved in each transaction (default {}).'.format(
+                archive.DEFAULT_BATCH_SIZE))
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1.')
+        if options['older_than_days'] is None:
+            returned_before = archive.default_cutoff()
+        elif options['older_than_days'] < 0:
+            raise CommandError('The age must be at least 0 days.')
+        else:
+            returned_before = datetime.date.today() - datetime.timedelta(days=options['older_than_days'])
+
+        archived = 0
+        for moved in archive.archive_loans(returned_before, options['batch_size']):
+            archived += moved
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived {} loans'.format(archived))
+        self.stdout.write(self.style.SUCCESS(
+            'Archived {} loans returned before {}.'.format(archived, returned_before)))
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+    )
+
+from library import benchmark
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+# The library seeded for the benchmarks, unless the baseline says otherwise
+DEFAULT_LIBRARY = {'books': 1000, 'users': 200, 'loans': 5000, 'seed': 1}
+
+
+class Command(BaseCommand):
+    help = """Benchmarks every page and API endpoint against a stored baseline.
+
+Creates a test database, fills it with seed_library, and requests every URL
+in library.urls as a librarian, recording the median time, the number of
+queries and the peak memory of each. Fails if any URL makes more queries than
+its baseline, or takes more time or memory than the baseline plus a tolerance.
+The baseline also records the size of the seeded library, so later runs
+measure the same data."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+            help='The baseline file (default benchmarks/baseline.json).')
+        parser.add_argument('--update-baseline', action='store_true',
+            help='Store the results as the new baseline instead of comparing with it.')
+        parser.add_argument('--repeat', type=int, default=5,
+            help='Requests timed for each URL (default 5).')
+        parser.add_argument('--time-tolerance', type=float, default=0.5,
+            help='Fraction by which a time may exceed its baseline (default 0.5).')
+        parser.add_argument('--memory-tolerance', type=float, default=0.5,
+            help='Fraction by which peak memory may exceed its baseline (default 0.5).')
+        for name, value in DEFAULT_LIBRARY.items():
+            parser.add_argument('--{}'.format(name), type=int,
+                help='Passed to seed_library (default {}, or as in the baseline).'.format(value))
+
+    def handle(self, *args, **options):
+        baseline = None
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+        elif not options['update_baseline']:
+            raise CommandError('No baseline at {}; create one with --update-baseline.'.format(
+                options['baseline']))
+
+        library = dict(DEFAULT_LIBRARY, **(baseline or {}).get('library', {}))
+        library.update({name: options[name] for name in DEFAULT_LIBRARY if options[name] is not None})
+        if baseline and library != baseline.get('library') and not options['update_baseline']:
+            raise CommandError('The baseline was measured with a different library: {}'.format(
+                baseline.get('library')))
+
+        results = self.run_benchmarks(library, options['repeat'])
+
+        if options['update_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump({'library': library, 'results': results}, baseline_file,
+                    indent=2, sort_keys=True)
+                baseline_file.write('\n')
+            self.stdout.write(self.style.SUCCESS('Stored the baseline in {}.'.format(
+                options['baseline'])))
+            return
+
+        failures = benchmark.compare(results, baseline['results'],
+            options['time_tolerance'], options['memory_tolerance'])
+        for route in sorted(set(results) - set(baseline['results'])):
+            self.stdout.write(self.style.WARNING('{} has no baseline.'.format(route)))
+        if failures:
+            raise CommandError('Over budget:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All {} URLs within budget.'.format(len(results))))
+
+    def run_benchmarks(self, library, repeat):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # Expected 404s and 405s would otherwise be logged for every request
+        request_logger = logging.getLogger('django.request')
+        request_log_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            # Measure requests as they run in production, without the query instrumentation
+            with override_settings(
+                    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+                    MIDDLEWARE=[middleware for middleware in settings.MIDDLEWARE
+                        if middleware != 'library.instrumentation.QueryInstrumentationMiddleware']):
+                call_command('loaddata', 'config', verbosity=0)
+                call_command('seed_library', stdout=self.stdout, **library)
+                librarian = User.objects.create_superuser(
+                    username='benchmark', email='benchmark@example.com', password='benchmark')
+                client = Client()
+                client.force_login(librarian)
+
+                results = {}
+                self.stdout.write('{:<45} {:>6} {:>10} {:>8} {:>10}'.format(
+                    'URL', 'status', 'time (ms)', 'queries', 'peak (KiB)'))
+                for route, name, path in benchmark.benchmark_urls():
+                    result = benchmark.measure(client, path, repeat)
+                    results[route] = result
+                    self.stdout.write('{:<45} {status:>6} {time_ms:>10} {queries:>8} {peak_kb:>10}'
+                        .format(route or '(index)', **result))
+                return results
+        finally:
+            request_logger.setLevel(request_log_level)
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
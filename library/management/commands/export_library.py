@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library import export
+
+
+class Command(BaseCommand):
+    help = """Writes all the loans, books or copies as CSV or NDJSON.
+
+Rows are read a chunk at a time and written as they come, so even the whole
+loan history is exported in constant memory. The same exports can be
+downloaded from the API, at /library/api/v1/exports/<export>/."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(export.EXPORTS),
+            help='What to export.')
+        parser.add_argument('--format', choices=export.FORMATS, default='csv',
+            help='CSV (the default) or NDJSON, one JSON object per line.')
+        parser.add_argument('--output', '-o',
+            help='The file to write to (default standard output).')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE,
+            help='Rows read from the database at a time (default {}).'.format(
+                export.DEFAULT_CHUNK_SIZE))
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be at least 1.')
+        chunks = export.stream(options['export'], options['format'], options['chunk_size'])
+        if options['output']:
+            # newline='' as the CSV writer ends its own lines
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
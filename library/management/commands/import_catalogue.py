@@ -0,0 +1,238 @@
+import csv
+import datetime
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.dateparse import parse_date
+
+from library import availability, caching, search, statistics
+from library.models import Book, Category, Copy
+
+
+class Command(BaseCommand):
+    help = """Imports books, copies and categories from a CSV or NDJSON file.
+
+Each record describes one book, with the fields title, author, isbn and
+publication_date (YYYY-MM-DD), and optionally edition, category, image,
+thumbnail, copies (how many copies the library holds, default 1), condition
+(of new copies, default G) and acquisition_date (of new copies, default today).
+
+Books are matched by ISBN, so importing a record for a book that already
+exists only adds any copies it's short of, and categories are matched by name.
+The file is read a chunk of records at a time, each chunk imported in its own
+transaction, and progress is saved to a checkpoint file after every chunk;
+rerunning the same import carries on from the checkpoint."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The CSV or NDJSON file to import.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+            help='The file format. By default, guessed from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='Records imported in each transaction (default 500).')
+        parser.add_argument('--checkpoint',
+            help='The checkpoint file (default: the import file with .checkpoint added).')
+        parser.add_argument('--restart', action='store_true',
+            help='Ignore any checkpoint and import from the start of the file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or self.guess_format(path)
+        chunk_size = options['chunk_size']
+        checkpoint_path = options['checkpoint'] or path + '.checkpoint'
+        if chunk_size < 1:
+            raise CommandError('The chunk size must be at least 1.')
+
+        start = 0 if options['restart'] else self.read_checkpoint(checkpoint_path)
+        if start:
+            self.stdout.write('Resuming after record {}.'.format(start))
+
+        self.category_ids = {}
+        self.totals = {'records': 0, 'books': 0, 'copies': 0, 'errors': 0}
+        started_at = time.time()
+        position = start
+        with open(path, newline='', encoding='utf-8') as source:
+            chunk = []
+            for number, record in enumerate(self.read_records(source, file_format), start=1):
+                if number <= start:
+                    continue
+                chunk.append((number, record))
+                if len(chunk) == chunk_size:
+                    position = self.import_chunk(chunk)
+                    self.write_checkpoint(checkpoint_path, position)
+                    self.report_progress(position - start, started_at)
+                    chunk = []
+            if chunk:
+                position = self.import_chunk(chunk)
+                self.write_checkpoint(checkpoint_path, position)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = max(time.time() - started_at, 0.001)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {records} records: {books} new books, {copies} new copies, '
+            '{errors} records skipped'.format(**self.totals) +
+            ' in {:.1f}s ({:.0f} records/s).'.format(elapsed, self.totals['records'] / elapsed)))
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.ndjson', '.jsonl'):
+            return 'ndjson'
+        raise CommandError("Can't tell the format of {}; use --format.".format(path))
+
+    def read_records(self, source, file_format):
+        """Yield each record in the file as a dict, without reading it all in."""
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Reported as a skipped record by clean_record()
+                        yield None
+
+    def read_checkpoint(self, checkpoint_path):
+        if not os.path.exists(checkpoint_path):
+            return 0
+        with open(checkpoint_path) as checkpoint:
+            return json.load(checkpoint)['records']
+
+    def write_checkpoint(self, checkpoint_path, position):
+        # Write then rename, so a crash can't leave a half-written checkpoint
+        with open(checkpoint_path + '.tmp', 'w') as checkpoint:
+            json.dump({'records': position}, checkpoint)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def report_progress(self, records, started_at):
+        elapsed = max(time.time() - started_at, 0.001)
+        self.stdout.write('{} records, {:.0f} records/s'.format(records, records / elapsed))
+
+    def clean_record(self, number, record):
+        """The record's values converted for the database, or None if it's invalid."""
+        try:
+            if not isinstance(record, dict):
+                raise ValueError('not a JSON object')
+            values = {key: (str(value).strip() if value is not None else '')
+                for key, value in record.items() if key}
+            for required in ('title', 'author', 'isbn', 'publication_date'):
+                if not values.get(required):
+                    raise ValueError('no {}'.format(required))
+            condition = values.get('condition') or 'G'
+            if condition not in dict(Copy.COPY_CONDITIONS):
+                raise ValueError('unknown condition {}'.format(condition))
+            publication_date = parse_date(values['publication_date'])
+            acquisition_date = (parse_date(values['acquisition_date'])
+                if values.get('acquisition_date') else datetime.date.today())
+            if publication_date is None or acquisition_date is None:
+                raise ValueError('dates must be YYYY-MM-DD')
+            return {
+                'title': values['title'][:200],
+                'author': values['author'][:200],
+                'isbn': values['isbn'][:17],
+                'publication_date': publication_date,
+                'edition': int(values['edition']) if values.get('edition') else None,
+                'image': values.get('image') or None,
+                'thumbnail': values.get('thumbnail') or None,
+                'category': values.get('category', '')[:20],
+                'copies': int(values['copies']) if values.get('copies') else 1,
+                'condition': condition,
+                'acquisition_date': acquisition_date,
+                }
+        except ValueError as error:
+            self.stderr.write('Skipping record {}: {}'.format(number, error))
+            self.totals['errors'] += 1
+            return None
+
+    def import_chunk(self, chunk):
+        """Import (number, record) pairs in one transaction. Returns the last record number."""
+        rows = [row for row in (self.clean_record(number, record) for number, record in chunk) if row]
+        # The first record for each ISBN wins
+        by_isbn = {}
+        for row in rows:
+            by_isbn.setdefault(row['isbn'], row)
+
+        with transaction.atomic():
+            self.import_categories({row['category'] for row in by_isbn.values() if row['category']})
+            book_ids = self.import_books(by_isbn)
+            self.import_copies(by_isbn, book_ids)
+
+            # bulk_create skips the receivers in library.signals, so bring the
+            # availability state, search index and API cache up to date in bulk
+            availability.refresh_books(book_ids.values())
+            search.get_backend().index_books(book_ids.values())
+            caching.bump_books(book_ids.values())
+
+        self.totals['records'] += len(chunk)
+        return chunk[-1][0]
+
+    def import_categories(self, names):
+        missing = names - set(self.category_ids)
+        if not missing:
+            return
+        existing = Category.objects.filter(category__in=missing).values_list('category', 'id')
+        self.category_ids.update(existing)
+        new = missing - set(self.category_ids)
+        if new:
+            Category.objects.bulk_create([Category(category=name) for name in new])
+            caching.bump('category')
+            self.category_ids.update(
+                Category.objects.filter(category__in=new).values_list('category', 'id'))
+
+    def import_books(self, by_isbn):
+        """Create the books that don't exist yet. Returns the book id of every ISBN."""
+        book_ids = dict(Book.objects
+            .filter(isbn__in=list(by_isbn))
+            .order_by('id')
+            .values_list('isbn', 'id'))
+        new_books = [
+            Book(
+                title=row['title'],
+                author=row['author'],
+                isbn=isbn,
+                publication_date=row['publication_date'],
+                edition=row['edition'],
+                image=row['image'],
+                thumbnail=row['thumbnail'],
+                category_id=self.category_ids.get(row['category']),
+            )
+            for isbn, row in by_isbn.items() if isbn not in book_ids]
+        if new_books:
+            Book.objects.bulk_create(new_books)
+            # Not every database returns the new ids from bulk_create
+            book_ids.update(Book.objects
+                .filter(isbn__in=[book.isbn for book in new_books])
+                .values_list('isbn', 'id'))
+            statistics.adjust(total_books=len(new_books))
+            self.totals['books'] += len(new_books)
+        return book_ids
+
+    def import_copies(self, by_isbn, book_ids):
+        """Create copies for books with fewer copies than their record says."""
+        existing = {row['book']: row for row in (Copy.objects
+            .filter(book_id__in=list(book_ids.values()))
+            .order_by()
+            .values('book')
+            .annotate(count=Count('id'), last_number=Max('copy_number')))}
+        new_copies = []
+        for isbn, row in by_isbn.items():
+            book_id = book_ids[isbn]
+            held = existing.get(book_id, {'count': 0, 'last_number': 0})
+            for offset in range(1, row['copies'] - held['count'] + 1):
+                new_copies.append(Copy(
+                    book_id=book_id,
+                    acquisition_date=row['acquisition_date'],
+                    copy_number=(held['last_number'] or 0) + offset,
+                    condition=row['condition'],
+                ))
+        Copy.objects.bulk_create(new_copies)
+        statistics.adjust(circulating_copies=sum(
+            statistics.is_circulating(copy.condition) for copy in new_copies))
+        self.totals['copies'] += len(new_copies)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from library import sync
+
+
+class Command(BaseCommand):
+    help = """Deletes the records of deleted rows kept for syncing clients.
+
+Tombstones older than the LIBRARY_SYNC_TOMBSTONE_DAYS setting (default 90)
+are deleted; a client that hasn't synced for that long is sent everything
+again instead. Meant to be run nightly."""
+
+    def handle(self, *args, **options):
+        pruned = sync.prune_tombstones()
+        self.stdout.write(self.style.SUCCESS('Pruned {} tombstones.'.format(pruned)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from library import availability
+from library.models import Book, Copy
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored availability of every copy and book from the Loan table.'
+
+    def handle(self, *args, **options):
+        availability.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt availability for {} copies of {} books.'.format(
+                Copy.objects.count(), Book.objects.count())))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from library import search
+from library.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of the book catalogue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+            help='The database to rebuild the index in.')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend(options['database'])
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Indexed {} books with {}.'.format(
+            Book.objects.using(options['database']).count(), type(backend).__name__)))
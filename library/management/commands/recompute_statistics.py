@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from library import statistics
+from library.models import LibraryStatistics
+
+
+class Command(BaseCommand):
+    help = ('Recounts the home page statistics from scratch, reporting any '
+        'that had drifted from the incrementally maintained values.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+            help="Only report differences; don't store the recounted values.")
+
+    def handle(self, *args, **options):
+        stored = LibraryStatistics.objects.filter(pk=statistics.STATISTICS_ID).first()
+        counted = statistics.counted_statistics()
+
+        differences = 0
+        for name, value in counted.items():
+            if name == 'overdue_counted_on':
+                continue
+            stored_value = getattr(stored, name, None)
+            if stored_value != value:
+                differences += 1
+                self.stdout.write('{}: stored {}, counted {}'.format(name, stored_value, value))
+
+        if not options['check']:
+            statistics.recompute()
+        if differences:
+            self.stdout.write(self.style.WARNING('{} statistics differed.'.format(differences)))
+        else:
+            self.stdout.write(self.style.SUCCESS('All statistics matched.'))
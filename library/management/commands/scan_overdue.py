@@ -0,0 +1,132 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Case, CharField, Exists, OuterRef, Q, Value, When
+from django.template.loader import get_template
+
+from library.models import Loan, LoanReminder
+
+
+class Command(BaseCommand):
+    help = """Emails borrowers about their overdue loans and loans due soon.
+
+Open loans due within --due-soon-days, or already overdue, are read a batch
+at a time in borrower order, so each borrower gets one digest email listing
+all their loans that need a reminder. Every reminder sent is recorded, and a
+loan only gets one due-soon and one overdue reminder for each due date, so
+the scan can be rerun safely; renewing a loan makes it due for reminders
+again. Meant to be run nightly."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--due-soon-days', type=int, default=3,
+            help='Remind borrowers of loans due within this many days (default 3).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Loans read in each query (default 1000).')
+        parser.add_argument('--dry-run', action='store_true',
+            help="Report the digests that would be sent, but don't send or record them.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1.')
+        self.today = datetime.date.today()
+        self.dry_run = options['dry_run']
+        self.totals = {'digests': 0, 'reminders': 0, 'skipped': 0}
+        started_at = time.time()
+
+        self.subject_template = get_template('library/email/reminder_digest_subject.txt')
+        self.body_template = get_template('library/email/reminder_digest.txt')
+
+        loans = self.loans_to_remind(options['due_soon_days'])
+        batch_size = options['batch_size']
+        borrower_loans = []
+        position = None
+        while True:
+            batch = loans
+            if position is not None:
+                batch = batch.filter(self.after(position))
+            batch = list(batch[:batch_size])
+            digests = []
+            for loan in batch:
+                # Loans come in borrower order, so a borrower's loans are
+                # all together, though they may span batches
+                if borrower_loans and loan['borrower'] != borrower_loans[0]['borrower']:
+                    digests.append(borrower_loans)
+                    borrower_loans = []
+                borrower_loans.append(loan)
+            if len(batch) < batch_size and borrower_loans:
+                digests.append(borrower_loans)
+            self.send_digests(digests)
+            if len(batch) < batch_size:
+                break
+            position = batch[-1]
+
+        elapsed = time.time() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            '{verb} {digests} digests covering {reminders} loans; skipped {skipped} '
+            'borrowers without an email address'.format(
+                verb='Would send' if self.dry_run else 'Sent', **self.totals) +
+            ' in {:.1f}s.'.format(elapsed)))
+
+    def loans_to_remind(self, due_soon_days):
+        """
+        Open loans due a reminder, in borrower order, as dicts with the
+        reminder_kind and what the digest needs of the borrower and book.
+        """
+        already_sent = LoanReminder.objects.filter(
+            loan=OuterRef('pk'), kind=OuterRef('reminder_kind'), return_due=OuterRef('return_due'))
+        return (Loan.objects
+            .filter(date_returned__isnull=True, borrower__isnull=False,
+                return_due__lte=self.today + datetime.timedelta(days=due_soon_days))
+            .annotate(reminder_kind=Case(
+                When(return_due__lt=self.today, then=Value(LoanReminder.OVERDUE)),
+                default=Value(LoanReminder.DUE_SOON),
+                output_field=CharField()))
+            .annotate(already_sent=Exists(already_sent))
+            .filter(already_sent=False)
+            # The order of the loan_open_borrower_idx index
+            .order_by('borrower', 'return_due', 'id')
+            .values('id', 'borrower', 'return_due', 'reminder_kind',
+                'borrower__username', 'borrower__first_name', 'borrower__email',
+                'loaned_copy__copy_number', 'loaned_copy__book__title'))
+
+    def after(self, loan):
+        """Q selecting the loans after loan in the borrower, return_due, id order."""
+        return (Q(borrower__gt=loan['borrower'])
+            | Q(borrower=loan['borrower'], return_due__gt=loan['return_due'])
+            | Q(borrower=loan['borrower'], return_due=loan['return_due'], id__gt=loan['id']))
+
+    def send_digests(self, digests):
+        """Email a digest of each borrower's loans, and record the reminders sent."""
+        messages, reminders = [], []
+        for loans in digests:
+            email = loans[0]['borrower__email']
+            if not email:
+                self.totals['skipped'] += 1
+                continue
+            messages.append(self.digest_message(email, loans))
+            reminders.extend(LoanReminder(loan_id=loan['id'], kind=loan['reminder_kind'],
+                return_due=loan['return_due'], sent_on=self.today) for loan in loans)
+            self.totals['digests'] += 1
+            self.totals['reminders'] += len(loans)
+            if self.dry_run:
+                self.stdout.write('{}: {} loans'.format(email, len(loans)))
+        if self.dry_run or not messages:
+            return
+        get_connection().send_messages(messages)
+        LoanReminder.objects.bulk_create(reminders)
+
+    def digest_message(self, email, loans):
+        context = {
+            'name': loans[0]['borrower__first_name'] or loans[0]['borrower__username'],
+            'overdue': [loan for loan in loans if loan['reminder_kind'] == LoanReminder.OVERDUE],
+            'due_soon': [loan for loan in loans if loan['reminder_kind'] == LoanReminder.DUE_SOON],
+            'today': self.today,
+            }
+        return EmailMessage(
+            subject=' '.join(self.subject_template.render(context).split()),
+            body=self.body_template.render(context),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[email])
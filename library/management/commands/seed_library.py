@@ -0,0 +1,194 @@
+import datetime
+import itertools
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from library import availability, caching, configuration, search
+from library.models import Book, Category, Copy, Loan, UserMicrobit
+
+CATEGORIES = ('Fiction', 'Programming', 'Science', 'History', 'Poetry', 'Biography',
+    'Art', 'Travel', 'Cookery', 'Sport', 'Music', 'Reference')
+TITLE_WORDS = ('Python', 'Django', 'Garden', 'River', 'Journey', 'Secret', 'Code',
+    'Stars', 'Winter', 'Kingdom', 'Data', 'Ocean', 'Machine', 'Silent', 'Mountain',
+    'Recipe', 'History', 'Light', 'Shadow', 'Music', 'Bridge', 'Engine', 'Island')
+FIRST_NAMES = ('Ada', 'Grace', 'Alan', 'Mary', 'Tim', 'Hedy', 'Katherine', 'Dennis',
+    'Margaret', 'Radia', 'Barbara', 'Linus', 'Frances', 'Ken', 'Sophie', 'Joan')
+SURNAMES = ('Lovelace', 'Hopper', 'Turing', 'Somerville', 'Berners-Lee', 'Lamarr',
+    'Johnson', 'Ritchie', 'Hamilton', 'Perlman', 'Liskov', 'Torvalds', 'Allen',
+    'Thompson', 'Wilson', 'Clarke')
+
+# Relative frequencies of the number of copies of a book, and of copy conditions
+COPY_COUNT_WEIGHTS = {1: 50, 2: 25, 3: 12, 4: 8, 5: 5}
+CONDITION_WEIGHTS = {'M': 20, 'G': 50, 'W': 20, 'D': 6, 'L': 3, 'X': 1}
+
+LOAN_WEEKS = 3
+PASSWORD = 'seeded-password'
+
+
+class Command(BaseCommand):
+    help = """Fills the library with a synthetic catalogue, readers and loan history.
+
+The same --seed always generates the same library. Book popularity, category
+sizes and reader activity follow long-tailed distributions, so a few books
+and readers account for most of the loans, as in a real library. Every
+reader's password is "{}".""".format(PASSWORD)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000,
+            help='Number of books to create (default 1000).')
+        parser.add_argument('--users', type=int, default=200,
+            help='Number of library users to create (default 200).')
+        parser.add_argument('--loans', type=int, default=5000,
+            help='Number of loans to create, open and returned (default 5000).')
+        parser.add_argument('--open-fraction', type=float, default=0.1,
+            help='Fraction of the borrowed copies still on loan (default 0.1).')
+        parser.add_argument('--seed', type=int, default=1,
+            help='Random seed (default 1).')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.today = datetime.date.today()
+        with transaction.atomic():
+            categories = self.create_categories()
+            users = self.create_users(options['users'])
+            books = self.create_books(options['books'], categories)
+            copies = self.create_copies(books)
+            loans = self.create_loans(copies, users, options['loans'], options['open_fraction'])
+
+            # bulk_create skips the receivers in library.signals
+            availability.rebuild()
+            search.get_backend().rebuild()
+            caching.bump('book', 'category')
+
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} books, {} copies, {} users and {} loans.'.format(
+                len(books), len(copies), len(users), loans)))
+
+    def long_tail_weights(self, count, exponent=1.0):
+        """
+        Cumulative Zipf-like weights, for random.choices(): the item ranked n is
+        1/n**exponent as likely as the first, and the ranks are shuffled.
+        """
+        weights = [1 / (rank ** exponent) for rank in range(1, count + 1)]
+        self.random.shuffle(weights)
+        return list(itertools.accumulate(weights))
+
+    def choose(self, weights_by_value):
+        return self.random.choices(list(weights_by_value), list(weights_by_value.values()))[0]
+
+    def random_date(self, start, end):
+        return start + datetime.timedelta(days=self.random.randint(0, (end - start).days))
+
+    def new_ids(self, model, last_id):
+        return list(model.objects.filter(pk__gt=last_id or 0).order_by('pk').values_list('pk', flat=True))
+
+    def create_categories(self):
+        existing = set(Category.objects.filter(category__in=CATEGORIES).values_list('category', flat=True))
+        Category.objects.bulk_create(
+            [Category(category=name) for name in CATEGORIES if name not in existing])
+        return list(Category.objects.filter(category__in=CATEGORIES).order_by('category'))
+
+    def create_users(self, count):
+        first = User.objects.filter(username__startswith='reader').count()
+        last_id = User.objects.aggregate(last=Max('pk'))['last']
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username='reader{:05d}'.format(number),
+                first_name=self.random.choice(FIRST_NAMES),
+                last_name=self.random.choice(SURNAMES),
+                password=password)
+            for number in range(first + 1, first + count + 1)], batch_size=500)
+        user_ids = self.new_ids(User, last_id)
+
+        UserMicrobit.objects.bulk_create(
+            [UserMicrobit(user_id=user_id) for user_id in user_ids], batch_size=500)
+        library_user = Group.objects.get(name='Library user')
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=user_id, group=library_user) for user_id in user_ids],
+            batch_size=500)
+        return user_ids
+
+    def create_books(self, count, categories):
+        last_id = Book.objects.aggregate(last=Max('pk'))['last']
+        category_weights = self.long_tail_weights(len(categories))
+        books = []
+        for _ in range(count):
+            words = self.random.sample(TITLE_WORDS, self.random.choice((1, 2, 2, 3)))
+            books.append(Book(
+                title=' '.join(['The'] + words if self.random.random() < 0.3 else words),
+                author='{} {}'.format(self.random.choice(FIRST_NAMES), self.random.choice(SURNAMES)),
+                edition=self.choose({1: 80, 2: 12, 3: 5, 4: 3}),
+                isbn='978{:010d}'.format(self.random.randrange(10 ** 10)),
+                # Most books are recent
+                publication_date=self.today - datetime.timedelta(
+                    days=min(int(self.random.expovariate(1 / 3000)), 30000)),
+                category=self.random.choices(categories, cum_weights=category_weights)[0],
+                ))
+        Book.objects.bulk_create(books, batch_size=500)
+        return self.new_ids(Book, last_id)
+
+    def create_copies(self, book_ids):
+        """(copy id, condition) pairs of the new copies."""
+        last_id = Copy.objects.aggregate(last=Max('pk'))['last']
+        copies = []
+        for book_id in book_ids:
+            for copy_number in range(1, self.choose(COPY_COUNT_WEIGHTS) + 1):
+                copies.append(Copy(
+                    book_id=book_id,
+                    copy_number=copy_number,
+                    acquisition_date=self.random_date(
+                        self.today - datetime.timedelta(days=3650), self.today),
+                    condition=self.choose(CONDITION_WEIGHTS),
+                    ))
+        Copy.objects.bulk_create(copies, batch_size=500)
+        return list(Copy.objects.filter(pk__gt=last_id or 0).order_by('pk').values_list('pk', 'condition'))
+
+    def create_loans(self, copies, user_ids, count, open_fraction):
+        """Lay out each copy's loans back from today, the latest possibly still open."""
+        if count and not (copies and user_ids):
+            raise CommandError('Loans need some copies and users.')
+        max_open = configuration.get().maxbooksonloan or 4
+        popularity = self.long_tail_weights(len(copies), exponent=0.8)
+        activity = self.long_tail_weights(len(user_ids), exponent=0.7)
+
+        loans_per_copy = {}
+        for index in self.random.choices(range(len(copies)), cum_weights=popularity, k=count):
+            loans_per_copy[index] = loans_per_copy.get(index, 0) + 1
+
+        open_loans_per_user = {}
+        loans = []
+        for index, loan_count in loans_per_copy.items():
+            copy_id, condition = copies[index]
+            end = self.today
+            for position in range(loan_count):
+                borrower = self.random.choices(user_ids, cum_weights=activity)[0]
+                keep_open = (position == 0 and condition not in Copy.UNAVAILABLE_CONDITIONS
+                    and open_loans_per_user.get(borrower, 0) < max_open
+                    and self.random.random() < open_fraction)
+                if keep_open:
+                    # About a fifth of open loans are overdue
+                    overdue = self.random.random() < 0.2
+                    loan_start = end - datetime.timedelta(
+                        days=self.random.randint(LOAN_WEEKS * 7 + 1, 60) if overdue
+                        else self.random.randint(0, LOAN_WEEKS * 7 - 1))
+                    date_returned = None
+                    open_loans_per_user[borrower] = open_loans_per_user.get(borrower, 0) + 1
+                else:
+                    date_returned = end - datetime.timedelta(days=self.random.randint(0, 30))
+                    loan_start = date_returned - datetime.timedelta(days=self.random.randint(1, 35))
+                loans.append(Loan(
+                    loaned_copy_id=copy_id,
+                    borrower_id=borrower,
+                    loan_start=loan_start,
+                    return_due=loan_start + datetime.timedelta(weeks=LOAN_WEEKS),
+                    approved=True,
+                    date_returned=date_returned,
+                    ))
+                end = loan_start - datetime.timedelta(days=1)
+        Loan.objects.bulk_create(loans, batch_size=500)
+        return len(loans)
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:56
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_availability(apps, schema_editor):
+    # Same as library.availability.rebuild(), but on the historical models
+    Book = apps.get_model('library', 'Book')
+    Copy = apps.get_model('library', 'Copy')
+    Loan = apps.get_model('library', 'Loan')
+
+    Copy.objects.update(has_open_loan=Exists(
+        Loan.objects.filter(loaned_copy=OuterRef('pk'), date_returned__isnull=True)))
+    available = (Copy.objects
+        .filter(book=OuterRef('pk'), has_open_loan=False)
+        .exclude(condition__in=['L', 'X'])
+        .order_by()
+        .values('book')
+        .annotate(count=Count('pk'))
+        .values('count'))
+    Book.objects.update(available_copies=Coalesce(
+        Subquery(available, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_merge_20190522_1103'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='copy',
+            name='has_open_loan',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(populate_availability, migrations.RunPython.noop),
+    ]
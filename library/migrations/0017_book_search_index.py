@@ -0,0 +1,57 @@
+from django.db import migrations, OperationalError
+
+
+SQLITE_CREATE = """
+    CREATE VIRTUAL TABLE library_book_fts USING fts5(
+        title, author, isbn, category, tokenize = 'unicode61 remove_diacritics 2')
+    """
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE library_book_search (
+        book_id integer PRIMARY KEY
+            REFERENCES library_book (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL)
+    """,
+    'CREATE INDEX library_book_search_document_gin ON library_book_search USING GIN (document)',
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    # The index tables depend on the database, so they aren't Django models;
+    # see library.search for how they're used.
+    from library.search import PostgresSearchBackend, SQLiteSearchBackend
+
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(SQLITE_CREATE)
+        except OperationalError:
+            # SQLite built without FTS5: search falls back to icontains
+            return
+        backend = SQLiteSearchBackend(connection.alias)
+        backend.configure()
+        backend.index_books()
+    elif connection.vendor == 'postgresql':
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+        PostgresSearchBackend(connection.alias).index_books()
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS library_book_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS library_book_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_availability_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:01
+
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def count_statistics(apps, schema_editor):
+    # Same as library.statistics.recompute(), but on the historical models
+    Book = apps.get_model('library', 'Book')
+    Copy = apps.get_model('library', 'Copy')
+    Loan = apps.get_model('library', 'Loan')
+    LibraryStatistics = apps.get_model('library', 'LibraryStatistics')
+
+    open_loans = Loan.objects.filter(date_returned__isnull=True)
+    LibraryStatistics.objects.update_or_create(pk=1, defaults={
+        'total_books': Book.objects.count(),
+        'circulating_copies': Copy.objects.exclude(condition__in=['L', 'X']).count(),
+        'available_copies': Book.objects.aggregate(total=Sum('available_copies'))['total'] or 0,
+        'open_loans': open_loans.count(),
+        'overdue_loans': open_loans.filter(return_due__lt=date.today()).count(),
+        'overdue_counted_on': date.today(),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_books', models.PositiveIntegerField(default=0)),
+                ('circulating_copies', models.PositiveIntegerField(default=0)),
+                ('available_copies', models.PositiveIntegerField(default=0)),
+                ('open_loans', models.PositiveIntegerField(default=0)),
+                ('overdue_loans', models.PositiveIntegerField(default=0)),
+                ('overdue_counted_on', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'library statistics',
+            },
+        ),
+        migrations.RunPython(count_statistics, migrations.RunPython.noop),
+    ]
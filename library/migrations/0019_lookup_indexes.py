@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# Case-insensitive prefix lookups (istartswith) for the issue screen's
+# typeahead pickers. Django 2.2 can't declare expression indexes, so these are
+# created with SQL for the backends that can use them.
+INDEXES = {
+    'sqlite': [
+        ('library_book_title_nocase', 
+            'CREATE INDEX library_book_title_nocase ON library_book (title COLLATE NOCASE)'),
+        ('library_auth_user_username_nocase',
+            'CREATE INDEX library_auth_user_username_nocase ON auth_user (username COLLATE NOCASE)'),
+        ],
+    'postgresql': [
+        ('library_book_title_upper_like',
+            'CREATE INDEX library_book_title_upper_like ON library_book (UPPER(title) varchar_pattern_ops)'),
+        ('library_auth_user_username_upper_like',
+            'CREATE INDEX library_auth_user_username_upper_like ON auth_user (UPPER(username) varchar_pattern_ops)'),
+        ],
+    }
+
+
+def create_indexes(apps, schema_editor):
+    for name, sql in INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    for name, sql in INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('library', '0018_library_statistics'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0020_book_isbn_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='copy',
+            name='microbit_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='microbit_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='usermicrobit',
+            name='microbit_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
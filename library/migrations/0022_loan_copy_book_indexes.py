@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_open_loans(apps, schema_editor):
+    """Refuse to add the constraint over copies that are already lent twice."""
+    Loan = apps.get_model('library', 'Loan')
+    lent_twice = list(Loan.objects
+        .filter(date_returned__isnull=True)
+        .values('loaned_copy')
+        .annotate(loans=Count('pk'))
+        .filter(loans__gt=1)
+        .values_list('loaned_copy', flat=True))
+    if lent_twice:
+        raise RuntimeError(
+            'These copies have more than one open loan: {}. Mark all but one of '
+            'each copy\'s loans as returned, then migrate again.'.format(
+                ', '.join(str(copy_id) for copy_id in lent_twice)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0021_microbit_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'edition', '-publication_date'], name='book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'title'], name='book_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(fields=['book', 'copy_number'], name='copy_book_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(date_returned__isnull=True), fields=['return_due', 'id'], name='loan_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(date_returned__isnull=True), fields=['borrower', 'return_due', 'id'], name='loan_open_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(date_returned__isnull=False), fields=['date_returned', 'id'], name='loan_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(date_returned__isnull=False), fields=['borrower', 'date_returned', 'id'], name='loan_closed_borrower_idx'),
+        ),
+        migrations.RunPython(check_open_loans, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='loan',
+            constraint=models.UniqueConstraint(condition=models.Q(date_returned__isnull=True), fields=('loaned_copy',), name='loan_one_open_per_copy'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0022_loan_copy_book_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('D', 'Due soon'), ('O', 'Overdue')], max_length=1)),
+                ('return_due', models.DateField()),
+                ('sent_on', models.DateField()),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='library.Loan')),
+            ],
+            options={
+                'unique_together': {('loan', 'kind', 'return_due')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0023_loan_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='default_loan_weeks',
+            field=models.PositiveIntegerField(default=3, help_text='How long a loan lasts unless the librarian chooses otherwise.'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='max_renewal_weeks',
+            field=models.PositiveIntegerField(default=4, help_text='How far ahead a loan can be renewed to.'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('library', '0024_configuration_loan_periods'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, help_text='Unique ID for this loan across whole library', primary_key=True, serialize=False)),
+                ('loan_start', models.DateField()),
+                ('return_due', models.DateField()),
+                ('approved', models.BooleanField(default=False)),
+                ('date_returned', models.DateField(blank=True, null=True)),
+                ('microbit_id', models.PositiveIntegerField(blank=True, db_index=True, null=True)),
+                ('last_microbit_update', models.DateTimeField(blank=True, null=True)),
+                ('borrower', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('loaned_copy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.Copy')),
+            ],
+            options={
+                'ordering': ['-date_returned', '-return_due', '-loan_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['date_returned', 'id'], name='archivedloan_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['borrower', 'date_returned', 'id'], name='archivedloan_borrower_idx'),
+        ),
+    ]
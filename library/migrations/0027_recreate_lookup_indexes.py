@@ -0,0 +1,24 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# SQLite carries out 0020_book_isbn_index and 0026_sync_tracking by copying
+# library_book into a new table, which loses the indexes that
+# 0019_lookup_indexes made with SQL. Make any that are missing again.
+lookup_indexes = import_module('library.migrations.0019_lookup_indexes')
+
+
+def create_missing_indexes(apps, schema_editor):
+    for name, sql in lookup_indexes.INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0026_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_indexes, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,81 @@
 from django.db import models
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef, Q
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from datetime import date
+from datetime import date, timedelta
 import uuid # Required for unique loan instances
 
-class Category(models.Model):
+class TrackedModel(models.Model):
+    """
+    Base for models whose signal receivers need to know what changed.
+
+    Instances loaded from the database remember the values they were loaded
+    with, so a post_save receiver can compare old and new state.
+
+    Fields listed in denormalised_fields are maintained by library.availability
+    with queryset updates, so saving an existing instance leaves them alone
+    rather than writing back a possibly stale value.
+    """
+    denormalised_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self):
+        self._loaded_values = {field.attname: self.__dict__.get(field.attname)
+            for field in self._meta.concrete_fields}
+
+    def loaded_value(self, attname, default=None):
+        """The value of a field when this instance was loaded or last saved."""
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    @property
+    def was_loaded(self):
+        return hasattr(self, '_loaded_values')
+
+    def save(self, *args, **kwargs):
+        if self.denormalised_fields and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalised_fields]
+        super().save(*args, **kwargs)
+
+
+class SyncedModel(models.Model):
+    """
+    Base for the models library.sync sends to clients, recording when each
+    row last changed. Saving sets updated_at, as do the queryset updates that
+    change what is synced. Unlike auto_now, it has a default for fixtures.
+    """
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['updated_at']
+        super().save(*args, **kwargs)
+
+class Category(SyncedModel):
     category = models.CharField(max_length=20)
 
     class Meta:
         verbose_name_plural = "categories"
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ]
 
 
     def __str__(self):
@@ -18,19 +83,45 @@ class Category(models.Model):
         return self.category
 
 
-class Book(models.Model):
+class BookQuerySet(models.QuerySet):
+
+    def with_availability(self):
+        """Annotate each book with has_available_copy, worked out from the Loan table in the same query."""
+        available_copies = (Copy.objects
+            .filter(book=OuterRef('pk'))
+            .exclude(condition__in=Copy.UNAVAILABLE_CONDITIONS)
+            .exclude(pk__in=Loan.objects
+                .filter(date_returned__isnull=True)
+                .values('loaned_copy')))
+        return self.annotate(has_available_copy=Exists(available_copies))
+
+
+class Book(TrackedModel, SyncedModel):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=200)
     edition = models.PositiveIntegerField(null=True, blank=True)
-    isbn = models.CharField(max_length=17)
+    isbn = models.CharField(max_length=17, db_index=True)
     publication_date = models.DateField()
     image = models.CharField(max_length=500, null=True, blank=True)
     thumbnail = models.CharField(max_length=500, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, 
         null=True, default=None)
+    # Denormalised count of copies that can be lent right now, kept up to date
+    # by library.availability. Rebuild with `manage.py rebuild_availability`.
+    available_copies = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BookQuerySet.as_manager()
+    denormalised_fields = ('available_copies',)
 
     class Meta:
         ordering = ['title', 'edition', '-publication_date']
+        indexes = [
+            # The default ordering, and sorting by title
+            models.Index(fields=['title', 'edition', '-publication_date'], name='book_title_idx'),
+            models.Index(fields=['author', 'title'], name='book_author_idx'),
+            # Changes since a client last synced
+            models.Index(fields=['updated_at', 'id'], name='book_updated_idx'),
+        ]
 
     def __str__(self):
         """String for representing the Book object (in Admin site etc.)."""
@@ -43,17 +134,24 @@ class Book(models.Model):
     @property
     def copy_available(self):
         """True if at least one copy of this book is available for loan, false otherwise"""
-        # available_copy = False
-        # for copy in self.copies.all():
-        #     if copy.available:
-        #         available_copy = True
-        # return available_copy
+        return self.available_copies > 0
+
 
-        return any(copy for copy in self.copies.all() if copy.available)
+class CopyQuerySet(models.QuerySet):
 
+    def available(self):
+        """Copies that can be lent right now, going by the stored availability state."""
+        return (self
+            .filter(has_open_loan=False)
+            .exclude(condition__in=Copy.UNAVAILABLE_CONDITIONS))
+
+    def with_loan_state(self):
+        """Annotate each copy with loan_open, worked out from the Loan table in the same query."""
+        return self.annotate(loan_open=Exists(Loan.objects
+            .filter(loaned_copy=OuterRef('pk'), date_returned__isnull=True)))
 
 
-class Copy(models.Model):
+class Copy(TrackedModel, SyncedModel):
     COPY_CONDITIONS = (
         ('M', 'Mint'),
         ('G', 'Good'),
@@ -62,17 +160,30 @@ class Copy(models.Model):
         ('L', 'Lost'),
         ('X', 'Destroyed'),
     )
+    # Copies in these conditions can never be lent
+    UNAVAILABLE_CONDITIONS = ('L', 'X')
 
     book = models.ForeignKey(Book, related_name='copies', on_delete=models.CASCADE)
     acquisition_date = models.DateField()
     copy_number = models.PositiveIntegerField()
     condition = models.CharField(max_length=1, choices=COPY_CONDITIONS)
-    microbit_id = models.PositiveIntegerField(blank=True, null=True)
+    microbit_id = models.PositiveIntegerField(blank=True, null=True, db_index=True)
     last_microbit_update = models.DateTimeField(blank=True, null=True)
+    # Denormalised flag, true while this copy has a loan without a return date.
+    # Kept up to date by library.availability.
+    has_open_loan = models.BooleanField(default=False, editable=False)
+
+    objects = CopyQuerySet.as_manager()
+    denormalised_fields = ('has_open_loan',)
 
     class Meta:
         ordering = ['copy_number']
         verbose_name_plural = "copies"
+        indexes = [
+            # A book's copies in order
+            models.Index(fields=['book', 'copy_number'], name='copy_book_number_idx'),
+            models.Index(fields=['updated_at', 'id'], name='copy_updated_idx'),
+        ]
 
     def __str__(self):
         """String for representing the Copy object."""
@@ -84,14 +195,15 @@ class Copy(models.Model):
 
     @property
     def on_loan(self):
-        return Loan.objects.filter(loaned_copy=self.id).filter(date_returned__isnull=True).count() > 0
+        return self.has_open_loan
 
     @property
     def available(self):
-        return not(self.on_loan) and (self.condition not in ['L', 'X'])
+        return not(self.on_loan) and (self.condition not in self.UNAVAILABLE_CONDITIONS)
 
 
-class Loan(models.Model):
+class LoanFields(SyncedModel):
+    """The fields of a loan, shared by current loans and archived ones."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, help_text="Unique ID for this loan across whole library")
     loaned_copy = models.ForeignKey(Copy, on_delete=models.CASCADE)
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -99,16 +211,11 @@ class Loan(models.Model):
     return_due = models.DateField()
     approved = models.BooleanField(default=False)
     date_returned = models.DateField(null=True, blank=True)
-    microbit_id = models.PositiveIntegerField(blank=True, null=True)
+    microbit_id = models.PositiveIntegerField(blank=True, null=True, db_index=True)
     last_microbit_update = models.DateTimeField(blank=True, null=True)
 
     class Meta:
-        ordering = ['-date_returned', '-return_due', '-loan_start']
-        permissions = (
-            ("can_mark_loaned", "Set book as on loan"),
-            ("can_mark_returned", "Set book as returned"),
-            ("can_view_all_loans", "View all users' loans")
-            )
+        abstract = True
 
     def __str__(self):
         """String for representing the Loan object."""
@@ -127,12 +234,149 @@ class Loan(models.Model):
             return True
         return False
 
+class Loan(TrackedModel, LoanFields):
+
+    class Meta:
+        ordering = ['-date_returned', '-return_due', '-loan_start']
+        permissions = (
+            ("can_mark_loaned", "Set book as on loan"),
+            ("can_mark_returned", "Set book as returned"),
+            ("can_view_all_loans", "View all users' loans")
+            )
+        # Loan lists show open loans by due date and closed loans by return
+        # date, for everyone or one borrower. The primary key ends each index
+        # as it ends the keyset pagination ordering.
+        indexes = [
+            models.Index(fields=['return_due', 'id'], name='loan_open_due_idx',
+                condition=Q(date_returned__isnull=True)),
+            models.Index(fields=['borrower', 'return_due', 'id'], name='loan_open_borrower_idx',
+                condition=Q(date_returned__isnull=True)),
+            models.Index(fields=['date_returned', 'id'], name='loan_closed_idx',
+                condition=Q(date_returned__isnull=False)),
+            models.Index(fields=['borrower', 'date_returned', 'id'], name='loan_closed_borrower_idx',
+                condition=Q(date_returned__isnull=False)),
+            models.Index(fields=['updated_at', 'id'], name='loan_updated_idx'),
+            models.Index(fields=['borrower', 'updated_at', 'id'], name='loan_borrower_updated_idx'),
+        ]
+        constraints = [
+            # Also the index for finding a copy's open loan
+            models.UniqueConstraint(fields=['loaned_copy'], name='loan_one_open_per_copy',
+                condition=Q(date_returned__isnull=True)),
+        ]
+
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # Django doesn't validate the conditional loan_one_open_per_copy constraint
+        if (self.date_returned is None and self.loaned_copy_id is not None
+                and 'loaned_copy' not in (exclude or ())):
+            open_loans = Loan.objects.filter(loaned_copy_id=self.loaned_copy_id, date_returned__isnull=True)
+            if open_loans.exclude(pk=self.pk).exists():
+                raise ValidationError({'loaned_copy': 'This copy is already on loan.'})
+
+class ArchivedLoan(LoanFields):
+    """
+    A loan closed long enough ago to be moved out of the Loan table by
+    `manage.py archive_loans`, so that the loans still in circulation stay a
+    small table. Read together with closed loans through library.archive.
+    """
+
+    class Meta:
+        ordering = ['-date_returned', '-return_due', '-loan_start']
+        # As the closed loan indexes on Loan
+        indexes = [
+            models.Index(fields=['date_returned', 'id'], name='archivedloan_closed_idx'),
+            models.Index(fields=['borrower', 'date_returned', 'id'], name='archivedloan_borrower_idx'),
+        ]
+
+class Tombstone(models.Model):
+    """
+    A record that a book, copy, loan or category was deleted, so that
+    library.sync can tell clients to forget it. Pruned after
+    LIBRARY_SYNC_TOMBSTONE_DAYS.
+    """
+    table = models.CharField(max_length=20)
+    object_id = models.CharField(max_length=36)
+    # Whose loan it was, so borrowers are only told about their own
+    borrower_id = models.IntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['table', 'deleted_at', 'id'], name='tombstone_table_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {} deleted at {}'.format(self.table, self.object_id, self.deleted_at)
+
+class LoanReminder(models.Model):
+    """
+    A reminder sent to a borrower about a loan, recorded by
+    `manage.py scan_overdue` so that a loan gets each kind of reminder only
+    once for each due date.
+    """
+    DUE_SOON = 'D'
+    OVERDUE = 'O'
+    KINDS = (
+        (DUE_SOON, 'Due soon'),
+        (OVERDUE, 'Overdue'),
+    )
+
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='reminders')
+    kind = models.CharField(max_length=1, choices=KINDS)
+    # The due date the reminder was about; renewing a loan moves it on
+    return_due = models.DateField()
+    sent_on = models.DateField()
+
+    class Meta:
+        unique_together = ('loan', 'kind', 'return_due')
+
+    def __str__(self):
+        return '{} reminder for {} (due {})'.format(
+            self.get_kind_display(), self.loan_id, self.return_due)
+
 class Configuration(models.Model):
+    """
+    The library's loan policies, in a single row. Read it through
+    library.configuration.get(), which caches it.
+    """
     maxbooksonloan = models.PositiveIntegerField()
+    default_loan_weeks = models.PositiveIntegerField(default=3,
+        help_text="How long a loan lasts unless the librarian chooses otherwise.")
+    max_renewal_weeks = models.PositiveIntegerField(default=4,
+        help_text="How far ahead a loan can be renewed to.")
+
+    @property
+    def loan_period(self):
+        return timedelta(weeks=self.default_loan_weeks)
+
+    @property
+    def renewal_window(self):
+        return timedelta(weeks=self.max_renewal_weeks)
+
+    def default_return_due(self, loan_start=None):
+        """When a loan starting on loan_start (by default today) is due back."""
+        return (loan_start or date.today()) + self.loan_period
+
+class LibraryStatistics(models.Model):
+    """
+    Running totals shown on the home page. There is a single row, kept up to
+    date by library.statistics; recompute it with `manage.py recompute_statistics`.
+    """
+    total_books = models.PositiveIntegerField(default=0)
+    circulating_copies = models.PositiveIntegerField(default=0)
+    available_copies = models.PositiveIntegerField(default=0)
+    open_loans = models.PositiveIntegerField(default=0)
+    overdue_loans = models.PositiveIntegerField(default=0)
+    # Loans become overdue as time passes, so overdue_loans is recounted on
+    # the first read of each day
+    overdue_counted_on = models.DateField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "library statistics"
 
 class UserMicrobit(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    microbit_id = models.PositiveIntegerField(blank=True, null=True)
+    microbit_id = models.PositiveIntegerField(blank=True, null=True, db_index=True)
     last_microbit_update = models.DateTimeField(blank=True, null=True)
 
 @receiver(post_save, sender=User)
@@ -0,0 +1,216 @@
+"""
+Keyset (cursor) pagination.
+
+Rather than skipping OFFSET rows, each page continues from the ordering
+values of the last row of the page before, so every page costs the same
+however deep it is, and rows don't shift between pages as loans come and go.
+
+The queryset must be ordered by plain, non-null fields of its model; the
+primary key is appended to the ordering to make it total. Positions are
+passed around as opaque cursor strings.
+
+A list of querysets of models with the same fields and ordering, such as the
+closed loans and archived loans of library.archive, can be paged through as
+one: each page is merged from a page of each.
+"""
+import base64
+from collections import OrderedDict
+from functools import reduce
+import json
+import operator
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """One page of results, with the cursors of the pages either side."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+
+    def __init__(self, queryset, per_page):
+        self.querysets = list(queryset) if isinstance(queryset, (list, tuple)) else [queryset]
+        self.queryset = self.querysets[0]
+        self.per_page = per_page
+        self.ordering = self._ordering(self.queryset)
+
+    def _ordering(self, queryset):
+        """(field, descending) pairs, ending with the primary key."""
+        opts = queryset.model._meta
+        ordering = []
+        for name in queryset.query.order_by or opts.ordering:
+            if not isinstance(name, str):
+                raise ImproperlyConfigured('Keyset pagination needs ordering by field names')
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            field = opts.pk if name == 'pk' else opts.get_field(name.split('__')[0])
+            if not field.concrete or '__' in name:
+                raise ImproperlyConfigured(
+                    'Keyset pagination cannot order by {}'.format(name))
+            ordering.append((field, descending))
+        if not any(field.primary_key for field, _ in ordering):
+            ordering.append((opts.pk, ordering[-1][1] if ordering else False))
+        return ordering
+
+    def encode_cursor(self, obj, reverse):
+        position = [getattr(obj, field.attname) for field, _ in self.ordering]
+        data = {'p': [None if value is None else str(value) for value in position]}
+        if reverse:
+            data['r'] = 1
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """(position, reverse) from a cursor string."""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values = data['p']
+            if len(values) != len(self.ordering):
+                raise ValueError(cursor)
+            position = [field.to_python(value)
+                for (field, _), value in zip(self.ordering, values)]
+            return position, bool(data.get('r'))
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise InvalidCursor(cursor)
+
+    def _after(self, position, reverse):
+        """Q selecting the rows after position in the ordering (before it if reverse)."""
+        conditions = []
+        for index, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition = Q(**{'{}__{}'.format(field.attname, lookup): position[index]})
+            for (earlier_field, _), value in zip(self.ordering[:index], position):
+                condition &= Q(**{earlier_field.attname: value})
+            conditions.append(condition)
+        return reduce(operator.or_, conditions)
+
+    def _merge(self, rows, reverse):
+        """Sorts the rows of several querysets into the order of the page."""
+        # Sorts are stable, so sorting by each field from the last makes the
+        # earlier fields take precedence
+        for field, descending in reversed(self.ordering):
+            rows.sort(key=operator.attrgetter(field.attname), reverse=descending != reverse)
+
+    def page(self, cursor=None):
+        """The page starting after the cursor (ending before it if it points backwards)."""
+        position, reverse = (None, False) if not cursor else self.decode_cursor(cursor)
+
+        order_by = ['{}{}'.format('-' if descending != reverse else '', field.attname)
+            for field, descending in self.ordering]
+        rows = []
+        for queryset in self.querysets:
+            queryset = queryset.order_by(*order_by)
+            if position is not None:
+                queryset = queryset.filter(self._after(position, reverse))
+            # Fetch one extra row to find out whether there is another page
+            rows.extend(queryset[:self.per_page + 1])
+        if len(self.querysets) > 1:
+            self._merge(rows, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            # Coming from a cursor, there is a page on that side of it
+            has_next = has_more if not reverse else True
+            has_previous = has_more if reverse else position is not None
+            if has_next:
+                next_cursor = self.encode_cursor(rows[-1], reverse=False)
+            if has_previous:
+                previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class KeysetPagination(BasePagination):
+    """DRF pagination class using KeysetPaginator, with `next` and `previous` links."""
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.page_size)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.page.next_cursor)),
+            ('previous', self.get_link(self.page.previous_cursor)),
+            ('results', data),
+        ]))
+
+
+def paginate_by_keyset(request, queryset, per_page, cursor_param='cursor'):
+    """
+    A KeysetPage of queryset for a web view, reading the cursor from
+    cursor_param and adding next_url and previous_url query strings that keep
+    the request's other parameters. Raises Http404 for an invalid cursor.
+    """
+    try:
+        page = KeysetPaginator(queryset, per_page).page(request.GET.get(cursor_param))
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+
+    def url(cursor):
+        if cursor is None:
+            return None
+        query = request.GET.copy()
+        query[cursor_param] = cursor
+        return '?' + query.urlencode()
+
+    page.next_url = url(page.next_cursor)
+    page.previous_url = url(page.previous_cursor)
+    return page
+
+
+class KeysetPaginationMixin:
+    """
+    For ListViews with paginate_by: paginate with keyset cursors instead of
+    page numbers. page_obj is a KeysetPage with next_url and previous_url.
+    """
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_by_keyset(self.request, queryset, page_size, self.cursor_kwarg)
+        return (None, page, page.object_list, page.has_other_pages())
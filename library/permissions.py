@@ -0,0 +1,72 @@
+"""
+Cached permission checks.
+
+Django's ModelBackend loads a user's permissions, through their groups, with
+two queries the first time a request checks one. Every API request checks
+them (DjangoModelPermissions and the library's own permission classes) and
+so do the librarian's views, so CachedModelBackend keeps each user's
+permissions in the shared cache instead.
+
+Cached permissions are keyed by two versions kept alongside the API response
+versions (see library.caching): one for each user, bumped when the user is
+saved or their groups or own permissions change, and one for everyone,
+bumped when a group's or permission's definition changes. The receivers in
+library.signals do the bumping; call users_changed() after bulk changes that
+skip signals.
+
+The versions are kept in the cache too, and the default cache is local to
+each gunicorn worker (see CACHES in the settings), so the other workers only
+notice a change when their own entry expires. Permissions are therefore only
+cached for LIBRARY_PERMISSIONS_CACHE_SECONDS (default 30): raise it only if
+CACHES is a cache all the workers share, such as memcached.
+
+Rolling back a transaction doesn't bump the versions back, so tests that
+change users' permissions should clear the cache when they finish.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from library import caching
+
+PERMISSIONS_KEY = 'library:permissions:{}:{}:{}'
+ALL_USERS_SCOPE = 'permissions'
+USER_SCOPE = 'permissions:user:{}'
+DEFAULT_PERMISSIONS_SECONDS = 30
+
+
+def users_changed(user_ids=None):
+    """Forget the cached permissions of some users, or of everyone if user_ids is None."""
+    if user_ids is None:
+        caching.bump(ALL_USERS_SCOPE)
+    else:
+        caching.bump(*(USER_SCOPE.format(user_id) for user_id in user_ids))
+
+
+def permissions_timeout():
+    """How long a user's permissions are cached, in seconds."""
+    return getattr(settings, 'LIBRARY_PERMISSIONS_CACHE_SECONDS',
+        DEFAULT_PERMISSIONS_SECONDS)
+
+
+def cache_key(user_id):
+    return PERMISSIONS_KEY.format(user_id,
+        *caching.get_versions(ALL_USERS_SCOPE, USER_SCOPE.format(user_id)))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, keeping each user's permissions in the cache."""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            # The key is worked out before the permissions are loaded, so if
+            # they change meanwhile the versions move on past what we store
+            key = cache_key(user_obj.pk)
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions, permissions_timeout())
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
@@ -0,0 +1,113 @@
+"""
+A compact representation of the API, for micro:bit gateways and other
+clients short of bandwidth.
+
+Ask for it with `?format=compact` or `Accept: application/vnd.library.compact+json`.
+Related objects are given as their IDs rather than hyperlinks (see the
+hyperlinked fields in library.serializers), and the fields of each object
+are renamed to the short keys in COMPACT_KEYS, with its own URL becoming
+`id`. Pagination envelopes (`count`, `next`, `results` and so on) keep their
+names.
+"""
+from collections import OrderedDict
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+COMPACT_KEYS = {
+    'url': 'id',
+    # Books
+    'title': 't',
+    'author': 'a',
+    'category': 'cat',
+    'copy_available': 'av',
+    'publication_date': 'pd',
+    'copies': 'cps',
+    'thumbnail': 'th',
+    # Copies
+    'book': 'bk',
+    'copy_number': 'no',
+    'condition': 'cd',
+    'acquisition_date': 'ad',
+    'available': 'av',
+    'on_loan': 'ol',
+    'microbit_id': 'mb',
+    'last_microbit_update': 'mbt',
+    # Loans
+    'loaned_copy': 'cp',
+    'borrower': 'by',
+    'loan_start': 'st',
+    'return_due': 'due',
+    'date_returned': 'rt',
+    # Users
+    'username': 'un',
+}
+
+
+def is_compact(request):
+    """True if the response to request is to be in the compact representation."""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return getattr(renderer, 'format', None) == CompactJSONRenderer.format
+
+
+def shorten_keys(data):
+    if isinstance(data, dict):
+        return OrderedDict((COMPACT_KEYS.get(key, key), shorten_keys(value))
+            for key, value in data.items())
+    if isinstance(data, list):
+        return [shorten_keys(value) for value in data]
+    return data
+
+
+class CompactJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.library.compact+json'
+    format = 'compact'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'results' in data:
+            data = OrderedDict((key, shorten_keys(value) if key == 'results' else value)
+                for key, value in data.items())
+        else:
+            data = shorten_keys(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    For choosing the format of the exports (see library.export), which
+    stream their own responses. What these render is the data of an error
+    response, like {"detail": "..."}, as one record of the export format.
+    """
+    charset = 'utf-8'
+
+    def as_record(self, data):
+        return data if isinstance(data, dict) else {'detail': data}
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        record = self.as_record(data)
+        lines = io.StringIO()
+        writer = csv.writer(lines)
+        writer.writerow(record.keys())
+        writer.writerow(record.values())
+        return lines.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(self.as_record(data), cls=encoders.JSONEncoder,
+            separators=(',', ':')) + '\n').encode(self.charset)
@@ -0,0 +1,241 @@
+"""
+Full-text search over the book catalogue.
+
+Each backend keeps a search index of book title, author, ISBN and category
+name, and can filter a Book queryset down to the books matching some search
+terms, annotated with a `search_rank` (higher is more relevant).
+
+* SQLite uses an FTS5 virtual table, `library_book_fts`.
+* PostgreSQL uses a `tsvector` column in `library_book_search`, with a GIN index.
+* Anything else, or an SQLite build without FTS5, falls back to the old
+  `icontains` matching, which needs no index.
+
+Both index tables are created by migration 0017. The receivers in
+library.signals keep them in step with Book and Category; after bulk changes
+that skip signals, call `get_backend().index_books(...)` or run
+`manage.py rebuild_search_index`.
+
+Set LIBRARY_SEARCH_BACKEND to the dotted path of a backend class to override
+the choice made from the database vendor.
+"""
+from functools import reduce
+import operator
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.utils.module_loading import import_string
+
+
+# Relative weights of the indexed columns when ranking
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+ISBN_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+
+# The indexed text of each book, one row per book
+INDEX_SOURCE_SQL = """
+    SELECT library_book.id, library_book.title, library_book.author,
+        library_book.isbn, COALESCE(library_category.category, '')
+    FROM library_book
+    LEFT OUTER JOIN library_category
+        ON library_category.id = library_book.category_id
+    """
+
+
+class BasicSearchBackend:
+    """Unindexed substring search, used where no full-text index is available."""
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def search(self, queryset, terms):
+        """Books in queryset matching every term, annotated with search_rank."""
+        matches = reduce(operator.and_, (
+            Q(title__icontains=term) | Q(author__icontains=term) |
+            Q(isbn__icontains=term) | Q(category__category__icontains=term)
+            for term in terms))
+        return (queryset
+            .filter(matches)
+            .annotate(search_rank=Value(0.0, output_field=FloatField())))
+
+    def index_books(self, book_ids=None, category_id=None):
+        """(Re)index the given books, the books in a category, or every book if neither is given."""
+
+    def remove_books(self, book_ids):
+        """Remove books from the index."""
+
+    def rebuild(self):
+        self.index_books()
+
+    def _source(self, book_ids=None, category_id=None):
+        """SQL and params selecting the indexed text of some or all books."""
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            return (INDEX_SOURCE_SQL + ' WHERE library_book.id IN ({})'.format(
+                ', '.join(['%s'] * len(book_ids))), book_ids)
+        if category_id is not None:
+            return INDEX_SOURCE_SQL + ' WHERE library_book.category_id = %s', [category_id]
+        return INDEX_SOURCE_SQL, []
+
+
+class SQLiteSearchBackend(BasicSearchBackend):
+    """Search using an SQLite FTS5 table, whose rowid is the book id."""
+
+    table = 'library_book_fts'
+
+    def match_expression(self, terms):
+        # Quote every term so FTS5 query syntax in user input is taken
+        # literally, and allow prefix matches ("djan" finds "Django").
+        return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    # The ranking function behind the FTS5 rank column. configure() stores it
+    # with the table when the migration creates it; DELETE doesn't reset it.
+    RANK_FUNCTION = 'bm25({}, {}, {}, {})'.format(
+        TITLE_WEIGHT, AUTHOR_WEIGHT, ISBN_WEIGHT, CATEGORY_WEIGHT)
+
+    def configure(self):
+        """Store the weighted ranking function in the FTS5 table's configuration."""
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {0} ({0}, rank) VALUES ('rank', %s)".format(self.table),
+                [self.RANK_FUNCTION])
+
+    def search(self, queryset, terms):
+        return queryset.extra(
+            tables=[self.table],
+            where=[
+                '{}.rowid = library_book.id'.format(self.table),
+                '{} MATCH %s'.format(self.table),
+                ],
+            params=[self.match_expression(terms)],
+            # rank is lower for better matches
+            select={'search_rank': '-{}.rank'.format(self.table)},
+            )
+
+    def index_books(self, book_ids=None, category_id=None):
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            if not book_ids:
+                return
+        source_sql, params = self._source(book_ids, category_id)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid IN (SELECT id FROM ({}))'.format(
+                    self.table, source_sql), params)
+            cursor.execute(
+                'INSERT INTO {} (rowid, title, author, isbn, category) {}'.format(
+                    self.table, source_sql), params)
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(
+                self.table, ', '.join(['%s'] * len(book_ids))), book_ids)
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+        self.index_books()
+
+
+class PostgresSearchBackend(BasicSearchBackend):
+    """Search using a weighted tsvector per book, with a GIN index."""
+
+    table = 'library_book_search'
+    config = 'simple'
+
+    # A tsvector built from the columns of INDEX_SOURCE_SQL
+    DOCUMENT_SQL = """
+        setweight(to_tsvector('simple', source.title), 'A') ||
+        setweight(to_tsvector('simple', source.author), 'B') ||
+        setweight(to_tsvector('simple', source.isbn), 'C') ||
+        setweight(to_tsvector('simple', source.category), 'D')
+        """
+
+    def tsquery(self, terms):
+        # Quote every term as a lexeme, and allow prefix matches
+        return ' & '.join("'{}':*".format(term.replace("\\", "").replace("'", "''"))
+            for term in terms)
+
+    def search(self, queryset, terms):
+        tsquery = "to_tsquery('{}', %s)".format(self.config)
+        weights = "'{{{}, {}, {}, {}}}'".format(
+            CATEGORY_WEIGHT / TITLE_WEIGHT, ISBN_WEIGHT / TITLE_WEIGHT,
+            AUTHOR_WEIGHT / TITLE_WEIGHT, 1.0)
+        query = self.tsquery(terms)
+        return queryset.extra(
+            tables=[self.table],
+            where=[
+                '{}.book_id = library_book.id'.format(self.table),
+                '{}.document @@ {}'.format(self.table, tsquery),
+                ],
+            params=[query],
+            select={'search_rank': 'ts_rank({}, {}.document, {})'.format(
+                weights, self.table, tsquery)},
+            select_params=[query],
+            )
+
+    def index_books(self, book_ids=None, category_id=None):
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            if not book_ids:
+                return
+        source_sql, params = self._source(book_ids, category_id)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO {table} (book_id, document)
+                SELECT source.id, {document}
+                FROM ({source}) AS source (id, title, author, isbn, category)
+                ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document
+                """.format(table=self.table, document=self.DOCUMENT_SQL, source=source_sql),
+                params)
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE book_id = ANY(%s)'.format(self.table),
+                [book_ids])
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+        self.index_books()
+
+
+_backends = {}
+
+def get_backend(using='default'):
+    """The search backend for a database connection."""
+    if using not in _backends:
+        backend_path = getattr(settings, 'LIBRARY_SEARCH_BACKEND', None)
+        if backend_path:
+            backend_class = import_string(backend_path)
+        else:
+            connection = connections[using]
+            table_names = connection.introspection.table_names()
+            if connection.vendor == 'sqlite' and SQLiteSearchBackend.table in table_names:
+                backend_class = SQLiteSearchBackend
+            elif connection.vendor == 'postgresql' and PostgresSearchBackend.table in table_names:
+                backend_class = PostgresSearchBackend
+            else:
+                backend_class = BasicSearchBackend
+        _backends[using] = backend_class(using)
+    return _backends[using]
+
+
+def search_books(queryset, terms):
+    """
+    Books in queryset matching all the search terms, most relevant first.
+    With no terms, returns queryset unchanged.
+    """
+    terms = [term for term in terms if term]
+    if not terms:
+        return queryset
+    return (get_backend(queryset.db)
+        .search(queryset, terms)
+        .order_by('-search_rank', 'title'))
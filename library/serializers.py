@@ -1,38 +1,194 @@
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from collections import OrderedDict
 
 from library.models import Book, Copy, Loan, UserMicrobit, Category
+from library.renderers import is_compact
+
+# Stands in for the object's key when reversing a URL for every object at once
+URL_PLACEHOLDER = 'URLPLACEHOLDER'
+
+class TemplatedHyperlinkMixin:
+    """
+    For hyperlinked fields: reverse each URL once per serializer, with a
+    placeholder for the object's key, and fill that in for each object,
+    rather than calling reverse() for every object. In the compact
+    representation (see library.renderers), give just the key.
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        templates = self.__dict__.setdefault('_url_templates', {})
+        if (view_name, format) not in templates:
+            url = self.reverse(view_name, kwargs={self.lookup_url_kwarg: URL_PLACEHOLDER},
+                request=request, format=format)
+            templates[view_name, format] = url.split(URL_PLACEHOLDER)
+        prefix, suffix = templates[view_name, format]
+        return prefix + str(getattr(obj, self.lookup_field)) + suffix
+
+    def to_representation(self, value):
+        if is_compact(self.context.get('request')):
+            return getattr(value, self.lookup_field)
+        return super().to_representation(value)
+
+class TemplatedHyperlinkedRelatedField(TemplatedHyperlinkMixin, serializers.HyperlinkedRelatedField):
+    pass
+
+class TemplatedHyperlinkedIdentityField(TemplatedHyperlinkMixin, serializers.HyperlinkedIdentityField):
+    pass
+
+def requested_names(request, parameter):
+    """
+    The comma-separated names in a query parameter of request, such as
+    ?fields=title,author, as a set, or None if it wasn't given. Only read
+    requests are shaped like this, so that writes see every field.
+    """
+    if request is None or request.method not in SAFE_METHODS or parameter not in request.query_params:
+        return None
+    return {name.strip() for name in request.query_params[parameter].split(',') if name.strip()}
+
+class FieldSelectionMixin:
+    """
+    For the API's model serializers: return just the fields named in
+    ?fields=, if given, and inline the related objects named in ?expand=
+    with the serializers made by Meta.expandable_fields. Only the top-level
+    objects are shaped like this, not those inlined into them.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+
+        request = self.context.get('request')
+        selected = requested_names(request, 'fields')
+        if selected is not None:
+            unknown = selected - set(fields)
+            if unknown:
+                raise serializers.ValidationError({'fields': 'Unknown fields: {}.'.format(
+                    ', '.join(sorted(unknown)))})
+            fields = OrderedDict((name, field) for name, field in fields.items() if name in selected)
+
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name in requested_names(request, 'expand') or ():
+            if name not in expandable:
+                raise serializers.ValidationError({'expand': '{} cannot be expanded.'.format(name)})
+            if name in fields:
+                fields[name] = expandable[name]()
+        return fields
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class TemplatedHyperlinkedModelSerializer(FieldSelectionMixin, serializers.HyperlinkedModelSerializer):
+    """
+    HyperlinkedModelSerializer, with hyperlinks built from URL templates,
+    and ?fields= and ?expand= to shape the response.
+    """
+    serializer_related_field = TemplatedHyperlinkedRelatedField
+    serializer_url_field = TemplatedHyperlinkedIdentityField
+
+class UserSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ('url', 'id', 'username')
 
-class UserMicrobitSerializer(serializers.HyperlinkedModelSerializer):
+class UserMicrobitSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = UserMicrobit
         fields = ('url', 'id', 'microbit_id', 'last_microbit_update',)
 
-class LoanSerializer(serializers.HyperlinkedModelSerializer):
+class LoanSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = Loan
         fields = ('url', 'loaned_copy', 'borrower', 
             'loan_start', 'return_due', 'date_returned')
+        expandable_fields = {
+            'loaned_copy': lambda: CopySerializer(read_only=True),
+            'borrower': lambda: UserSerializer(read_only=True),
+        }
+
+    def validate(self, attrs):
+        # The serializer doesn't run the model's validate_unique()
+        loaned_copy = attrs.get('loaned_copy', getattr(self.instance, 'loaned_copy', None))
+        date_returned = attrs.get('date_returned', getattr(self.instance, 'date_returned', None))
+        if loaned_copy is not None and date_returned is None:
+            open_loans = Loan.objects.filter(loaned_copy=loaned_copy, date_returned__isnull=True)
+            if self.instance is not None:
+                open_loans = open_loans.exclude(pk=self.instance.pk)
+            if open_loans.exists():
+                raise serializers.ValidationError({'loaned_copy': 'This copy is already on loan.'})
+        return attrs
+
+class CopySerializer(TemplatedHyperlinkedModelSerializer):
+    # Read the loan_open annotation from CopyQuerySet.with_loan_state() when
+    # the viewset supplies it, so a page of copies needs no per-row queries.
+    available = serializers.SerializerMethodField()
+    on_loan = serializers.SerializerMethodField()
 
-class CopySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Copy
         fields = ('url', 'book', 'copy_number', 'condition', 'acquisition_date',
             'available', 'on_loan',
             'microbit_id', 'last_microbit_update')
+        expandable_fields = {
+            'book': lambda: BookSerializer(read_only=True),
+        }
 
-class CategorySerializer(serializers.HyperlinkedModelSerializer):
+    def get_on_loan(self, copy):
+        return getattr(copy, 'loan_open', copy.on_loan)
+
+    def get_available(self, copy):
+        return (not self.get_on_loan(copy)) and (copy.condition not in Copy.UNAVAILABLE_CONDITIONS)
+
+class CategorySerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = Category
         fields = ('url', 'category')
 
-class BookSerializer(serializers.HyperlinkedModelSerializer):
+class BookSerializer(TemplatedHyperlinkedModelSerializer):
+    # Read the has_available_copy annotation from BookQuerySet.with_availability()
+    # when the viewset supplies it.
+    copy_available = serializers.SerializerMethodField()
+
     class Meta:
         model = Book
         fields = ('url', 'title', 'author', 'category', 'isbn', 
-            'copy_available', 'publication_date', 'copies')
+            'copy_available', 'publication_date', 'copies', 'thumbnail')
+        expandable_fields = {
+            'copies': lambda: CopySerializer(many=True, read_only=True),
+            'category': lambda: CategorySerializer(read_only=True),
+        }
+
+    def get_copy_available(self, book):
+        return getattr(book, 'has_available_copy', book.copy_available)
+
+class MicrobitReadingSerializer(serializers.Serializer):
+    """One heartbeat from a micro:bit."""
+    microbit_id = serializers.IntegerField(min_value=0)
+    timestamp = serializers.DateTimeField()
+
+class LoanBatchSerializer(serializers.Serializer):
+    """A stack of scanned copies to lend, return or renew, by copy ID or micro:bit ID."""
+    max_copies = 100
+
+    borrower = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
+    copies = serializers.ListField(child=serializers.IntegerField(), required=False)
+    microbit_ids = serializers.ListField(child=serializers.IntegerField(min_value=0), required=False)
+    return_due = serializers.DateField(required=False)
+    date_returned = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if ('copies' in attrs) == ('microbit_ids' in attrs):
+            raise serializers.ValidationError('Give either copies or microbit_ids.')
+        scanned = attrs.get('copies', attrs.get('microbit_ids'))
+        if not scanned:
+            raise serializers.ValidationError('Scan at least one copy.')
+        if len(scanned) > self.max_copies:
+            raise serializers.ValidationError(
+                'Scan at most {} copies at a time.'.format(self.max_copies))
+        return attrs
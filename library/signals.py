@@ -0,0 +1,165 @@
+"""
+Signal receivers for the library app. Connected in LibraryConfig.ready().
+
+Book, Copy and Loan are TrackedModels, so the post_save receivers can compare
+an instance with the values it was loaded with. Each receiver refreshes those
+values once it has finished with them.
+
+Besides keeping the stored state up to date, the receivers invalidate the
+cached API responses of whatever has changed (see library.caching), and the
+cached permissions of users whose groups or permissions change (see
+library.permissions), publish the live events of library.events, and
+leave tombstones of deleted rows for library.sync.
+"""
+from django.contrib.auth.models import Group, Permission, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from library import (availability, authentication, caching, configuration,
+    events, permissions, search, statistics, sync)
+from library.models import Book, Category, Configuration, Copy, Loan
+
+
+def copy_book_ids(*copy_ids):
+    return Copy.objects.filter(pk__in=copy_ids).values_list('book_id', flat=True)
+
+
+@receiver(post_save, sender=Loan)
+def loan_saved(sender, instance, created, **kwargs):
+    availability.refresh_copy(instance.loaned_copy_id)
+    previous_copy_id = instance.loaded_value('loaned_copy_id')
+    if previous_copy_id not in (None, instance.loaned_copy_id):
+        availability.refresh_copy(previous_copy_id)
+    caching.bump_books(copy_book_ids(instance.loaned_copy_id, previous_copy_id))
+
+    statistics.loan_changed(
+        statistics.loan_state(instance.loaded_value('date_returned'),
+            instance.loaded_value('return_due')),
+        statistics.loan_state(instance.date_returned, instance.return_due))
+
+    event_type = events.loan_event_type(instance, created,
+        instance.loaded_value('date_returned'), instance.loaded_value('return_due'))
+    if event_type is not None:
+        events.loans_changed(event_type, [(instance, instance.loaned_copy.book_id)])
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Loan)
+def loan_deleted(sender, instance, **kwargs):
+    sync.record_deletion(instance)
+    caching.bump_books(copy_book_ids(instance.loaned_copy_id))
+    if instance.date_returned is None:
+        availability.refresh_copy(instance.loaned_copy_id)
+        statistics.loan_changed(
+            statistics.loan_state(instance.date_returned, instance.return_due), None)
+
+
+@receiver(post_save, sender=Copy)
+def copy_saved(sender, instance, created, **kwargs):
+    # Recompute the flag as well as the book's count: a fixture load may have
+    # just overwritten has_open_loan.
+    availability.refresh_copy(instance.pk)
+    previous_book_id = instance.loaded_value('book_id')
+    if previous_book_id not in (None, instance.book_id):
+        availability.refresh_book(previous_book_id)
+    caching.bump_books([instance.book_id, previous_book_id])
+
+    statistics.adjust(circulating_copies=
+        int(statistics.is_circulating(instance.condition)) -
+        int(statistics.is_circulating(instance.loaded_value('condition'))))
+    if not created and instance.condition != instance.loaded_value('condition'):
+        events.copy_condition_changed(instance)
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Copy)
+def copy_deleted(sender, instance, **kwargs):
+    sync.record_deletion(instance)
+    availability.refresh_book(instance.book_id)
+    caching.bump_books([instance.book_id])
+    statistics.adjust(circulating_copies=-int(statistics.is_circulating(instance.condition)))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, using, created, **kwargs):
+    availability.refresh_book(instance.pk)
+    search.get_backend(using).index_books([instance.pk])
+    caching.bump_books([instance.pk])
+    if created:
+        statistics.adjust(total_books=1)
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, using, **kwargs):
+    sync.record_deletion(instance)
+    search.get_backend(using).remove_books([instance.pk])
+    caching.bump_books([instance.pk])
+    # Its copies have already been deleted, adjusting the available copies
+    statistics.adjust(total_books=-1)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, using, **kwargs):
+    search.get_backend(using).index_books(category_id=instance.pk)
+    caching.bump('category', 'category:{}'.format(instance.pk))
+    # Books are searched by category name as well, and can be given with
+    # their category expanded
+    caching.bump_books(Book.objects.filter(category_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    sync.record_deletion(instance)
+    caching.bump('category', 'category:{}'.format(instance.pk))
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def configuration_changed(sender, **kwargs):
+    configuration.clear()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Being made inactive or a superuser changes what a user may do
+    permissions.users_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Their loans are about to lose their borrower, by a queryset update
+    Loan.objects.filter(borrower=instance).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        permissions.users_changed([instance.pk])
+    elif pk_set is not None:
+        # e.g. group.user_set.add(user)
+        permissions.users_changed(pk_set)
+    else:
+        # A group or permission cleared of all its users
+        permissions.users_changed()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def group_permissions_changed(sender, action='post_', **kwargs):
+    if action.startswith('post_'):
+        permissions.users_changed()
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    authentication.forget_token(instance.key)
@@ -0,0 +1,108 @@
+"""
+Maintains the LibraryStatistics row behind the home page.
+
+The counts are adjusted by small deltas as books, copies and loans change
+(see library.signals and library.availability), so reading them is a single
+query. recompute() rebuilds them from the underlying tables.
+"""
+from datetime import date
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from library.models import Book, Copy, LibraryStatistics, Loan
+
+STATISTICS_ID = 1
+
+
+def counted_statistics(today=None):
+    """The statistics counted from scratch, as a dict of field values."""
+    today = today or date.today()
+    open_loans = Loan.objects.filter(date_returned__isnull=True)
+    return {
+        'total_books': Book.objects.count(),
+        'circulating_copies': (Copy.objects
+            .exclude(condition__in=Copy.UNAVAILABLE_CONDITIONS).count()),
+        'available_copies': (Book.objects
+            .aggregate(total=Sum('available_copies'))['total'] or 0),
+        'open_loans': open_loans.count(),
+        'overdue_loans': open_loans.filter(return_due__lt=today).count(),
+        'overdue_counted_on': today,
+        }
+
+
+def recompute():
+    """Recount every statistic and store the result."""
+    with transaction.atomic():
+        statistics, _ = LibraryStatistics.objects.update_or_create(
+            pk=STATISTICS_ID, defaults=counted_statistics())
+    return statistics
+
+
+def current():
+    """The stored statistics, recounting overdue loans if that is a day old."""
+    statistics = LibraryStatistics.objects.filter(pk=STATISTICS_ID).first()
+    if statistics is None:
+        return recompute()
+    today = date.today()
+    if statistics.overdue_counted_on != today:
+        statistics.overdue_loans = (Loan.objects
+            .filter(date_returned__isnull=True, return_due__lt=today).count())
+        statistics.overdue_counted_on = today
+        statistics.save(update_fields=['overdue_loans', 'overdue_counted_on'])
+    return statistics
+
+
+def adjust(**deltas):
+    """Add the given deltas to the stored statistics, e.g. adjust(open_loans=1)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = (LibraryStatistics.objects
+        .filter(pk=STATISTICS_ID)
+        .update(**{name: F(name) + delta for name, delta in deltas.items()}))
+    if not updated:
+        # No statistics stored yet; counting includes this change
+        recompute()
+
+
+def is_circulating(condition):
+    return condition is not None and condition not in Copy.UNAVAILABLE_CONDITIONS
+
+
+def loan_state(date_returned, return_due):
+    """The due date of a loan with these dates if it is open, else None, as for no loan."""
+    return return_due if date_returned is None else None
+
+
+def loans_changed(states_before, states_after):
+    """
+    Adjust for loans going from the states before to the states after, each
+    given by loan_state(). overdue_loans was counted on overdue_counted_on,
+    so the loans it includes are those overdue then, not today: a loan that
+    fell overdue since isn't in it, and returning it mustn't take it off.
+    """
+    with transaction.atomic():
+        stored = (LibraryStatistics.objects.select_for_update()
+            .filter(pk=STATISTICS_ID).only('overdue_counted_on').first())
+        if stored is None:
+            # Counting includes these changes
+            recompute()
+            return
+        counted_on = stored.overdue_counted_on
+
+        def counts(states):
+            open_dues = [return_due for return_due in states if return_due is not None]
+            overdue = 0
+            if counted_on is not None:
+                overdue = sum(return_due < counted_on for return_due in open_dues)
+            return len(open_dues), overdue
+
+        open_before, overdue_before = counts(states_before)
+        open_after, overdue_after = counts(states_after)
+        adjust(open_loans=open_after - open_before, overdue_loans=overdue_after - overdue_before)
+
+
+def loan_changed(old_state, new_state):
+    """Adjust for a loan going from one loan_state() to another."""
+    loans_changed([old_state], [new_state])
@@ -0,0 +1,199 @@
+"""
+Incremental sync of the catalogue and loans, for clients that keep a copy
+of them offline, like kiosks and micro:bit gateways.
+
+Categories, books, copies and loans record when they last changed, in
+updated_at, and leave a Tombstone when they are deleted. A client's first
+sync (GET api/v1/sync/) sends every row; each response ends with a token,
+and the next sync with ?since=<token> sends only the rows changed and the
+IDs deleted since the sync that gave out the token. Rows come as lists of
+values in the order of their table's columns, at most batch_size() of each
+table per response; while `more` is true, the client asks again straight
+away with the new token.
+
+A sync covers the changes up to the time it started, and the next one
+starts OVERLAP_SECONDS before that, so that changes committed by
+transactions still running at the time aren't missed. Some rows are sent
+twice as a result; clients apply the deletions, then the rows, as upserts.
+
+Loans moved to the archive by library.archive are deleted as far as sync
+is concerned: clients only keep the loans still in Loan, whether they sync
+from scratch or not.
+
+Tombstones are kept for LIBRARY_SYNC_TOMBSTONE_DAYS (default 90). A client
+that hasn't synced for longer is sent everything again, with `reset` set
+to tell it to drop what it has.
+"""
+from collections import OrderedDict, namedtuple
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from library.models import Book, Category, Copy, Loan, Tombstone
+
+TOKEN_SALT = 'library.sync'
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_TOMBSTONE_DAYS = 90
+# Longer than any transaction that changes the catalogue or loans
+OVERLAP_SECONDS = 60
+
+Table = namedtuple('Table', 'model columns')
+
+TABLES = OrderedDict([
+    ('categories', Table(Category, ('id', 'category'))),
+    ('books', Table(Book, ('id', 'title', 'author', 'edition', 'isbn',
+        'publication_date', 'category_id', 'available_copies'))),
+    ('copies', Table(Copy, ('id', 'book_id', 'copy_number', 'condition',
+        'acquisition_date', 'has_open_loan', 'microbit_id'))),
+    ('loans', Table(Loan, ('id', 'loaned_copy_id', 'borrower_id', 'loan_start',
+        'return_due', 'date_returned'))),
+])
+TABLE_NAMES = {table.model: name for name, table in TABLES.items()}
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def batch_size():
+    return getattr(settings, 'LIBRARY_SYNC_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def tombstone_days():
+    return getattr(settings, 'LIBRARY_SYNC_TOMBSTONE_DAYS', DEFAULT_TOMBSTONE_DAYS)
+
+
+def record_deletion(instance):
+    """Leave a Tombstone for a deleted category, book, copy or loan."""
+    Tombstone.objects.create(table=TABLE_NAMES[type(instance)], object_id=str(instance.pk),
+        borrower_id=getattr(instance, 'borrower_id', None))
+
+
+def record_deletions(model, rows):
+    """
+    Leave Tombstones for rows deleted from model in bulk, without signals;
+    rows are dicts of their fields, with at least the id.
+    """
+    Tombstone.objects.bulk_create([Tombstone(table=TABLE_NAMES[model], object_id=str(row['id']),
+        borrower_id=row.get('borrower_id')) for row in rows])
+
+
+def prune_tombstones():
+    """Delete the tombstones too old for any client to still need, returning how many."""
+    cutoff = timezone.now() - datetime.timedelta(days=tombstone_days())
+    return Tombstone.objects.filter(deleted_at__lt=cutoff).delete()[0]
+
+
+def _dump(value):
+    return None if value is None else value.isoformat()
+
+
+def _load(value):
+    if value is None:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise InvalidToken(value)
+    return moment
+
+
+def encode_token(since, until=None, positions=None):
+    """
+    A sync token. Mid-way through a sync, positions gives the (time, key)
+    of the last row sent from each table, or None for a table finished with.
+    """
+    return signing.dumps({
+        's': _dump(since),
+        'u': _dump(until),
+        'p': {name: None if position is None else [_dump(position[0]), str(position[1])]
+            for name, position in (positions or {}).items()},
+    }, salt=TOKEN_SALT, compress=True)
+
+
+def decode_token(token):
+    """(since, until, positions) from a token; until is None between syncs."""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT)
+        positions = {name: None if position is None else (_load(position[0]), position[1])
+            for name, position in data['p'].items()}
+        return _load(data['s']), _load(data['u']), positions
+    except (signing.BadSignature, KeyError, IndexError, TypeError, ValueError):
+        raise InvalidToken(token)
+
+
+def _page(queryset, time_field, since, until, position, limit):
+    """
+    Up to limit + 1 rows of queryset changed after since, up to until, and
+    after position, in order of time_field and id.
+    """
+    queryset = queryset.filter(**{time_field + '__lte': until})
+    if since is not None:
+        queryset = queryset.filter(**{time_field + '__gt': since})
+    if position is not None:
+        moment, key = position
+        queryset = queryset.filter(Q(**{time_field + '__gt': moment})
+            | Q(**{time_field: moment, 'id__gt': key}))
+    return list(queryset.order_by(time_field, 'id')[:limit + 1])
+
+
+def changes(user, token=None):
+    """
+    The changes user may see since the sync that gave out token (everything
+    without one), as the response data of the sync endpoint.
+    """
+    since, until, positions = decode_token(token) if token else (None, None, {})
+    reset = False
+    if until is None:
+        # Starting a sync
+        until = timezone.now()
+        if since is None:
+            reset = True
+        else:
+            since -= datetime.timedelta(seconds=OVERLAP_SECONDS)
+            if since < until - datetime.timedelta(days=tombstone_days()):
+                since, reset = None, True
+    limit = batch_size()
+
+    data = OrderedDict()
+    next_positions = {}
+    for name, table in TABLES.items():
+        rows = table.model.objects.all()
+        deletions = Tombstone.objects.filter(table=name)
+        if table.model is Loan and not user.has_perm('library.can_view_all_loans'):
+            rows = rows.filter(borrower=user)
+            deletions = deletions.filter(borrower_id=user.pk)
+
+        sent = {}
+        for key, queryset, time_field, fields in (
+                (name, rows, 'updated_at', table.columns),
+                (name + ':deleted', deletions, 'deleted_at', ('id', 'object_id'))):
+            # A client starting afresh has nothing to delete
+            finished = key in positions and positions[key] is None
+            if finished or (since is None and queryset is deletions):
+                sent[key] = []
+                next_positions[key] = None
+                continue
+            page = _page(queryset.values_list(time_field, *fields),
+                time_field, since, until, positions.get(key), limit)
+            sent[key] = page[:limit]
+            next_positions[key] = (page[limit - 1][0], page[limit - 1][1]) if len(page) > limit else None
+
+        if sent[name] or sent[name + ':deleted']:
+            data[name] = OrderedDict([
+                ('columns', table.columns),
+                ('rows', [row[1:] for row in sent[name]]),
+                ('deleted', [row[2] for row in sent[name + ':deleted']]),
+            ])
+
+    more = any(position is not None for position in next_positions.values())
+    return OrderedDict([
+        # Until it's finished, the rest of this sync; then the next
+        ('token', encode_token(since, until, next_positions) if more else encode_token(until)),
+        ('more', more),
+        ('reset', reset),
+        ('changes', data),
+    ])
@@ -0,0 +1,106 @@
+"""
+Records micro:bit heartbeats in bulk.
+
+Copy, Loan and UserMicrobit each carry the `microbit_id` of a device and the
+time it was last heard from, `last_microbit_update`. record_readings() applies
+a batch of (microbit_id, timestamp) readings with one UPDATE per model.
+Copies and loans are synced (see library.sync), so the UPDATE also moves
+their updated_at, and the books whose copies or loans changed have their
+cached responses invalidated, as if the rows had been saved one by one.
+
+Devices ping far more often than anyone needs to know, so a reading is
+coalesced (dropped) if the device's last recorded reading is less than
+LIBRARY_MICROBIT_COALESCE_SECONDS older. The time of each device's last
+recorded reading is kept in the cache, so coalesced readings never reach the
+database. Set the window to 0 to record every reading.
+"""
+from collections import namedtuple
+from functools import reduce
+import operator
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Q, Value, When
+from django.utils import timezone
+
+from library import caching
+from library.models import Copy, Loan, UserMicrobit
+
+DEFAULT_COALESCE_SECONDS = 30
+
+CACHE_KEY = 'library:microbit-seen:{}'
+
+# Devices per UPDATE, keeping the CASE expression's parameters within limits
+UPDATE_BATCH_SIZE = 200
+
+TelemetryResult = namedtuple('TelemetryResult', 'recorded coalesced')
+
+
+def coalesce_seconds():
+    return getattr(settings, 'LIBRARY_MICROBIT_COALESCE_SECONDS', DEFAULT_COALESCE_SECONDS)
+
+
+def latest_readings(readings):
+    """The latest timestamp of each device in (microbit_id, timestamp) readings."""
+    latest = {}
+    for microbit_id, timestamp in readings:
+        if microbit_id not in latest or timestamp > latest[microbit_id]:
+            latest[microbit_id] = timestamp
+    return latest
+
+
+def _update_last_seen(queryset, latest, book_field=None):
+    """
+    Set last_microbit_update on the rows of queryset from a microbit_id:
+    timestamp dict, where it moves forward. For synced models, name the
+    field holding each row's book as book_field, to set updated_at on the
+    rows and invalidate the cached responses of their books.
+    """
+    changed = queryset.filter(reduce(operator.or_, (
+        Q(microbit_id=microbit_id) &
+            (Q(last_microbit_update__isnull=True) | Q(last_microbit_update__lt=timestamp))
+        for microbit_id, timestamp in latest.items())))
+    fields = {'last_microbit_update': Case(
+        *(When(microbit_id=microbit_id, then=Value(timestamp, output_field=DateTimeField()))
+            for microbit_id, timestamp in latest.items()),
+        output_field=DateTimeField())}
+    if book_field is not None:
+        fields['updated_at'] = timezone.now()
+        book_ids = set(changed.order_by().values_list(book_field, flat=True))
+        if book_ids:
+            caching.bump_books(book_ids)
+    return changed.update(**fields)
+
+
+def record_readings(readings, window=None):
+    """
+    Record (microbit_id, timestamp) readings on the copies, open loans and
+    users with those micro:bits, skipping readings within the coalescing window.
+    """
+    window = coalesce_seconds() if window is None else window
+    latest = latest_readings(readings)
+    if window:
+        keys = {microbit_id: CACHE_KEY.format(microbit_id) for microbit_id in latest}
+        seen = cache.get_many(keys.values())
+        due = {microbit_id: timestamp for microbit_id, timestamp in latest.items()
+            if keys[microbit_id] not in seen
+            or timestamp.timestamp() >= seen[keys[microbit_id]] + window}
+    else:
+        due = latest
+
+    if due:
+        devices = sorted(due)
+        with transaction.atomic():
+            for start in range(0, len(devices), UPDATE_BATCH_SIZE):
+                batch = {microbit_id: due[microbit_id]
+                    for microbit_id in devices[start:start + UPDATE_BATCH_SIZE]}
+                _update_last_seen(Copy.objects.all(), batch, 'book')
+                _update_last_seen(Loan.objects.filter(date_returned__isnull=True), batch,
+                    'loaned_copy__book')
+                _update_last_seen(UserMicrobit.objects.all(), batch)
+        if window:
+            cache.set_many(
+                {keys[microbit_id]: timestamp.timestamp() for microbit_id, timestamp in due.items()},
+                timeout=window)
+    return TelemetryResult(recorded=len(due), coalesced=len(readings) - len(due))
@@ -0,0 +1,145 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.contrib.auth.models import User
+
+from library import caching
+from library.models import Book, Category, Copy, Loan
+from library.views import BookViewSet, CategoryViewSet
+import datetime
+import json
+import shutil
+import tempfile
+import threading
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ApiResponseCacheTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.category = Category.objects.create(category='Poetry')
+        for book_id in range(2):
+            book = Book.objects.create(
+                title=f'Title {book_id}',
+                author=f'Person {book_id}',
+                isbn='1234',
+                publication_date=datetime.date.today(),
+                category=cls.category,
+            )
+            Copy.objects.create(
+                book=book,
+                acquisition_date=datetime.date.today(),
+                copy_number=1,
+                condition='M',
+                )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_books(self, pk=None):
+        factory = APIRequestFactory()
+        if pk is None:
+            view = BookViewSet.as_view({'get': 'list'})
+            response = view(factory.get('/library/api/v1/books/'))
+        else:
+            view = BookViewSet.as_view({'get': 'retrieve'})
+            response = view(factory.get('/library/api/v1/books/{}/'.format(pk)), pk=pk)
+        self.assertEqual(response.status_code, 200)
+        response.render()
+        return json.loads(response.content)
+
+    def test_repeated_reads_are_cached(self):
+        book = Book.objects.get(title='Title 0')
+        first_list, first_book = self.get_books(), self.get_books(book.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_books(), first_list)
+            self.assertEqual(self.get_books(book.pk), first_book)
+
+    def test_loans_invalidate_just_their_book(self):
+        lent, other = Book.objects.get(title='Title 0'), Book.objects.get(title='Title 1')
+        self.get_books()
+        self.get_books(lent.pk)
+        self.get_books(other.pk)
+
+        Loan.objects.create(
+            loaned_copy=lent.copies.get(),
+            borrower=self.test_user,
+            loan_start=datetime.date.today(),
+            return_due=datetime.date.today() + datetime.timedelta(weeks=3),
+            )
+        self.assertFalse(self.get_books(lent.pk)['copy_available'])
+        self.assertFalse(self.get_books()['results'][0]['copy_available'])
+        with self.assertNumQueries(0):
+            self.assertTrue(self.get_books(other.pk)['copy_available'])
+
+    def test_book_changes_invalidate(self):
+        book = Book.objects.get(title='Title 0')
+        self.get_books()
+        self.get_books(book.pk)
+
+        book.title = 'New title'
+        book.save()
+        self.assertEqual(self.get_books(book.pk)['title'], 'New title')
+        self.assertIn('New title', [result['title'] for result in self.get_books()['results']])
+
+        book.delete()
+        self.assertEqual(self.get_books()['count'], 1)
+
+    def test_category_changes_invalidate(self):
+        librarian = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='F7NcNDVS')
+        factory = APIRequestFactory()
+        view = CategoryViewSet.as_view({'get': 'list'})
+
+        def get_categories():
+            request = factory.get('/library/api/v1/categories/')
+            force_authenticate(request, user=librarian)
+            response = view(request)
+            response.render()
+            return [result['category'] for result in json.loads(response.content)['results']]
+
+        self.assertEqual(get_categories(), ['Poetry'])
+        self.category.category = 'Verse'
+        self.category.save()
+        self.assertEqual(get_categories(), ['Verse'])
+
+    def test_errors_are_not_cached(self):
+        factory = APIRequestFactory()
+        view = BookViewSet.as_view({'get': 'retrieve'})
+        for _ in range(2):
+            response = view(factory.get('/library/api/v1/books/999/'), pk=999)
+            self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_misses_compute_once(self):
+        computed = []
+        results = []
+        # As if another request were already computing the value
+        cache.add(caching.LOCK_KEY.format('key'), 1)
+        waiter = threading.Thread(target=lambda: results.append(
+            caching.cached_data('key', lambda: computed.append(1) or 'recomputed', 60)))
+        waiter.start()
+        cache.set('key', 'computed', 60)
+        cache.delete(caching.LOCK_KEY.format('key'))
+        waiter.join()
+        self.assertEqual(results, ['computed'])
+        self.assertEqual(computed, [])
+
+    def test_file_based_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory}}):
+            book = Book.objects.get(title='Title 0')
+            first = self.get_books(book.pk)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get_books(book.pk), first)
+            book.title = 'New title'
+            book.save()
+            self.assertEqual(self.get_books(book.pk)['title'], 'New title')
@@ -0,0 +1,113 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User, Group
+
+from library import archive, export
+from library.models import ArchivedLoan, Book, Copy, Loan, LoanReminder
+import datetime
+import io
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ArchiveTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+        cls.other_user = User.objects.create_user(username='otheruser', password='N7F8VDcS')
+        cls.test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        cls.test_librarian.groups.add(Group.objects.get(name='Librarian'))
+        book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date(2019, 7, 29),
+        )
+        cls.copy = Copy.objects.create(book=book, acquisition_date=datetime.date(2019, 1, 1),
+            copy_number=1, condition='G')
+
+        today = datetime.date.today()
+        # 12 loans returned over the last two years, alternating borrowers,
+        # and one still open
+        cls.closed_loans = []
+        for months in range(12):
+            returned = today - datetime.timedelta(days=30 + 60 * months)
+            cls.closed_loans.append(Loan.objects.create(loaned_copy=cls.copy,
+                borrower=cls.test_user if months % 2 else cls.other_user,
+                loan_start=returned - datetime.timedelta(weeks=3),
+                return_due=returned, date_returned=returned))
+        cls.open_loan = Loan.objects.create(loaned_copy=cls.copy, borrower=cls.test_user,
+            loan_start=today, return_due=today + datetime.timedelta(weeks=3))
+        LoanReminder.objects.create(loan=cls.closed_loans[-1], kind=LoanReminder.OVERDUE,
+            return_due=cls.closed_loans[-1].return_due, sent_on=cls.closed_loans[-1].return_due)
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_loans', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_archive_loans(self):
+        # Loans returned 30, 90, ... 690 days ago: the 6 over a year old go
+        self.assertIn('Archived 6 loans', self.archive())
+        self.assertEqual(set(ArchivedLoan.objects.values_list('pk', flat=True)),
+            {loan.pk for loan in self.closed_loans[6:]})
+        self.assertEqual(Loan.objects.count(), 7)
+        self.assertFalse(LoanReminder.objects.exists())
+        archived = ArchivedLoan.objects.get(pk=self.closed_loans[-1].pk)
+        self.assertEqual(archived.date_returned, self.closed_loans[-1].date_returned)
+        self.assertEqual(archived.borrower, self.test_user)
+
+        # Rerunning finds nothing more to do
+        self.assertIn('Archived 0 loans', self.archive())
+        self.assertIn('Archived 5 loans', self.archive('--older-than-days', '31'))
+        self.assertTrue(Copy.objects.get(pk=self.copy.pk).has_open_loan)
+
+    def test_closed_lists_span_both_tables(self):
+        self.archive('--older-than-days', '200')
+        self.assertEqual(ArchivedLoan.objects.count(), 9)
+        expected = [loan.pk for loan in self.closed_loans]
+
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        response = self.client.get(reverse('all_open_closed_loans'))
+        seen = [loan.pk for loan in response.context['closed_loan_list']]
+        response = self.client.get(reverse('all_open_closed_loans')
+            + response.context['closed_page_obj'].next_url)
+        seen += [loan.pk for loan in response.context['closed_loan_list']]
+        self.assertEqual(seen, expected)
+        self.assertFalse(response.context['closed_page_obj'].has_next())
+        response = self.client.get(reverse('all_open_closed_loans')
+            + response.context['closed_page_obj'].previous_url)
+        self.assertEqual([loan.pk for loan in response.context['closed_loan_list']], expected[:10])
+        # The copies, books and borrowers are loaded with the loans, not one by one
+        with self.assertNumQueries(5):
+            self.client.get(reverse('all_open_closed_loans'))
+
+        client = APIClient()
+        client.force_authenticate(self.test_user)
+        response = client.get('/library/api/v1/myloans/?closed=true')
+        self.assertEqual([loan['url'].split('/')[-2] for loan in response.data['results']],
+            [str(loan.pk) for loan in self.closed_loans[1::2]])
+
+        # Archived loans can be read but not changed
+        url = response.data['results'][-1]['url']
+        self.assertEqual(client.get(url + '?closed=true').status_code, 200)
+        client.force_authenticate(self.test_librarian)
+        self.assertEqual(client.get(url + '?closed=true').status_code, 200)
+        self.assertEqual(client.patch(url + '?closed=true',
+            {'return_due': '2019-01-01'}).status_code, 404)
+
+        rows = list(export.rows('loans'))
+        self.assertEqual(len(rows), 13)
+
+    def test_closed_loans_of_borrower(self):
+        self.archive('--older-than-days', '200')
+        loans = archive.closed_loans(borrower_id=self.other_user.pk)
+        self.assertEqual(sum(queryset.count() for queryset in loans), 6)
@@ -0,0 +1,115 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User, Group
+
+from library import authentication, caching, permissions
+import base64
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ApiAuthenticationTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+
+    def setUp(self):
+        # Rolling back the last test's changes didn't forget the users it cached
+        cache.clear()
+        self.client = APIClient()
+
+    def basic(self, password='F7NcNDVS'):
+        credentials = base64.b64encode('testuser:{}'.format(password).encode()).decode()
+        return 'Basic ' + credentials
+
+    def get_loans(self, authorization):
+        return self.client.get('/library/api/v1/myloans/', HTTP_AUTHORIZATION=authorization)
+
+    def exchange(self):
+        response = self.client.post('/library/api/v1/tokens/', HTTP_AUTHORIZATION=self.basic())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['expires_in'], 3600)
+        return 'Bearer ' + response.data['token']
+
+    def test_signed_token(self):
+        bearer = self.exchange()
+        self.assertEqual(self.get_loans(bearer).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_loans(bearer).status_code, 200)
+        # Only the loans are queried
+        self.assertEqual([query['sql'] for query in queries if 'auth_' in query['sql']], [])
+        # The cached user has no password hash
+        key = authentication.USER_KEY.format(self.test_user.pk,
+            *caching.get_versions(permissions.USER_SCOPE.format(self.test_user.pk)))
+        self.assertEqual(cache.get(key)['username'], 'testuser')
+        self.assertNotIn(self.test_user.password, str(cache.get(key)))
+
+        self.assertEqual(self.get_loans(bearer[:-2] + 'xx').status_code, 401)
+        with override_settings(LIBRARY_API_TOKEN_SECONDS=-1):
+            response = self.get_loans(bearer)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('expired', response.data['detail'])
+
+        # A signed token can't be traded for another
+        response = self.client.post('/library/api/v1/tokens/', HTTP_AUTHORIZATION=bearer)
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/library/api/v1/tokens/', HTTP_AUTHORIZATION=self.basic('wrong'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_change_revokes_signed_tokens(self):
+        bearer = self.exchange()
+        self.test_user.set_password('VDNcN7F8')
+        self.test_user.save()
+        self.assertEqual(self.get_loans(bearer).status_code, 401)
+
+        self.test_user.set_password('F7NcNDVS')
+        self.test_user.is_active = False
+        self.test_user.save()
+        self.assertEqual(self.get_loans(bearer).status_code, 401)
+
+    def test_cached_users_expire(self):
+        bearer = self.exchange()
+        with override_settings(LIBRARY_USER_CACHE_SECONDS=0):
+            self.assertEqual(self.get_loans(bearer).status_code, 200)
+            # As another worker, with its own cache, would see the user
+            # deactivated: updating the row sends no signals
+            User.objects.filter(pk=self.test_user.pk).update(is_active=False)
+            self.assertEqual(self.get_loans(bearer).status_code, 401)
+
+    def test_cached_drf_token(self):
+        header = 'Token ' + Token.objects.create(user=self.test_user).key
+        self.assertEqual(self.get_loans(header).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_loans(header).status_code, 200)
+        self.assertEqual([query['sql'] for query in queries if 'auth' in query['sql']], [])
+
+        Token.objects.get(user=self.test_user).delete()
+        self.assertEqual(self.get_loans(header).status_code, 401)
+
+    def test_metrics(self):
+        before = authentication.metrics().get('signed_token', {})
+        bearer = self.exchange()
+        self.get_loans(bearer)
+        self.get_loans('Bearer nonsense')
+        after = authentication.metrics()
+        self.assertEqual(after['signed_token']['authenticated'], before.get('authenticated', 0) + 1)
+        self.assertEqual(after['signed_token']['rejected'], before.get('rejected', 0) + 1)
+        self.assertGreater(after['basic']['cpu_ms_per_request'], 0)
+
+        self.assertEqual(self.client.get('/library/api/v1/authmetrics/',
+            HTTP_AUTHORIZATION=bearer).status_code, 403)
+        User.objects.create_superuser('testadmin', 'admin@example.com', 'X2ubE3Ak')
+        self.client.login(username='testadmin', password='X2ubE3Ak')
+        response = self.client.get('/library/api/v1/authmetrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('basic', response.data)
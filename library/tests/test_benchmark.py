@@ -0,0 +1,73 @@
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+
+from django.contrib.auth.models import User
+
+from library import benchmark, statistics
+from library.models import Book, Copy, Loan
+from io import StringIO
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class SeedLibraryTest(TestCase):
+
+    fixtures = ['config',]
+
+    def seed(self, **options):
+        call_command('seed_library', books=50, users=10, loans=200, stdout=StringIO(), **options)
+
+    def test_seeded_library_is_consistent(self):
+        self.seed()
+        self.assertEqual(Book.objects.count(), 50)
+        self.assertEqual(User.objects.filter(groups__name='Library user').count(), 10)
+        self.assertEqual(Loan.objects.count(), 200)
+
+        open_loans = Loan.objects.filter(date_returned__isnull=True)
+        self.assertTrue(open_loans.exists())
+        # At most one open loan per copy, and none of lost or destroyed copies
+        self.assertFalse(open_loans.values('loaned_copy')
+            .annotate(loans=Count('pk')).filter(loans__gt=1).exists())
+        self.assertFalse(open_loans
+            .filter(loaned_copy__condition__in=Copy.UNAVAILABLE_CONDITIONS).exists())
+
+        stored = statistics.current()
+        for name, value in statistics.counted_statistics().items():
+            self.assertEqual(getattr(stored, name), value, name)
+
+    def test_same_seed_same_library(self):
+        self.seed(seed=3)
+        first = list(Book.objects.order_by('pk').values_list('title', 'author', 'isbn'))
+        Book.objects.all().delete()
+        self.seed(seed=3)
+        self.assertEqual(list(Book.objects.order_by('pk').values_list('title', 'author', 'isbn')), first)
+
+
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class BenchmarkTest(TestCase):
+
+    fixtures = ['config',]
+
+    def test_every_url_is_benchmarked(self):
+        call_command('seed_library', books=5, users=5, loans=20, open_fraction=1.0, stdout=StringIO())
+        routes = {route for route, name, path in benchmark.benchmark_urls()}
+        for route in ('', 'book/{pk}', 'loan/{pk}/renew/', 'issue-to/{user_pk}',
+                'api/v1/books/', 'api/v1/loans/{pk}/', 'api/v1/'):
+            self.assertIn(route, routes)
+        # Not the format suffix variants, nor the API's log in and out pages
+        self.assertFalse([route for route in routes if 'format' in route or 'login' in route])
+
+    def test_measure_and_compare(self):
+        librarian = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='F7NcNDVS')
+        client = Client()
+        client.force_login(librarian)
+        result = benchmark.measure(client, '/library/', repeat=1)
+        self.assertEqual(result['status'], 200)
+        self.assertGreater(result['queries'], 0)
+        self.assertGreater(result['peak_kb'], 0)
+
+        self.assertEqual(benchmark.compare({'': result}, {'': result}), [])
+        budget = dict(result, queries=result['queries'] - 1)
+        self.assertEqual(len(benchmark.compare({'': result}, {'': budget})), 1)
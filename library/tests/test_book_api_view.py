@@ -1,10 +1,11 @@
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIRequestFactory, force_authenticate
 
 from django.contrib.auth.models import User, Group
 
-from library.models import Book
+from library.models import Book, Category, Copy, Loan
 from library.views import BookViewSet
 import datetime
 import json
@@ -160,3 +161,139 @@ class BookViewCreationTest(TestCase):
         force_authenticate(request, user=user)
         response = view(request, pk=self.test_book.pk)
         self.assertEqual(response.status_code, 200)
+
+class BookViewQueryCountTest(TestCase):
+
+    fixtures = ['config',]
+
+    def create_books(self, number_of_books, copies_per_book):
+        for book_id in range(number_of_books):
+            book = Book.objects.create(
+                title=f'Title {book_id}',
+                author=f'Person {book_id}',
+                isbn='1234',
+                publication_date=datetime.date.today(),
+            )
+            for copy_number in range(copies_per_book):
+                Copy.objects.create(
+                    book=book,
+                    acquisition_date=datetime.date.today(),
+                    copy_number=copy_number,
+                    condition='M',
+                    )
+
+    def get_books_page(self):
+        factory = APIRequestFactory()
+        view = BookViewSet.as_view({'get': 'list'})
+        response = view(factory.get('/library/api/v1/books'))
+        response.render()
+        return json.loads(response.content)
+
+    def test_page_query_count_is_constant(self):
+        # count, page of books, prefetched copies
+        self.create_books(2, 1)
+        with self.assertNumQueries(3):
+            self.get_books_page()
+
+        self.create_books(10, 4)
+        with self.assertNumQueries(3):
+            response_json = self.get_books_page()
+        self.assertEqual(len(response_json['results']), 10)
+
+    def test_copy_available_reads_open_loans(self):
+        self.create_books(1, 1)
+        user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        Loan.objects.create(
+            loaned_copy=Copy.objects.get(),
+            borrower=user,
+            loan_start=datetime.date.today(),
+            return_due=datetime.date.today(),
+            )
+        response_json = self.get_books_page()
+        self.assertFalse(response_json['results'][0]['copy_available'])
+        self.assertEqual(len(response_json['results'][0]['copies']), 1)
+
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class BookRepresentationTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(
+            title='Title',
+            author='Person',
+            isbn='1234',
+            publication_date=datetime.date(2019, 7, 29),
+        )
+        cls.copies = [Copy.objects.create(
+            book=cls.book,
+            acquisition_date=datetime.date.today(),
+            copy_number=copy_number,
+            condition='M',
+            ) for copy_number in range(2)]
+
+    def setUp(self):
+        # The API responses are cached
+        cache.clear()
+
+    def test_hyperlinks(self):
+        response = self.client.get('/library/api/v1/books/')
+        book = response.json()['results'][0]
+        self.assertEqual(book['url'], 'http://testserver' + reverse('book-detail', args=[self.book.pk]))
+        self.assertEqual(book['copies'], ['http://testserver' + reverse('copy-detail', args=[copy.pk])
+            for copy in self.copies])
+
+        response = self.client.get('/library/api/v1/books/{}.json'.format(self.book.pk))
+        self.assertEqual(response.json()['url'],
+            'http://testserver/library/api/v1/books/{}.json'.format(self.book.pk))
+
+    def test_compact(self):
+        expected = {
+            'id': self.book.pk, 't': 'Title', 'a': 'Person', 'cat': None, 'isbn': '1234',
+            'av': True, 'pd': '2019-07-29', 'cps': [copy.pk for copy in self.copies], 'th': None,
+            }
+        response = self.client.get('/library/api/v1/books/?format=compact')
+        self.assertEqual(response['Content-Type'], 'application/vnd.library.compact+json')
+        self.assertEqual(json.loads(response.content)['results'], [expected])
+
+        # Not the cached response with hyperlinks
+        self.client.get('/library/api/v1/books/{}/'.format(self.book.pk))
+        response = self.client.get('/library/api/v1/books/{}/'.format(self.book.pk),
+            HTTP_ACCEPT='application/vnd.library.compact+json')
+        self.assertEqual(json.loads(response.content), expected)
+        self.assertEqual(response['Vary'], 'Accept, Cookie')
+
+    def test_sparse_fields(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/library/api/v1/books/?fields=title,author,thumbnail')
+        self.assertEqual(response.json()['results'], [{'title': 'Title', 'author': 'Person', 'thumbnail': None}])
+
+        response = self.client.get('/library/api/v1/books/?fields=title,shelf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('shelf', response.json()['fields'])
+
+    def test_expand(self):
+        category = Category.objects.create(category='Poetry')
+        self.book.category = category
+        self.book.save()
+        Loan.objects.create(loaned_copy=self.copies[1],
+            borrower=User.objects.create_user(username='testuser', password='F7NcNDVS'),
+            loan_start=datetime.date.today(), return_due=datetime.date.today())
+
+        # count, books with their categories, copies with their loan state
+        with self.assertNumQueries(3):
+            response = self.client.get('/library/api/v1/books/?expand=copies,category')
+        book = response.json()['results'][0]
+        self.assertEqual(book['category']['category'], 'Poetry')
+        self.assertEqual([(copy['copy_number'], copy['on_loan']) for copy in book['copies']],
+            [(0, False), (1, True)])
+
+        detail = '/library/api/v1/books/{}/?expand=category'.format(self.book.pk)
+        self.assertEqual(self.client.get(detail).json()['category']['category'], 'Poetry')
+        category.category = 'Verse'
+        category.save()
+        self.assertEqual(self.client.get(detail).json()['category']['category'], 'Verse')
+
+        response = self.client.get('/library/api/v1/books/?expand=title')
+        self.assertEqual(response.status_code, 400)
@@ -1,7 +1,10 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from library.models import Book
+from library.models import Book, Copy
 import datetime
 
 # Override the compiled static file storage for testing, 
@@ -54,3 +57,39 @@ class BookListAllViewTest(TestCase):
         self.assertTrue(response.context['book_list'].has_previous() == True)
         self.assertTrue(response.context['book_list'].has_next() == False)
         self.assertTrue(len(response.context['book_list']) == 3)
+
+    def test_cards_are_cached_until_the_book_changes(self):
+        cache.clear()
+        book = Book.objects.get(title='Title 10')
+        copy = Copy.objects.create(book=book, acquisition_date=datetime.date.today(),
+            copy_number=1, condition='G')
+        response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'Available', count=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'Title 12')
+        # Just the count and the page of books
+        self.assertEqual(len(queries), 2)
+
+        copy.condition = 'L'
+        copy.save()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_list'))
+        self.assertNotContains(response, 'Available')
+        # Rendering the changed book's card takes no more queries
+        self.assertEqual(len(queries), 2)
+
+    def test_copy_list_is_cached_until_a_copy_changes(self):
+        cache.clear()
+        book = Book.objects.get(title='Title 10')
+        copy = Copy.objects.create(book=book, acquisition_date=datetime.date.today(),
+            copy_number=7, condition='G')
+        self.assertContains(self.client.get(book.get_absolute_url()), 'Good')
+        with self.assertNumQueries(1):
+            response = self.client.get(book.get_absolute_url())
+        self.assertContains(response, 'Copy number:</strong> 7')
+
+        copy.condition = 'W'
+        copy.save()
+        self.assertContains(self.client.get(book.get_absolute_url()), 'Worn')
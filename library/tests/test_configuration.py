@@ -0,0 +1,64 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from django.contrib.auth.models import User, Group
+
+from library import configuration
+from library.forms import RenewLoanForm
+from library.models import Configuration
+import datetime
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConfigurationTest(TestCase):
+
+    fixtures = ['config',]
+
+    def setUp(self):
+        # The test's rollback doesn't clear the cached configuration
+        self.addCleanup(configuration.clear)
+
+    def test_cached_until_saved(self):
+        self.assertEqual(configuration.get().maxbooksonloan, 5)
+        with self.assertNumQueries(0):
+            policies = configuration.get()
+        self.assertEqual(policies.default_return_due(datetime.date(2019, 1, 1)),
+            datetime.date(2019, 1, 22))
+
+        stored = Configuration.objects.get()
+        stored.maxbooksonloan = 2
+        stored.max_renewal_weeks = 6
+        stored.save()
+        self.assertEqual(configuration.get().maxbooksonloan, 2)
+
+        form = RenewLoanForm(data={'renewal_date': datetime.date.today() + datetime.timedelta(weeks=5)})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.fields['renewal_date'].help_text,
+            'Enter a date between now and 6 weeks (default 3).')
+
+    def test_shared_cache_survives_the_local_copy(self):
+        configuration.get()
+        with override_settings(LIBRARY_CONFIGURATION_LOCAL_SECONDS=0):
+            with self.assertNumQueries(0):
+                configuration.get()
+
+    def test_no_configuration(self):
+        Configuration.objects.all().delete()
+        self.assertIsNone(configuration.get().maxbooksonloan)
+        self.assertEqual(configuration.get().default_loan_weeks, 3)
+
+    def test_issue_page_does_not_query_configuration(self):
+        librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        librarian.groups.add(Group.objects.get(name='Librarian'))
+        borrower = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        url = reverse('issue_to_user', args=[borrower.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'out of 5')
+        self.assertFalse([query for query in queries if 'library_configuration' in query['sql']])
@@ -0,0 +1,62 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from django.contrib.auth.models import User
+
+from library.models import Book, Copy, Loan
+from library.views import CopyViewSet
+import datetime
+import json
+
+# Override the compiled static file storage for testing, 
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class CopyListViewTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        test_book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        # Create 12 copies, loan out every third one and lose every fourth one
+        for copy_number in range(12):
+            copy = Copy.objects.create(
+                book=test_book,
+                acquisition_date=datetime.date.today(),
+                copy_number=copy_number,
+                condition='L' if copy_number % 4 == 0 else 'M',
+                )
+            if copy_number % 3 == 0:
+                Loan.objects.create(
+                    loaned_copy=copy,
+                    borrower=test_user,
+                    loan_start=datetime.date.today(),
+                    return_due=datetime.date.today() + datetime.timedelta(weeks=3),
+                    )
+
+    def get_copies_page(self, page=1):
+        factory = APIRequestFactory()
+        view = CopyViewSet.as_view({'get': 'list'})
+        response = view(factory.get('/library/api/v1/copies/', {'page': page}))
+        self.assertEqual(response.status_code, 200)
+        response.render()
+        return json.loads(response.content)
+
+    def test_page_query_count_is_constant(self):
+        # count and page of copies, whatever the page size
+        with self.assertNumQueries(2):
+            self.get_copies_page()
+
+    def test_loan_state_fields(self):
+        copies = self.get_copies_page()['results'] + self.get_copies_page(2)['results']
+        self.assertEqual(len(copies), 12)
+        for copy in copies:
+            self.assertEqual(copy['on_loan'], copy['copy_number'] % 3 == 0)
+            self.assertEqual(copy['available'], 
+                copy['copy_number'] % 3 != 0 and copy['copy_number'] % 4 != 0)
@@ -0,0 +1,176 @@
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from django.contrib.auth.models import User, Group
+
+from library import authentication, events, loans
+from library.event_stream import stream_events
+from library.models import Book, Copy
+from unittest import mock
+import datetime
+import json
+
+
+def create_copies(count):
+    book = Book.objects.create(
+        title='Test title',
+        author='Test author',
+        isbn='1234',
+        publication_date=datetime.date(2019, 7, 29),
+    )
+    return [Copy.objects.create(book=book, acquisition_date=datetime.date(2019, 1, 1),
+        copy_number=copy_number, condition='G') for copy_number in range(count)]
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class EventPublishingTest(TransactionTestCase):
+    """Events are published as loans and copies change, once committed."""
+
+    fixtures = ['config',]
+
+    def test_loan_and_copy_events(self):
+        copies = create_copies(3)
+        borrower = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        due = datetime.date.today() + datetime.timedelta(weeks=3)
+        last = events.hub.publish('test.start', {'copy': None}).id
+
+        loan = loans.issue(copies[0], borrower, due)
+        loans.renew(loan, due + datetime.timedelta(weeks=1))
+        loans.return_loan(loan)
+        loans.issue_batch(borrower, due, copy_ids=[copies[1].pk, copies[2].pk])
+        loans.return_batch(copy_ids=[copies[1].pk])
+        copies[0].condition = 'D'
+        copies[0].save()
+
+        published = events.hub.recent(last)
+        self.assertEqual([event.type for event in published], [
+            events.LOAN_CREATED, events.LOAN_RENEWED, events.LOAN_RETURNED,
+            events.LOAN_CREATED, events.LOAN_CREATED, events.LOAN_RETURNED,
+            events.COPY_CONDITION])
+        self.assertEqual(published[0].data['loan'], str(loan.pk))
+        self.assertEqual(published[0].data['borrower'], borrower.pk)
+        self.assertEqual(published[0].data['book'], copies[0].book_id)
+        self.assertEqual(published[5].data['copy'], copies[1].pk)
+        self.assertEqual(published[6].data['condition'], 'D')
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class EventStreamTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+        cls.other_user = User.objects.create_user(username='otheruser', password='N7F8VDcS')
+        cls.test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        cls.test_librarian.groups.add(Group.objects.get(name='Librarian'))
+
+    def scope(self, user=None, query='', headers=()):
+        headers = list(headers)
+        if user is not None:
+            headers.append((b'authorization',
+                'Bearer {}'.format(authentication.issue_token(user)).encode()))
+        return {'type': 'http', 'method': 'GET', 'path': '/library/api/v1/events/',
+            'query_string': query.encode(), 'headers': headers}
+
+    def publish(self, borrower, copy=1):
+        return events.hub.publish(events.LOAN_CREATED, {'copy': copy, 'borrower': borrower.pk})
+
+    async def open_stream(self, scope):
+        stream = ApplicationCommunicator(stream_events, scope)
+        await stream.send_input({'type': 'http.request'})
+        start = await stream.receive_output(timeout=5)
+        return stream, start
+
+    def response(self, scope):
+        async def request():
+            stream, start = await self.open_stream(scope)
+            body = await stream.receive_output(timeout=5)
+            return start['status'], json.loads(body['body'].decode())
+        return async_to_sync(request)()
+
+    def test_events_of_own_loans(self):
+        async def listen():
+            stream, start = await self.open_stream(self.scope(self.test_user))
+            self.assertEqual(start['status'], 200)
+            self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), start['headers'])
+            self.assertEqual((await stream.receive_output(timeout=5))['body'], b'retry: 5000\n\n')
+
+            self.publish(self.other_user)
+            event = self.publish(self.test_user)
+            body = (await stream.receive_output(timeout=5))['body'].decode()
+            lines = body.splitlines()
+            self.assertEqual(lines[:2], ['id: {}'.format(event.id), 'event: loan.created'])
+            self.assertEqual(json.loads(lines[2][len('data: '):])['borrower'], self.test_user.pk)
+
+            subscribers = events.hub.subscriber_count()
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(timeout=5)
+            self.assertEqual(events.hub.subscriber_count(), subscribers - 1)
+        async_to_sync(listen)()
+
+    def test_filters_and_reconnecting(self):
+        missed = self.publish(self.other_user, copy=2)
+        self.publish(self.other_user, copy=3)
+
+        async def reconnect():
+            scope = self.scope(self.test_librarian, query='copy=2',
+                headers=[(b'last-event-id', str(missed.id - 1).encode())])
+            stream, start = await self.open_stream(scope)
+            await stream.receive_output(timeout=5)
+            body = (await stream.receive_output(timeout=5))['body'].decode()
+            self.assertTrue(body.startswith('id: {}\n'.format(missed.id)))
+            self.assertTrue(await stream.receive_nothing(timeout=0.1))
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(timeout=5)
+        async_to_sync(reconnect)()
+
+    def test_reconnecting_after_more_events_than_the_queue_holds(self):
+        hub = events.Hub(queue_size=3)
+        missed = [hub.publish(events.LOAN_CREATED, {'copy': 1, 'borrower': self.test_user.pk})
+            for _ in range(10)]
+
+        async def reconnect():
+            scope = self.scope(self.test_user, headers=[(b'last-event-id', b'0')])
+            stream, start = await self.open_stream(scope)
+            await stream.receive_output(timeout=5)
+            body = (await stream.receive_output(timeout=5))['body'].decode()
+            self.assertEqual([line for line in body.splitlines() if line.startswith('id: ')],
+                ['id: {}'.format(event.id) for event in missed])
+
+            # Live events follow
+            event = hub.publish(events.LOAN_RETURNED, {'copy': 1, 'borrower': self.test_user.pk})
+            body = (await stream.receive_output(timeout=5))['body'].decode()
+            self.assertTrue(body.startswith('id: {}\n'.format(event.id)))
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(timeout=5)
+        with mock.patch.object(events, 'hub', hub):
+            async_to_sync(reconnect)()
+
+    @override_settings(LIBRARY_EVENTS_HEARTBEAT_SECONDS=0.01)
+    def test_heartbeat(self):
+        async def idle():
+            stream, start = await self.open_stream(self.scope(self.test_user))
+            await stream.receive_output(timeout=5)
+            self.assertEqual((await stream.receive_output(timeout=5))['body'], b': keepalive\n\n')
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(timeout=5)
+        async_to_sync(idle)()
+
+    def test_errors(self):
+        status, body = self.response(self.scope())
+        self.assertEqual(status, 401)
+        status, body = self.response(self.scope(query='token=nonsense'))
+        self.assertEqual((status, body['detail']), (401, 'Invalid token.'))
+        status, body = self.response(self.scope(self.test_user,
+            query='borrower={}'.format(self.other_user.pk)))
+        self.assertEqual(status, 403)
+        status, body = self.response(self.scope(self.test_librarian, query='copy=first'))
+        self.assertEqual(status, 400)
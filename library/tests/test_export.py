@@ -0,0 +1,95 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from django.contrib.auth.models import User, Group
+
+from library.models import Book, Copy, Loan
+import csv
+import datetime
+import io
+import json
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ExportTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+        cls.test_assistant = User.objects.create_user(username='testassistant', password='ubE3AkCa')
+        cls.test_assistant.groups.add(Group.objects.get(name='Library assistant'))
+
+        book = Book.objects.create(
+            title='Test, "quoted" title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date(2019, 7, 29),
+        )
+        copies = [Copy.objects.create(
+            book=book,
+            acquisition_date=datetime.date.today(),
+            copy_number=copy_number,
+            condition='G',
+            ) for copy_number in range(3)]
+        for copy in copies:
+            Loan.objects.create(loaned_copy=copy, borrower=cls.test_user,
+                loan_start=datetime.date(2019, 1, 1), return_due=datetime.date(2019, 1, 22),
+                date_returned=datetime.date(2019, 1, 20))
+        cls.open_loan = Loan.objects.create(loaned_copy=copies[0], borrower=cls.test_user,
+            loan_start=datetime.date(2019, 2, 1), return_due=datetime.date(2019, 2, 22))
+
+    def export(self, path, user=None):
+        self.client.force_login(user or self.test_assistant)
+        response = self.client.get('/library/api/v1/exports/' + path)
+        if response.streaming:
+            response.text = b''.join(response.streaming_content).decode()
+        return response
+
+    def test_csv(self):
+        response = self.export('loans/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="loans.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row['title'] for row in rows}, {'Test, "quoted" title'})
+        open_row = next(row for row in rows if row['id'] == str(self.open_loan.pk))
+        self.assertEqual(open_row['date_returned'], '')
+        self.assertEqual(open_row['borrower'], 'testuser')
+        self.assertEqual(open_row['copy_number'], '0')
+
+    def test_ndjson(self):
+        response = self.export('copies/?format=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        copies = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([copy['copy_number'] for copy in copies], [0, 1, 2])
+        self.assertEqual([copy['on_loan'] for copy in copies], [True, False, False])
+
+        response = self.export('books.ndjson')
+        self.assertEqual(json.loads(response.text)['publication_date'], '2019-07-29')
+
+    def test_errors(self):
+        response = self.export('loans/', user=self.test_user)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.export('books/', user=self.test_user).status_code, 200)
+        response = self.export('shelves/')
+        self.assertEqual(response.status_code, 404)
+        # Errors come in the format asked for
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        error = next(csv.DictReader(io.StringIO(response.content.decode())))
+        self.assertIn('shelves', error['detail'])
+        response = self.export('shelves/?format=ndjson')
+        self.assertIn('shelves', json.loads(response.content.decode())['detail'])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_library', 'loans', '--format', 'ndjson', '--chunk-size', '2', stdout=out)
+        loans = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(loans), 4)
+        self.assertEqual({loan['borrower_id'] for loan in loans}, {self.test_user.pk})
@@ -0,0 +1,101 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from library import search, statistics
+from library.models import Book, Category, Copy
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+CSV_CATALOGUE = """title,author,isbn,publication_date,category,copies,condition
+Imported Python,Ada Author,978-0000000001,2018-05-01,Programming,2,G
+Imported Django,Bea Author,978-0000000002,2019-01-15,Programming,1,
+Imported Poems,Cy Author,978-0000000003,2017-03-09,Poetry,3,W
+No Date,Di Author,978-0000000004,,Poetry,1,G
+Imported Python,Ada Author,978-0000000001,2018-05-01,Programming,5,G
+"""
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ImportCatalogueTest(TestCase):
+
+    fixtures = ['config', 'small_test_data.json',]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as catalogue:
+            catalogue.write(content)
+        return path
+
+    def import_catalogue(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalogue', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_csv(self):
+        books_before = Book.objects.count()
+        out, err = self.import_catalogue(self.write_file('catalogue.csv', CSV_CATALOGUE))
+
+        self.assertEqual(Book.objects.count(), books_before + 3)
+        self.assertIn('Skipping record 4', err)
+        self.assertIn('3 new books, 6 new copies, 1 records skipped', out)
+
+        python = Book.objects.get(isbn='978-0000000001')
+        # The first record for an ISBN wins
+        self.assertEqual(python.copies.count(), 2)
+        self.assertEqual(list(python.copies.values_list('copy_number', flat=True)), [1, 2])
+        self.assertEqual(python.category.category, 'Programming')
+        self.assertEqual(Category.objects.filter(category='Programming').count(), 1)
+
+        # bulk_create skipped the signals, but the derived state is up to date
+        self.assertEqual(python.available_copies, 2)
+        poems = Book.objects.get(isbn='978-0000000003')
+        self.assertEqual(poems.copies.filter(condition='W').count(), 3)
+        self.assertEqual(
+            list(search.search_books(Book.objects.all(), ['imported', 'django'])),
+            [Book.objects.get(isbn='978-0000000002')])
+        stored = statistics.current()
+        for name, value in statistics.counted_statistics().items():
+            self.assertEqual(getattr(stored, name), value, name)
+
+    def test_reimport_only_tops_up_copies(self):
+        path = self.write_file('catalogue.csv', CSV_CATALOGUE)
+        self.import_catalogue(path)
+        books_before, copies_before = Book.objects.count(), Copy.objects.count()
+
+        self.import_catalogue(path)
+        self.assertEqual(Book.objects.count(), books_before)
+        self.assertEqual(Copy.objects.count(), copies_before)
+
+        more = self.write_file('more.ndjson', json.dumps({
+            'title': 'Imported Python', 'author': 'Ada Author', 'isbn': '978-0000000001',
+            'publication_date': '2018-05-01', 'copies': 4}) + '\n')
+        self.import_catalogue(more)
+        python = Book.objects.get(isbn='978-0000000001')
+        self.assertEqual(list(python.copies.values_list('copy_number', flat=True)), [1, 2, 3, 4])
+        self.assertEqual(python.available_copies, 4)
+
+    def test_resumes_from_checkpoint(self):
+        path = self.write_file('catalogue.ndjson', '\n'.join(json.dumps({
+            'title': 'Book {}'.format(number), 'author': 'Author',
+            'isbn': 'ISBN-{}'.format(number), 'publication_date': '2020-01-01',
+            }) for number in range(1, 6)))
+        # As if an earlier run had imported the first three records and stopped
+        checkpoint = path + '.checkpoint'
+        with open(checkpoint, 'w') as checkpoint_file:
+            json.dump({'records': 3}, checkpoint_file)
+
+        out, err = self.import_catalogue(path, chunk_size=1)
+        self.assertIn('Resuming after record 3', out)
+        self.assertEqual(
+            sorted(Book.objects.filter(isbn__startswith='ISBN-').values_list('isbn', flat=True)),
+            ['ISBN-4', 'ISBN-5'])
+        # Finished, so the checkpoint is removed
+        self.assertFalse(os.path.exists(checkpoint))
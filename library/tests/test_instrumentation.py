@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.shortcuts import render
+from django.test import TestCase, modify_settings, override_settings
+from django.urls import path, reverse
+from rest_framework import serializers
+
+from django.contrib.auth.models import User, Group
+
+from library.instrumentation import NPlusOneError, fingerprint, record_queries
+from library.models import Book, Copy, Loan
+import datetime
+
+
+class LoanTitleSerializer(serializers.Serializer):
+    title = serializers.CharField(source='loaned_copy.book.title')
+
+
+# A page loading each loan's copy and book, whatever the real pages do
+LOAN_TITLES_TEMPLATES = [dict(settings.TEMPLATES[0], APP_DIRS=False, OPTIONS={'loaders': [
+    ('django.template.loaders.locmem.Loader', {
+        'tests/loan_titles.html':
+            '<ul>\n'
+            '{% for loan in loans %}\n'
+            '  <li>{{ loan.loaned_copy.book.title }}</li>\n'
+            '{% endfor %}\n'
+            '</ul>\n'}),
+    ]})]
+
+
+def loan_titles(request):
+    return render(request, 'tests/loan_titles.html', {'loans': Loan.objects.all()})
+
+
+urlpatterns = [
+    path('loan-titles/', loan_titles, name='loan_titles'),
+]
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+@modify_settings(MIDDLEWARE={'append': 'library.instrumentation.QueryInstrumentationMiddleware'})
+class QueryInstrumentationTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        cls.test_librarian.groups.add(Group.objects.get(name='Librarian'))
+        test_book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        for copy_number in range(1, 5):
+            copy = Copy.objects.create(
+                book=test_book,
+                acquisition_date=datetime.date.today(),
+                copy_number=copy_number,
+                condition='G',
+                )
+            Loan.objects.create(
+                loaned_copy=copy,
+                borrower=cls.test_librarian,
+                loan_start=datetime.date.today(),
+                return_due=datetime.date.today() + datetime.timedelta(weeks=3),
+                )
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(
+            fingerprint('SELECT id FROM t WHERE id IN (%s, %s,  %s)'),
+            fingerprint('SELECT id FROM t WHERE id IN (%s)'))
+
+    def test_records_lazy_loads_in_code(self):
+        with record_queries() as recorder:
+            titles = [loan.loaned_copy.book.title for loan in Loan.objects.all()]
+        self.assertEqual(len(titles), 4)
+        # The loans, then a copy and a book for each
+        self.assertEqual(recorder.count, 9)
+        self.assertEqual(max(recorder.duplicates().values()), 4)
+        patterns = recorder.nplusones()
+        self.assertEqual(len(patterns), 2)
+        self.assertTrue(all(pattern.origin.startswith('library/tests/test_instrumentation.py:')
+            for pattern in patterns))
+
+        with record_queries(raise_on_nplusone=True):
+            list(Loan.objects.select_related('loaned_copy__book'))
+
+    def test_attributes_serializer_fields(self):
+        with self.assertRaisesRegex(NPlusOneError, 'from LoanTitleSerializer.title'):
+            with record_queries(raise_on_nplusone=True):
+                LoanTitleSerializer(Loan.objects.all(), many=True).data
+
+    def test_middleware_reports_in_headers(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-DB-Query-Count']), 0)
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertEqual(response['X-DB-NPlusOne'], '0')
+
+    @override_settings(LIBRARY_RAISE_ON_NPLUSONE=True, TEMPLATES=LOAN_TITLES_TEMPLATES,
+        ROOT_URLCONF='library.tests.test_instrumentation')
+    def test_middleware_attributes_template_lines(self):
+        with self.assertRaisesRegex(NPlusOneError, 'tests/loan_titles.html:3'):
+            self.client.get(reverse('loan_titles'))
@@ -0,0 +1,123 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from library.models import Book, Copy, Loan
+from django.contrib.auth.models import User, Group, Permission
+
+import datetime
+
+# Override the compiled static file storage for testing, 
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class IssueLookupViewTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.other_user = User.objects.create_user(username='otheruser', password='F7NcNDVS')
+        test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+
+        library_user_group = Group.objects.get(name='Library user')
+        librarian_group = Group.objects.get(name='Librarian')
+        cls.test_user.groups.add(library_user_group)
+        cls.other_user.groups.add(library_user_group)
+        test_librarian.groups.add(library_user_group, librarian_group)
+
+        for title in ['Beginning Django', 'Beginning Python', 'Advanced Django']:
+            book = Book.objects.create(
+                title=title,
+                author='Test author',
+                isbn='1234',
+                publication_date=datetime.date.today(),
+            )
+            for copy_number, condition in enumerate(['M', 'G', 'X']):
+                Copy.objects.create(
+                    book=book,
+                    acquisition_date=datetime.date.today(),
+                    copy_number=copy_number,
+                    condition=condition,
+                    )
+        cls.loaned_copy = Copy.objects.get(book__title='Beginning Django', copy_number=0)
+        Loan.objects.create(
+            loaned_copy=cls.loaned_copy,
+            borrower=cls.test_user,
+            loan_start=datetime.date.today(),
+            return_due=datetime.date.today() + datetime.timedelta(weeks=3),
+            )
+
+    def lookup(self, url_name, q):
+        response = self.client.get(reverse(url_name), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [result['text'] for result in response.json()['results']]
+
+    def test_lookups_need_permission(self):
+        self.client.login(username='testuser', password='F7NcNDVS')
+        response = self.client.get(reverse('copy_lookup'), {'q': 'Beg'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(reverse('user_lookup'), {'q': 'test'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_lookups_for_loan_forms(self):
+        # Whoever may add or change a loan may use the lookups on its form
+        editor = User.objects.create_user(username='loaneditor', password='F7NcNDVS')
+        editor.user_permissions.add(Permission.objects.get(codename='change_loan'))
+        self.client.login(username='loaneditor', password='F7NcNDVS')
+        self.assertEqual(self.lookup('copy_lookup', 'advanced'), ['Advanced Django (0)', 'Advanced Django (1)'])
+        self.assertEqual(self.lookup('user_lookup', 'other'), ['otheruser'])
+
+    def test_copy_lookup_returns_available_copies(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        self.assertEqual(self.lookup('copy_lookup', 'beginning'), 
+            ['Beginning Django (1)', 'Beginning Python (0)', 'Beginning Python (1)'])
+        self.assertEqual(self.lookup('copy_lookup', 'django'), [])
+        self.assertEqual(self.lookup('copy_lookup', ''), [])
+
+    def test_copy_lookup_by_id(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        copy = Copy.objects.get(book__title='Advanced Django', copy_number=1)
+        self.assertEqual(self.lookup('copy_lookup', str(copy.pk)), ['Advanced Django (1)'])
+        self.assertEqual(self.lookup('copy_lookup', str(self.loaned_copy.pk)), [])
+
+    def test_user_lookup(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        self.assertEqual(self.lookup('user_lookup', 'TEST'), ['testlibrarian', 'testuser'])
+        self.assertEqual(self.lookup('user_lookup', 'oth'), ['otheruser'])
+
+    def test_issue_page_does_not_list_copies(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        url = reverse('issue_to_user', args=[self.other_user.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Beginning Python')
+        self.assertContains(response, reverse('copy_lookup'))
+
+    def test_issue_to_user(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        copy = Copy.objects.get(book__title='Advanced Django', copy_number=0)
+        url = reverse('issue_to_user', args=[self.other_user.pk])
+        response = self.client.post(url, {
+            'selected_copy': copy.pk,
+            'return_due': datetime.date.today() + datetime.timedelta(weeks=3),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Loan.objects.filter(loaned_copy=copy, borrower=self.other_user).exists())
+
+    def test_issue_rejects_unavailable_copy(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        url = reverse('issue_to_user', args=[self.other_user.pk])
+        response = self.client.post(url, {
+            'selected_copy': self.loaned_copy.pk,
+            'return_due': datetime.date.today() + datetime.timedelta(weeks=3),
+            })
+        self.assertFalse(response.context['form'].is_valid())
+        self.assertFalse(Loan.objects.filter(borrower=self.other_user).exists())
+
+    def test_loan_update_labels_current_copy(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        loan = Loan.objects.get()
+        response = self.client.get(reverse('loan_update', args=[loan.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'value="Beginning Django (0)"')
+        self.assertNotContains(response, 'Beginning Python')
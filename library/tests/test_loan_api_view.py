@@ -96,9 +96,16 @@ class LoanViewUpdateTest(TestCase):
         factory = APIRequestFactory()
         user = User.objects.get(username='testuser')
         assistant = User.objects.get(username='testassistant')
+        # A copy that isn't on loan already
+        free_copy = Copy.objects.create(
+            book = self.test_copy1.book,
+            acquisition_date = datetime.date.today(),
+            copy_number = 3,
+            condition = 'M',
+            )
         request = factory.post(
             '/library/api/v1/loans/', 
-            {'loaned_copy': '/library/api/v1/copies/{}/'.format(self.test_copy1.id),
+            {'loaned_copy': '/library/api/v1/copies/{}/'.format(free_copy.id),
              'borrower': '/library/api/v1/users/{}/'.format(user.id),
              'loan_start': '2019-01-01',
              'return_due': '2019-02-01',
@@ -108,3 +115,103 @@ class LoanViewUpdateTest(TestCase):
         response = view(request)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data['return_due'], '2019-02-01')
+
+    def test_cannot_lend_copy_on_loan(self):
+        factory = APIRequestFactory()
+        user = User.objects.get(username='testuser')
+        assistant = User.objects.get(username='testassistant')
+        request = factory.post(
+            '/library/api/v1/loans/', 
+            {'loaned_copy': '/library/api/v1/copies/{}/'.format(self.test_copy1.id),
+             'borrower': '/library/api/v1/users/{}/'.format(user.id),
+             'loan_start': '2019-01-01',
+             'return_due': '2019-02-01',
+             })
+        view = LoanViewSet.as_view({'post': 'create'})
+        force_authenticate(request, user=assistant)
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('loaned_copy', response.data)
+
+
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LoanViewPaginationTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        cls.test_librarian.groups.add(Group.objects.get(name='Librarian'))
+        test_book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        # 25 open loans, with several due on each day, and 5 closed ones
+        for copy_number in range(30):
+            copy = Copy.objects.create(
+                book=test_book,
+                acquisition_date=datetime.date.today(),
+                copy_number=copy_number,
+                condition='M',
+                )
+            Loan.objects.create(
+                loaned_copy=copy,
+                borrower=test_user,
+                loan_start=datetime.date.today(),
+                return_due=datetime.date.today() + datetime.timedelta(days=copy_number % 4),
+                date_returned=datetime.date.today() if copy_number >= 25 else None,
+                )
+
+    def get(self, url):
+        factory = APIRequestFactory()
+        request = factory.get(url)
+        force_authenticate(request, user=self.test_librarian)
+        response = LoanViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        response.render()
+        return json.loads(response.content)
+
+    def test_pages_cover_all_loans_in_order(self):
+        response_json = self.get('/library/api/v1/loans/')
+        self.assertIsNone(response_json['previous'])
+        loans = response_json['results']
+        while response_json['next']:
+            response_json = self.get(response_json['next'])
+            self.assertIsNotNone(response_json['previous'])
+            loans += response_json['results']
+
+        self.assertEqual(len(loans), 25)
+        self.assertEqual(len({loan['url'] for loan in loans}), 25)
+        due_dates = [loan['return_due'] for loan in loans]
+        self.assertEqual(due_dates, sorted(due_dates))
+
+    def test_previous_link_returns_to_earlier_page(self):
+        first_page = self.get('/library/api/v1/loans/')
+        second_page = self.get(first_page['next'])
+        self.assertEqual(self.get(second_page['previous'])['results'], first_page['results'])
+
+    def test_pages_do_not_shift_when_loans_are_returned(self):
+        first_page = self.get('/library/api/v1/loans/')
+        returned = Loan.objects.get(loaned_copy__copy_number=0)
+        returned.date_returned = datetime.date.today()
+        returned.save()
+        second_page = self.get(first_page['next'])
+        first_urls = {loan['url'] for loan in first_page['results']}
+        self.assertFalse(first_urls & {loan['url'] for loan in second_page['results']})
+        self.assertEqual(len(second_page['results']), 10)
+
+    def test_closed_loans(self):
+        response_json = self.get('/library/api/v1/loans/?closed=true')
+        self.assertEqual(len(response_json['results']), 5)
+        self.assertIsNone(response_json['next'])
+
+    def test_invalid_cursor(self):
+        factory = APIRequestFactory()
+        request = factory.get('/library/api/v1/loans/?cursor=nonsense')
+        force_authenticate(request, user=self.test_librarian)
+        response = LoanViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 404)
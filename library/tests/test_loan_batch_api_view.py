@@ -0,0 +1,160 @@
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.contrib.auth.models import User, Group
+
+from library import configuration, statistics
+from library.models import Book, Configuration, Copy, Loan
+from library.views import CheckoutViewSet, RenewalViewSet, ReturnViewSet
+import datetime
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LoanBatchViewTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.other_user = User.objects.create_user(username='otheruser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+        cls.test_assistant = User.objects.create_user(username='testassistant', password='ubE3AkCa')
+        cls.test_assistant.groups.add(Group.objects.get(name='Library assistant'))
+
+        book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        cls.copies = [Copy.objects.create(
+            book=book,
+            acquisition_date=datetime.date.today(),
+            copy_number=copy_number,
+            condition='X' if copy_number == 9 else 'G',
+            microbit_id=100 + copy_number,
+            ) for copy_number in range(10)]
+        cls.due = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def setUp(self):
+        self.set_max_books_on_loan(20)
+
+    def set_max_books_on_loan(self, limit):
+        policies = Configuration.objects.get()
+        policies.maxbooksonloan = limit
+        policies.save()
+        # The test's rollback doesn't clear the cached configuration
+        self.addCleanup(configuration.clear)
+
+    def post(self, viewset, data, user=None):
+        request = APIRequestFactory().post('/library/api/v1/batch/', data, format='json')
+        force_authenticate(request, user=user or self.test_assistant)
+        return viewset.as_view({'post': 'create'})(request)
+
+    def assertConsistent(self):
+        stored = statistics.current()
+        for name, value in statistics.counted_statistics().items():
+            self.assertEqual(getattr(stored, name), value, name)
+        for copy in Copy.objects.all():
+            self.assertEqual(copy.has_open_loan,
+                Loan.objects.filter(loaned_copy=copy, date_returned__isnull=True).exists())
+
+    def test_checkout_a_stack(self):
+        Loan.objects.create(loaned_copy=self.copies[0], borrower=self.other_user,
+            loan_start=datetime.date.today(), return_due=self.due)
+        scanned = [copy.pk for copy in self.copies[:8]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(CheckoutViewSet, {
+                'borrower': self.test_user.pk,
+                'copies': scanned + [scanned[1], self.copies[9].pk, 0],
+                })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['succeeded'], 7)
+        self.assertEqual([result['status'] for result in response.data['results']],
+            ['failed'] + ['issued'] * 7 + ['failed'] * 3)
+        self.assertIn('already on loan', response.data['results'][0]['error'])
+        self.assertIn('more than once', response.data['results'][8]['error'])
+        self.assertIn('cannot be lent', response.data['results'][9]['error'])
+        self.assertIn('No copy', response.data['results'][10]['error'])
+        self.assertEqual(Loan.objects.filter(borrower=self.test_user).count(), 7)
+        self.assertConsistent()
+        # The same few queries however many copies are scanned
+        self.assertLess(len(queries), 25)
+
+    def test_checkout_keeps_to_the_limit(self):
+        self.set_max_books_on_loan(3)
+        response = self.post(CheckoutViewSet, {
+            'borrower': self.test_user.pk,
+            'microbit_ids': [100, 101, 102, 103],
+            })
+        self.assertEqual(response.data['succeeded'], 3)
+        self.assertEqual(response.data['results'][3]['microbit_id'], 103)
+        self.assertIn('more than 3 books', response.data['results'][3]['error'])
+
+    def test_return_and_renew(self):
+        for copy in self.copies[:3]:
+            Loan.objects.create(loaned_copy=copy, borrower=self.test_user,
+                loan_start=datetime.date.today() - datetime.timedelta(weeks=4),
+                return_due=datetime.date.today() - datetime.timedelta(days=1))
+        Loan.objects.create(loaned_copy=self.copies[3], borrower=self.other_user,
+            loan_start=datetime.date.today(), return_due=self.due)
+
+        response = self.post(RenewalViewSet, {
+            'borrower': self.test_user.pk,
+            'copies': [copy.pk for copy in self.copies[:4]],
+            'return_due': self.due,
+            })
+        self.assertEqual(response.data['succeeded'], 3)
+        self.assertIn('someone else', response.data['results'][3]['error'])
+        self.assertFalse(Loan.objects.filter(return_due__lt=datetime.date.today()).exists())
+        self.assertConsistent()
+
+        response = self.post(ReturnViewSet, {'copies': [copy.pk for copy in self.copies[:5]]})
+        self.assertEqual([result['status'] for result in response.data['results']],
+            ['returned'] * 4 + ['failed'])
+        self.assertFalse(Loan.objects.filter(date_returned__isnull=True).exists())
+        self.assertConsistent()
+
+    def test_dates_are_checked_for_each_loan(self):
+        today = datetime.date.today()
+        Loan.objects.create(loaned_copy=self.copies[0], borrower=self.test_user,
+            loan_start=today - datetime.timedelta(weeks=1), return_due=self.due)
+        Loan.objects.create(loaned_copy=self.copies[1], borrower=self.test_user,
+            loan_start=today, return_due=self.due)
+        copy_ids = [self.copies[0].pk, self.copies[1].pk]
+
+        for return_due in (today - datetime.timedelta(days=1), today + datetime.timedelta(weeks=5)):
+            response = self.post(RenewalViewSet, {'copies': copy_ids, 'return_due': return_due})
+            self.assertEqual(response.data['failed'], 2)
+            self.assertIn('Invalid date', response.data['results'][0]['error'])
+        response = self.post(ReturnViewSet, {'copies': copy_ids,
+            'date_returned': today + datetime.timedelta(days=1)})
+        self.assertEqual(response.data['failed'], 2)
+        self.assertIn('return in future', response.data['results'][1]['error'])
+
+        response = self.post(ReturnViewSet, {'copies': copy_ids,
+            'date_returned': today - datetime.timedelta(days=1)})
+        self.assertEqual([result['status'] for result in response.data['results']],
+            ['returned', 'failed'])
+        self.assertIn('before the loan started', response.data['results'][1]['error'])
+        self.assertEqual(Loan.objects.filter(return_due=self.due).count(), 2)
+        self.assertConsistent()
+
+    def test_bad_requests(self):
+        response = self.post(CheckoutViewSet, {'copies': [self.copies[0].pk]})
+        self.assertEqual(response.status_code, 400)
+        response = self.post(ReturnViewSet, {'copies': [1], 'microbit_ids': [1]})
+        self.assertEqual(response.status_code, 400)
+        response = self.post(ReturnViewSet, {'copies': list(range(101))})
+        self.assertEqual(response.status_code, 400)
+
+    def test_needs_permission(self):
+        response = self.post(CheckoutViewSet,
+            {'borrower': self.test_user.pk, 'copies': [self.copies[0].pk]}, user=self.test_user)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Loan.objects.exists())
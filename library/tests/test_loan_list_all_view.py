@@ -0,0 +1,69 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from library.models import Book, Copy, Loan
+from django.contrib.auth.models import User, Group
+
+import datetime
+
+# Override the compiled static file storage for testing, 
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LoanListAllOpenClosedViewTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        test_librarian.groups.add(Group.objects.get(name='Librarian'))
+        test_book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        # 12 open loans and 15 closed ones
+        for copy_number in range(27):
+            copy = Copy.objects.create(
+                book=test_book,
+                acquisition_date=datetime.date.today(),
+                copy_number=copy_number,
+                condition='M',
+                )
+            Loan.objects.create(
+                loaned_copy=copy,
+                borrower=test_user,
+                loan_start=datetime.date.today() - datetime.timedelta(weeks=4),
+                return_due=datetime.date.today() + datetime.timedelta(days=copy_number % 3),
+                date_returned=(datetime.date.today() - datetime.timedelta(days=copy_number % 5)
+                    if copy_number >= 12 else None),
+                )
+
+    def test_open_and_closed_lists_page_separately(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        response = self.client.get(reverse('all_open_closed_loans'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['loan_list']), 10)
+        self.assertEqual(len(response.context['closed_loan_list']), 10)
+
+        closed_page = response.context['closed_page_obj']
+        response = self.client.get(reverse('all_open_closed_loans') + closed_page.next_url)
+        self.assertEqual(len(response.context['loan_list']), 10)
+        self.assertEqual(len(response.context['closed_loan_list']), 5)
+        self.assertFalse(response.context['closed_page_obj'].has_next())
+
+        open_page = response.context['page_obj']
+        response = self.client.get(reverse('all_open_closed_loans') + open_page.next_url)
+        # Moving through the open loans keeps the position in the closed ones
+        self.assertEqual(len(response.context['loan_list']), 2)
+        self.assertEqual(len(response.context['closed_loan_list']), 5)
+
+        returned_dates = [loan.date_returned for loan in response.context['closed_loan_list']]
+        self.assertEqual(returned_dates, sorted(returned_dates, reverse=True))
+
+    def test_invalid_cursor(self):
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        response = self.client.get(reverse('all_loans'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,239 @@
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.contrib.auth.models import User, Group
+
+from library import configuration, loans
+from library.models import Book, Configuration, Copy, Loan
+from library.views import LoanViewSet
+import datetime
+import random
+import threading
+import time
+
+
+def create_copies(count, condition='G'):
+    book = Book.objects.create(
+        title='Test title',
+        author='Test author',
+        isbn='1234',
+        publication_date=datetime.date.today(),
+    )
+    return [Copy.objects.create(
+        book=book,
+        acquisition_date=datetime.date.today(),
+        copy_number=copy_number,
+        condition=condition,
+        ) for copy_number in range(count)]
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LoanServiceTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.copies = create_copies(7)
+        cls.due = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def test_issue_and_return(self):
+        loan = loans.issue(self.copies[0], self.borrower, self.due)
+        self.assertEqual(loan.loan_start, datetime.date.today())
+        self.assertTrue(Copy.objects.get(pk=self.copies[0].pk).has_open_loan)
+
+        loans.return_loan(loan)
+        self.assertFalse(Copy.objects.get(pk=self.copies[0].pk).has_open_loan)
+        with self.assertRaises(ValidationError):
+            loans.return_loan(loan)
+        with self.assertRaises(ValidationError):
+            loans.renew(loan, self.due)
+        # Returned, the copy can be lent again
+        loans.issue(self.copies[0], self.borrower, self.due)
+
+    def test_copy_on_loan_or_unavailable(self):
+        loans.issue(self.copies[0], self.borrower, self.due)
+        with self.assertRaisesRegex(ValidationError, 'already on loan'):
+            loans.issue(self.copies[0], self.borrower, self.due)
+
+        lost = self.copies[1]
+        lost.condition = 'L'
+        lost.save()
+        with self.assertRaisesRegex(ValidationError, 'lost'):
+            loans.issue(lost, self.borrower, self.due)
+
+    def test_max_books_on_loan(self):
+        limit = Configuration.objects.get().maxbooksonloan
+        for copy in self.copies[:limit]:
+            loans.issue(copy, self.borrower, self.due)
+        with self.assertRaises(ValidationError) as raised:
+            loans.issue(self.copies[limit], self.borrower, self.due)
+        self.assertIn('borrower', raised.exception.message_dict)
+
+    def test_api_create_keeps_to_the_limit(self):
+        assistant = User.objects.create_user(username='testassistant', password='ubE3AkCa')
+        assistant.groups.add(Group.objects.get(name='Library assistant'))
+        limit = Configuration.objects.get().maxbooksonloan
+        for copy in self.copies[:limit]:
+            loans.issue(copy, self.borrower, self.due)
+
+        request = APIRequestFactory().post('/library/api/v1/loans/', {
+            'loaned_copy': '/library/api/v1/copies/{}/'.format(self.copies[limit].pk),
+            'borrower': '/library/api/v1/users/{}/'.format(self.borrower.pk),
+            'loan_start': '2019-01-01',
+            'return_due': '2019-02-01',
+            })
+        force_authenticate(request, user=assistant)
+        response = LoanViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('borrower', response.data)
+
+    def test_api_create_without_borrower(self):
+        assistant = User.objects.create_user(username='testassistant', password='ubE3AkCa')
+        assistant.groups.add(Group.objects.get(name='Library assistant'))
+        request = APIRequestFactory().post('/library/api/v1/loans/', {
+            'loaned_copy': '/library/api/v1/copies/{}/'.format(self.copies[0].pk),
+            'loan_start': '2019-01-01',
+            'return_due': '2019-02-01',
+            })
+        force_authenticate(request, user=assistant)
+        response = LoanViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['borrower'])
+        self.assertTrue(Copy.objects.get(pk=self.copies[0].pk).has_open_loan)
+
+    def test_return_dates(self):
+        loan = loans.issue(self.copies[0], self.borrower, self.due)
+        for date_returned in (loan.loan_start - datetime.timedelta(days=1),
+                datetime.date.today() + datetime.timedelta(days=1)):
+            with self.assertRaises(ValidationError) as raised:
+                loans.return_loan(loan, date_returned)
+            self.assertIn('date_returned', raised.exception.message_dict)
+        self.assertIsNone(Loan.objects.get(pk=loan.pk).date_returned)
+
+    def test_issue_view_reports_limit(self):
+        librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        librarian.groups.add(Group.objects.get(name='Librarian'))
+        policies = Configuration.objects.get()
+        policies.maxbooksonloan = 1
+        policies.save()
+        # The test's rollback doesn't clear the cached configuration
+        self.addCleanup(configuration.clear)
+        loans.issue(self.copies[0], self.borrower, self.due)
+
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        response = self.client.post(reverse('issue_to_user', args=[self.borrower.pk]), {
+            'selected_copy': self.copies[1].pk,
+            'return_due': self.due,
+            })
+        self.assertContains(response, 'the most allowed')
+        self.assertEqual(Loan.objects.filter(borrower=self.borrower).count(), 1)
+
+    def test_edits_cannot_move_or_reopen_loans(self):
+        other = User.objects.create_user(username='otheruser', password='N7F8VDcS')
+        loan = loans.issue(self.copies[0], self.borrower, self.due)
+        with self.assertRaises(ValidationError) as raised:
+            loans.update(loan, borrower=other)
+        self.assertIn('borrower', raised.exception.message_dict)
+        with self.assertRaises(ValidationError) as raised:
+            loans.update(loan, loaned_copy=self.copies[1], borrower=self.borrower)
+        self.assertIn('loaned_copy', raised.exception.message_dict)
+
+        loan = loans.update(loan, return_due=self.due + datetime.timedelta(days=1),
+            date_returned=datetime.date.today())
+        self.assertEqual(loan.return_due, self.due + datetime.timedelta(days=1))
+        self.assertFalse(Copy.objects.get(pk=self.copies[0].pk).has_open_loan)
+        with self.assertRaises(ValidationError) as raised:
+            loans.update(loan, date_returned=None)
+        self.assertIn('date_returned', raised.exception.message_dict)
+
+    def test_api_and_form_edits_go_through_the_service(self):
+        librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        librarian.groups.add(Group.objects.get(name='Librarian'))
+        other = User.objects.create_user(username='otheruser', password='N7F8VDcS')
+        loan = loans.issue(self.copies[0], self.borrower, self.due)
+
+        request = APIRequestFactory().patch('/library/api/v1/loans/{}/'.format(loan.pk),
+            {'borrower': '/library/api/v1/users/{}/'.format(other.pk)})
+        force_authenticate(request, user=librarian)
+        response = LoanViewSet.as_view({'patch': 'partial_update'})(request, pk=loan.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('borrower', response.data)
+
+        self.client.login(username='testlibrarian', password='ubE3AkC2')
+        response = self.client.post(reverse('loan_update', args=[loan.pk]), {
+            'loaned_copy': self.copies[1].pk,
+            'borrower': self.borrower.pk,
+            'loan_start': loan.loan_start,
+            'return_due': loan.return_due,
+            })
+        self.assertFalse(response.context['form'].is_valid())
+        self.assertEqual(Loan.objects.get(pk=loan.pk).loaned_copy_id, self.copies[0].pk)
+        self.assertFalse(Copy.objects.get(pk=self.copies[1].pk).has_open_loan)
+
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LoanContentionTest(TransactionTestCase):
+    """Many desks issuing and returning the same few copies at once."""
+
+    fixtures = ['config',]
+
+    threads = 8
+    rounds = 3
+
+    def test_no_copy_is_issued_twice(self):
+        copies = create_copies(12)
+        borrowers = [User.objects.create_user(username='reader{}'.format(number))
+            for number in range(self.threads)]
+        limit = Configuration.objects.get().maxbooksonloan
+        due = datetime.date.today() + datetime.timedelta(weeks=3)
+        issued, errors = [], []
+
+        def desk(borrower, shuffle):
+            try:
+                order = list(copies)
+                shuffle(order)
+                for copy in order:
+                    try:
+                        issued.append(loans.issue(copy, borrower, due))
+                    except ValidationError:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        started_at = time.perf_counter()
+        for round_number in range(self.rounds):
+            threads = [threading.Thread(target=desk,
+                    args=(borrower, random.Random(round_number * self.threads + number).shuffle))
+                for number, borrower in enumerate(borrowers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+
+            open_loans = Loan.objects.filter(date_returned__isnull=True)
+            # Every copy was lent once, and only once, within each borrower's limit
+            self.assertEqual(open_loans.count(), len(copies))
+            self.assertFalse(open_loans.values('loaned_copy')
+                .annotate(loans=Count('pk')).filter(loans__gt=1).exists())
+            self.assertFalse(open_loans.values('borrower')
+                .annotate(loans=Count('pk')).filter(loans__gt=limit).exists())
+            self.assertEqual(Copy.objects.filter(has_open_loan=True).count(), len(copies))
+
+            for loan in open_loans:
+                loans.return_loan(loan)
+        elapsed = time.perf_counter() - started_at
+
+        self.assertEqual(len(issued), len(copies) * self.rounds)
+        # Each round is 96 attempts; even SQLite, retrying its whole-database
+        # locks, gets through them quickly
+        self.assertLess(elapsed, 30)
@@ -0,0 +1,119 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.contrib.auth.models import User
+
+from library import caching, telemetry
+from library.models import Book, Copy, Loan, UserMicrobit
+from library.views import MicrobitReadingViewSet
+import datetime
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class MicrobitReadingViewTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='F7NcNDVS')
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        UserMicrobit.objects.filter(user=cls.test_user).update(microbit_id=7)
+        test_book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+        )
+        for copy_number in range(1, 4):
+            Copy.objects.create(
+                book=test_book,
+                acquisition_date=datetime.date.today(),
+                copy_number=copy_number,
+                condition='G',
+                microbit_id=copy_number,
+                )
+        cls.open_loan = Loan.objects.create(
+            loaned_copy=Copy.objects.get(copy_number=1),
+            borrower=cls.test_user,
+            loan_start=datetime.date.today(),
+            return_due=datetime.date.today() + datetime.timedelta(weeks=3),
+            microbit_id=7,
+            )
+
+    def setUp(self):
+        # Forget the devices seen by earlier tests
+        cache.clear()
+
+    def post_readings(self, readings, user=None):
+        factory = APIRequestFactory()
+        view = MicrobitReadingViewSet.as_view({'post': 'create'})
+        request = factory.post('/library/api/v1/microbitreadings/', readings, format='json')
+        force_authenticate(request, user=user or self.admin_user)
+        return view(request)
+
+    def test_readings_update_devices_in_bulk(self):
+        now = timezone.now().replace(microsecond=0)
+        readings = [
+            {'microbit_id': 1, 'timestamp': (now - datetime.timedelta(seconds=5)).isoformat()},
+            {'microbit_id': 1, 'timestamp': now.isoformat()},
+            {'microbit_id': 2, 'timestamp': now.isoformat()},
+            {'microbit_id': 7, 'timestamp': now.isoformat()},
+            {'microbit_id': 99, 'timestamp': now.isoformat()},
+            ]
+        book = Book.objects.get()
+        versions = caching.book_versions([book.pk])
+        before = timezone.now()
+        unseen = Copy.objects.get(microbit_id=3).updated_at
+        # One UPDATE each for copies, open loans and user micro:bits, with a
+        # SELECT of the books of the copies and loans, plus the savepoint and
+        # release of the transaction around them
+        with self.assertNumQueries(7):
+            response = self.post_readings(readings)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'recorded': 4, 'coalesced': 1})
+        self.assertNotEqual(caching.book_versions([book.pk]), versions)
+        # Syncing clients are sent the copies and loans that changed
+        self.assertGreaterEqual(Copy.objects.get(microbit_id=1).updated_at, before)
+        self.assertGreaterEqual(Loan.objects.get(pk=self.open_loan.pk).updated_at, before)
+        self.assertEqual(Copy.objects.get(microbit_id=3).updated_at, unseen)
+
+        self.assertEqual(Copy.objects.get(microbit_id=1).last_microbit_update, now)
+        self.assertEqual(Copy.objects.get(microbit_id=2).last_microbit_update, now)
+        self.assertIsNone(Copy.objects.get(microbit_id=3).last_microbit_update)
+        self.assertEqual(Loan.objects.get(pk=self.open_loan.pk).last_microbit_update, now)
+        self.assertEqual(UserMicrobit.objects.get(user=self.test_user).last_microbit_update, now)
+
+    @override_settings(LIBRARY_MICROBIT_COALESCE_SECONDS=60)
+    def test_repeated_heartbeats_are_coalesced(self):
+        now = timezone.now().replace(microsecond=0)
+        telemetry.record_readings([(1, now)])
+
+        # Within the window the database isn't touched
+        with self.assertNumQueries(0):
+            result = telemetry.record_readings([(1, now + datetime.timedelta(seconds=30))])
+        self.assertEqual(result, telemetry.TelemetryResult(recorded=0, coalesced=1))
+        self.assertEqual(Copy.objects.get(microbit_id=1).last_microbit_update, now)
+
+        later = now + datetime.timedelta(seconds=60)
+        telemetry.record_readings([(1, later)])
+        self.assertEqual(Copy.objects.get(microbit_id=1).last_microbit_update, later)
+
+    def test_older_readings_do_not_move_time_backwards(self):
+        now = timezone.now().replace(microsecond=0)
+        telemetry.record_readings([(2, now)], window=0)
+        telemetry.record_readings([(2, now - datetime.timedelta(minutes=5))], window=0)
+        self.assertEqual(Copy.objects.get(microbit_id=2).last_microbit_update, now)
+
+    def test_invalid_readings_are_rejected(self):
+        response = self.post_readings([{'microbit_id': 1, 'timestamp': 'yesterday'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_needs_permission(self):
+        response = self.post_readings(
+            [{'microbit_id': 1, 'timestamp': timezone.now().isoformat()}], user=self.test_user)
+        self.assertEqual(response.status_code, 403)
@@ -4,7 +4,9 @@ from django.test import TestCase
 
 from library.models import Book, Copy, Loan
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from datetime import date
+from io import StringIO
 
 class BookModelTest(TestCase):
 
@@ -70,3 +72,65 @@ class LoanModelTest(TestCase):
         # This will also fail if the urlconf is not defined.
         self.assertEquals(loan.get_absolute_url(), '/library/book/1')
     
+
+class AvailabilityStateTest(TestCase):
+
+    fixtures = ['config', 'small_test_data.json',]
+
+    def test_fixture_state(self):
+        self.assertTrue(Copy.objects.get(id=1).has_open_loan)
+        self.assertFalse(Copy.objects.get(id=3).has_open_loan)
+        self.assertEqual(Book.objects.get(id=1).available_copies, 0)
+        self.assertEqual(Book.objects.get(id=2).available_copies, 1)
+        self.assertEqual(Book.objects.get(id=3).available_copies, 0)
+
+    def test_loan_created_returned_and_deleted(self):
+        copy3 = Copy.objects.get(id=3)
+        loan = Loan.objects.create(
+            loaned_copy=copy3,
+            borrower=User.objects.get(id=2),
+            loan_start=date.today(),
+            return_due=date.today(),
+            )
+        self.assertTrue(Copy.objects.get(id=3).on_loan)
+        self.assertFalse(Book.objects.get(id=2).copy_available)
+
+        loan.date_returned = date.today()
+        loan.save()
+        self.assertFalse(Copy.objects.get(id=3).on_loan)
+        self.assertTrue(Book.objects.get(id=2).copy_available)
+
+        loan.date_returned = None
+        loan.save()
+        self.assertFalse(Book.objects.get(id=2).copy_available)
+        loan.delete()
+        self.assertTrue(Book.objects.get(id=2).copy_available)
+
+    def test_loan_moved_to_another_copy(self):
+        loan = Loan.objects.get(id="242ac8dc-682f-4d1b-b4ca-a4a458ddadca")
+        loan.loaned_copy = Copy.objects.get(id=3)
+        loan.save()
+        self.assertEqual(Book.objects.get(id=3).available_copies, 1)
+        self.assertEqual(Book.objects.get(id=2).available_copies, 0)
+
+    def test_condition_change(self):
+        copy3 = Copy.objects.get(id=3)
+        copy3.condition = 'L'
+        copy3.save()
+        self.assertFalse(Book.objects.get(id=2).copy_available)
+        copy3.condition = 'W'
+        copy3.save()
+        self.assertTrue(Book.objects.get(id=2).copy_available)
+
+    def test_rebuild_availability_command(self):
+        Copy.objects.update(has_open_loan=False)
+        Book.objects.exclude(id=2).update(available_copies=7)
+        unchanged = Book.objects.get(id=2).updated_at
+        call_command('rebuild_availability', stdout=StringIO())
+        self.assertTrue(Copy.objects.get(id=1).has_open_loan)
+        self.assertEqual(
+            list(Book.objects.order_by('id').values_list('available_copies', flat=True)),
+            [0, 1, 0])
+        # Syncing clients aren't sent the books that were already right
+        self.assertEqual(Book.objects.get(id=2).updated_at, unchanged)
+        self.assertGreater(Book.objects.get(id=1).updated_at, unchanged)
@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.contrib.auth.models import User, Group, Permission
+
+from library.views import CategoryViewSet
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class CachedPermissionsTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_assistant = User.objects.create_user(username='testassistant', password='ubE3AkCa')
+        cls.test_assistant.groups.add(Group.objects.get(name='Library assistant'))
+        cls.test_assistant.user_permissions.add(Permission.objects.get(codename='add_category'))
+
+    def setUp(self):
+        # Rolling back the last test's changes didn't forget the permissions it cached
+        cache.clear()
+
+    def fresh_user(self):
+        # As each request loads its user afresh
+        return User.objects.get(pk=self.test_assistant.pk)
+
+    def test_cached_between_requests(self):
+        self.assertTrue(self.fresh_user().has_perm('library.add_loan'))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('library.add_loan'))
+            self.assertFalse(user.has_perm('library.delete_book'))
+
+    def test_api_request_checks_permissions_without_queries(self):
+        factory = APIRequestFactory()
+        view = CategoryViewSet.as_view({'post': 'create'})
+
+        def create(name):
+            request = factory.post('/library/api/v1/categories/', {'category': name})
+            force_authenticate(request, user=self.fresh_user())
+            return view(request)
+
+        self.assertEqual(create('Poetry').status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(create('Drama').status_code, 201)
+        self.assertFalse([query for query in queries if 'auth_permission' in query['sql']])
+
+    def test_group_changes(self):
+        assistants = Group.objects.get(name='Library assistant')
+        self.assertTrue(self.fresh_user().has_perm('library.add_loan'))
+
+        assistants.permissions.remove(Permission.objects.get(codename='add_loan'))
+        self.assertFalse(self.fresh_user().has_perm('library.add_loan'))
+
+        self.test_assistant.groups.remove(assistants)
+        self.assertFalse(self.fresh_user().has_perm('library.change_copy'))
+
+        Group.objects.get(name='Librarian').user_set.add(self.test_assistant)
+        self.assertTrue(self.fresh_user().has_perm('library.change_copy'))
+
+    def test_user_changes(self):
+        self.assertFalse(self.fresh_user().has_perm('library.delete_book'))
+        self.test_assistant.user_permissions.add(Permission.objects.get(codename='delete_book'))
+        self.assertTrue(self.fresh_user().has_perm('library.delete_book'))
+
+        user = self.fresh_user()
+        user.is_active = False
+        user.save()
+        self.assertFalse(self.fresh_user().has_perm('library.delete_book'))
+
+    def test_expires(self):
+        # As another worker, with its own cache, would see the change
+        with override_settings(LIBRARY_PERMISSIONS_CACHE_SECONDS=0):
+            self.assertTrue(self.fresh_user().has_perm('library.add_loan'))
+            # Deleting the rows directly sends no signals to bump the versions
+            Group.permissions.through.objects.filter(
+                group__name='Library assistant', permission__codename='add_loan').delete()
+            self.assertFalse(self.fresh_user().has_perm('library.add_loan'))
@@ -0,0 +1,92 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from io import StringIO
+import re
+import unittest
+
+from django.core.management import call_command
+from django.contrib.auth.models import User
+
+# Plan steps reading a whole table without an index, e.g. 'SCAN library_loan',
+# and sorting the rows rather than reading them in order from an index
+TABLE_SCAN = re.compile(r'SCAN (?:TABLE )?"?(?:library|auth)_\w+"?(?: AS \w+)?$')
+LIBRARY_TABLE = re.compile(r'"(?:library|auth)_')
+SORT = re.compile(r'TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY')
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+class QueryPlanTest(TestCase):
+    """The queries behind the loan and book lists are answered from indexes."""
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_library', books=50, users=10, loans=200, stdout=StringIO())
+        cls.librarian = User.objects.create_superuser(
+            username='planner', email='planner@example.com', password='9zQh3XvA')
+        cls.reader = User.objects.filter(groups__name='Library user').order_by('pk').first()
+
+    def assertIndexed(self, path, index=None, sorting=False):
+        """
+        Every query for path that reads a library table uses an index, and
+        one of them uses index if given. With sorting, queries may sort the
+        rows they find.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        checked = 0
+        plans = []
+        for sql in sorted({query['sql'] for query in queries.captured_queries}):
+            # Counting a whole list for its page numbers reads every row anyway
+            if (not sql.startswith('SELECT') or not LIBRARY_TABLE.search(sql)
+                    or sql.startswith('SELECT COUNT(*)')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            plans += plan
+            # Sorting a page's worth of prefetched rows is fine, but a
+            # page of a list mustn't need the whole list sorting first
+            unindexed = [step for step in plan
+                if TABLE_SCAN.search(step)
+                    or (not sorting and ' LIMIT ' in sql and SORT.search(step))]
+            self.assertFalse(unindexed,
+                '{}\n{}'.format(sql, '\n'.join(plan)))
+            checked += 1
+        self.assertGreater(checked, 0)
+        if index is not None:
+            self.assertTrue(any(index in step for step in plans), '\n'.join(plans))
+
+    def test_loan_lists(self):
+        self.client.force_login(self.librarian)
+        for path in (reverse('all_loans'), reverse('all_open_closed_loans'),
+                reverse('loan-list'), reverse('loan-list') + '?closed=true'):
+            with self.subTest(path=path):
+                self.assertIndexed(path)
+
+    def test_borrower_loan_lists(self):
+        self.client.force_login(self.reader)
+        for path in (reverse('my_loans'), '/library/api/v1/myloans/',
+                '/library/api/v1/myloans/?closed=true'):
+            with self.subTest(path=path):
+                self.assertIndexed(path)
+
+    def test_book_lists(self):
+        self.client.force_login(self.librarian)
+        for path in (reverse('book_list'), reverse('book_list') + '?order=1',
+                reverse('book_list') + '?order=3', reverse('book-list')):
+            with self.subTest(path=path):
+                self.assertIndexed(path)
+
+    def test_lookups(self):
+        self.client.force_login(self.librarian)
+        # The typeahead pickers find a prefix's few matches, then sort them
+        self.assertIndexed(reverse('copy_lookup') + '?q=th', 'library_book_title_nocase', sorting=True)
+        self.assertIndexed(reverse('user_lookup') + '?q=re', sorting=True)
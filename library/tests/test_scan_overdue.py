@@ -0,0 +1,81 @@
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from django.contrib.auth.models import User
+
+from library.models import Book, Copy, Loan, LoanReminder
+from io import StringIO
+import datetime
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class ScanOverdueTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = User.objects.create_user(username='ada', email='ada@example.com', password='5pQe8wLk')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com', password='5pQe8wLk')
+        cls.nomail = User.objects.create_user(username='nomail', password='5pQe8wLk')
+        book = Book.objects.create(title='Test title', author='Test author', isbn='1234',
+            publication_date=datetime.date.today())
+        cls.copies = [Copy.objects.create(book=book, acquisition_date=datetime.date.today(),
+            copy_number=number, condition='G') for number in range(1, 8)]
+
+    def lend(self, copy_index, borrower, days_due):
+        today = datetime.date.today()
+        return Loan.objects.create(
+            loaned_copy=self.copies[copy_index],
+            borrower=borrower,
+            loan_start=today - datetime.timedelta(weeks=3),
+            return_due=today + datetime.timedelta(days=days_due),
+            )
+
+    def scan(self, **options):
+        call_command('scan_overdue', stdout=StringIO(), **options)
+
+    def test_one_digest_per_borrower(self):
+        self.lend(0, self.ada, -2)
+        self.lend(1, self.ada, 1)
+        self.lend(2, self.ada, 20)
+        self.lend(3, self.bob, 2)
+        self.lend(4, self.nomail, -1)
+        returned = self.lend(5, self.bob, -5)
+        returned.date_returned = datetime.date.today()
+        returned.save()
+
+        # A batch size of one splits Ada's loans across batches
+        self.scan(batch_size=1)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+            ['ada@example.com', 'bob@example.com'])
+        ada_digest = next(message for message in mail.outbox if message.to == ['ada@example.com'])
+        self.assertEqual(ada_digest.subject, 'Library reminder: 1 overdue book')
+        self.assertIn('overdue', ada_digest.body)
+        self.assertIn('due back soon', ada_digest.body)
+        self.assertEqual(LoanReminder.objects.filter(loan__borrower=self.ada).count(), 2)
+        self.assertEqual(LoanReminder.objects.count(), 3)
+
+    def test_rerun_sends_nothing_new(self):
+        loan = self.lend(0, self.ada, -2)
+        self.scan()
+        self.assertEqual(len(mail.outbox), 1)
+        self.scan()
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Renewed, the loan is due a reminder again when it's next due
+        loan.return_due = datetime.date.today() + datetime.timedelta(days=1)
+        loan.save()
+        self.scan()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].subject, 'Library reminder: 1 book due back soon')
+
+    def test_dry_run(self):
+        self.lend(0, self.ada, -2)
+        self.scan(dry_run=True)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(LoanReminder.objects.exists())
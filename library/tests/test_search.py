@@ -0,0 +1,97 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory
+
+from library.models import Book, Category
+from library.search import BasicSearchBackend, get_backend, search_books
+from library.views import BookViewSet
+import datetime
+import json
+
+# Override the compiled static file storage for testing, 
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class BookSearchTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.programming = Category.objects.create(category='Programming')
+        for title, author, isbn in [
+                ('Beginning Django', 'Django author', '978-0-00-000001-1'),
+                ('Advanced Django', 'Someone else', '978-0-00-000002-2'),
+                ('Beginning Python', 'Python author', '978-0-00-000003-3'),
+                ('Cooking for beginners', 'Chef', '978-0-00-000004-4'),
+                ]:
+            Book.objects.create(
+                title=title,
+                author=author,
+                isbn=isbn,
+                publication_date=datetime.date.today(),
+                category=cls.programming if 'Cooking' not in title else None,
+            )
+
+    def search(self, *terms):
+        return [book.title for book in search_books(Book.objects.all(), terms)]
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(set(self.search('begin')), 
+            {'Beginning Django', 'Beginning Python', 'Cooking for beginners'})
+        self.assertEqual(self.search('begin', 'python'), ['Beginning Python'])
+        self.assertEqual(self.search('nosuchword'), [])
+
+    def test_title_matches_rank_first(self):
+        # 'Beginning Django' matches in both title and author
+        self.assertEqual(self.search('django'), ['Beginning Django', 'Advanced Django'])
+
+    def test_searches_isbn_and_category(self):
+        self.assertEqual(self.search('978-0-00-000003-3'), ['Beginning Python'])
+        self.assertEqual(len(self.search('programming')), 3)
+
+    def test_user_input_is_not_query_syntax(self):
+        self.assertEqual(self.search('"django', 'OR', '*'), [])
+
+    def test_index_follows_changes(self):
+        book = Book.objects.get(title='Cooking for beginners')
+        book.title = 'Baking for beginners'
+        book.save()
+        self.assertEqual(self.search('cooking'), [])
+        self.assertEqual(self.search('baking'), ['Baking for beginners'])
+
+        self.programming.category = 'Computing'
+        self.programming.save()
+        self.assertEqual(self.search('programming'), [])
+        self.assertEqual(len(self.search('computing')), 3)
+
+        book.delete()
+        self.assertEqual(self.search('baking'), [])
+
+    def test_rebuild_matches_incremental_index(self):
+        before = self.search('begin')
+        get_backend().rebuild()
+        self.assertEqual(self.search('begin'), before)
+
+    def test_basic_backend(self):
+        books = BasicSearchBackend().search(Book.objects.all(), ['BEGIN', 'django'])
+        self.assertEqual([book.title for book in books], ['Beginning Django'])
+
+    def test_web_search(self):
+        response = self.client.get(reverse('book_list'), {'q': 'python begin'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book.title for book in response.context['book_list']], 
+            ['Beginning Python'])
+
+    def test_web_search_with_order(self):
+        response = self.client.get(reverse('book_list'), {'q': 'django', 'order': '4'})
+        self.assertEqual([book.title for book in response.context['book_list']], 
+            ['Beginning Django', 'Advanced Django'])
+
+    def test_api_search(self):
+        factory = APIRequestFactory()
+        view = BookViewSet.as_view({'get': 'list'})
+        response = view(factory.get('/library/api/v1/books', {'search': 'django,advanced'}))
+        response.render()
+        response_json = json.loads(response.content)
+        self.assertEqual(response_json['count'], 1)
+        self.assertEqual(response_json['results'][0]['title'], 'Advanced Django')
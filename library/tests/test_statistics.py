@@ -0,0 +1,118 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from django.contrib.auth.models import User
+
+from library import loans, statistics
+from library.models import Book, Copy, LibraryStatistics, Loan
+import datetime
+from io import StringIO
+
+# Override the compiled static file storage for testing, 
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class LibraryStatisticsTest(TestCase):
+
+    fixtures = ['config', 'small_test_data.json',]
+
+    def assertStatisticsMatchCounts(self):
+        stored = statistics.current()
+        for name, value in statistics.counted_statistics().items():
+            self.assertEqual(getattr(stored, name), value, name)
+
+    def test_fixture_statistics(self):
+        stored = statistics.current()
+        self.assertEqual(stored.total_books, 3)
+        self.assertEqual(stored.circulating_copies, 4)
+        self.assertEqual(stored.available_copies, 1)
+        self.assertEqual(stored.open_loans, 3)
+        # All the fixture loans were due back in 2019
+        self.assertEqual(stored.overdue_loans, 3)
+        self.assertStatisticsMatchCounts()
+
+    def test_statistics_follow_changes(self):
+        book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date.today(),
+            )
+        copy = Copy.objects.create(
+            book=book,
+            acquisition_date=datetime.date.today(),
+            copy_number=1,
+            condition='M',
+            )
+        self.assertStatisticsMatchCounts()
+
+        loan = Loan.objects.create(
+            loaned_copy=copy,
+            borrower=User.objects.get(id=2),
+            loan_start=datetime.date.today() - datetime.timedelta(weeks=4),
+            return_due=datetime.date.today() - datetime.timedelta(days=1),
+            )
+        self.assertStatisticsMatchCounts()
+
+        loan.return_due = datetime.date.today()
+        loan.save()
+        self.assertStatisticsMatchCounts()
+
+        loan.date_returned = datetime.date.today()
+        loan.save()
+        self.assertStatisticsMatchCounts()
+
+        copy.condition = 'L'
+        copy.save()
+        self.assertStatisticsMatchCounts()
+
+        Loan.objects.get(id="0ec31922-fc6b-417c-b665-af05d55ba77c").delete()
+        self.assertStatisticsMatchCounts()
+
+        Book.objects.get(id=1).delete()
+        book.delete()
+        self.assertStatisticsMatchCounts()
+        self.assertEqual(statistics.current().total_books, 2)
+
+    def test_overdue_recounted_daily(self):
+        LibraryStatistics.objects.update(overdue_loans=0, 
+            overdue_counted_on=datetime.date.today() - datetime.timedelta(days=1))
+        self.assertEqual(statistics.current().overdue_loans, 3)
+
+    def test_loan_falling_overdue_since_the_recount(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        LibraryStatistics.objects.update(**statistics.counted_statistics(today=yesterday))
+        book = Book.objects.create(title='Test title', author='Test author', isbn='1234',
+            publication_date=datetime.date.today())
+        copies = [Copy.objects.create(book=book, acquisition_date=datetime.date.today(),
+            copy_number=copy_number, condition='M') for copy_number in range(2)]
+        borrower = User.objects.get(id=2)
+        # Not overdue when the overdue loans were counted, yesterday
+        for copy in copies:
+            Loan.objects.create(loaned_copy=copy, borrower=borrower,
+                loan_start=yesterday - datetime.timedelta(weeks=3), return_due=yesterday)
+        self.assertEqual(LibraryStatistics.objects.get().overdue_loans, 3)
+
+        loan = Loan.objects.get(loaned_copy=copies[0])
+        loan.date_returned = datetime.date.today()
+        loan.save()
+        loans.return_batch(copy_ids=[copies[1].pk])
+        self.assertEqual(LibraryStatistics.objects.get().overdue_loans, 3)
+        self.assertStatisticsMatchCounts()
+
+    def test_index_uses_one_query(self):
+        statistics.current()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_copies_available'], 1)
+
+    def test_recompute_statistics_command(self):
+        LibraryStatistics.objects.update(total_books=99)
+        out = StringIO()
+        call_command('recompute_statistics', '--check', stdout=out)
+        self.assertIn('total_books: stored 99, counted 3', out.getvalue())
+        self.assertEqual(statistics.current().total_books, 99)
+
+        call_command('recompute_statistics', stdout=StringIO())
+        self.assertStatisticsMatchCounts()
@@ -0,0 +1,134 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User, Group
+
+from library import archive, loans
+from library.models import Book, Category, Copy, Loan
+import datetime
+
+
+# Override the compiled static file storage for testing,
+# so the test harness can find things like the style sheets
+@override_settings(STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage')
+class SyncTest(TestCase):
+
+    fixtures = ['config',]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='F7NcNDVS')
+        cls.test_user.groups.add(Group.objects.get(name='Library user'))
+        cls.other_user = User.objects.create_user(username='otheruser', password='N7F8VDcS')
+        cls.test_librarian = User.objects.create_user(username='testlibrarian', password='ubE3AkC2')
+        cls.test_librarian.groups.add(Group.objects.get(name='Librarian'))
+
+        category = Category.objects.create(category='Fiction')
+        cls.book = Book.objects.create(
+            title='Test title',
+            author='Test author',
+            isbn='1234',
+            publication_date=datetime.date(2019, 7, 29),
+            category=category,
+        )
+        cls.copies = [Copy.objects.create(book=cls.book, acquisition_date=datetime.date(2019, 1, 1),
+            copy_number=copy_number, condition='G') for copy_number in range(4)]
+        due = datetime.date.today() + datetime.timedelta(weeks=3)
+        cls.loan = Loan.objects.create(loaned_copy=cls.copies[0], borrower=cls.test_user,
+            loan_start=datetime.date.today(), return_due=due)
+        Loan.objects.create(loaned_copy=cls.copies[1], borrower=cls.other_user,
+            loan_start=datetime.date.today(), return_due=due)
+
+        # Everything changed well before the tests' syncs
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        for model in (Category, Book, Copy, Loan):
+            model.objects.update(updated_at=an_hour_ago)
+
+    def sync(self, user, token=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/library/api/v1/sync/', {'since': token} if token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_first_sync_sends_everything(self):
+        data = self.sync(self.test_user)
+        self.assertTrue(data['reset'])
+        self.assertFalse(data['more'])
+        changes = data['changes']
+        self.assertEqual(list(changes), ['categories', 'books', 'copies', 'loans'])
+        self.assertEqual(len(changes['copies']['rows']), 4)
+        books = changes['books']
+        self.assertEqual(dict(zip(books['columns'], books['rows'][0]))['available_copies'], 2)
+        # Borrowers only see their own loans
+        self.assertEqual([row[0] for row in changes['loans']['rows']], [self.loan.pk])
+        self.assertEqual(len(self.sync(self.test_librarian)['changes']['loans']['rows']), 2)
+
+    def test_changes_since_last_sync(self):
+        token = self.sync(self.test_librarian)['token']
+        data = self.sync(self.test_librarian, token)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['changes'], {})
+
+        copy = Copy.objects.get(pk=self.copies[2].pk)
+        copy.condition = 'D'
+        copy.save()
+        Copy.objects.get(pk=self.copies[3].pk).delete()
+        # A batch return updates the loan and its copy's state in bulk
+        loans.return_batch(copy_ids=[self.copies[1].pk])
+
+        data = self.sync(self.test_librarian, data['token'])
+        changes = data['changes']
+        self.assertEqual(list(changes), ['books', 'copies', 'loans'])
+        self.assertEqual(sorted(row[0] for row in changes['copies']['rows']),
+            [self.copies[1].pk, self.copies[2].pk])
+        self.assertEqual(changes['copies']['deleted'], [str(self.copies[3].pk)])
+        loan = dict(zip(changes['loans']['columns'], changes['loans']['rows'][0]))
+        self.assertEqual(loan['date_returned'], datetime.date.today())
+        # The book's available copies went down by one and up by one
+        self.assertEqual(len(changes['books']['rows']), 1)
+
+    def test_deleted_loans_of_borrower(self):
+        token = self.sync(self.test_user)['token']
+        Loan.objects.get(borrower=self.other_user).delete()
+        Loan.objects.get(pk=self.loan.pk).delete()
+        changes = self.sync(self.test_user, token)['changes']
+        self.assertEqual(changes['loans']['deleted'], [str(self.loan.pk)])
+
+    def test_archived_loans_are_dropped(self):
+        returned = datetime.date.today() - datetime.timedelta(days=400)
+        old_loan = Loan.objects.create(loaned_copy=self.copies[2], borrower=self.test_user,
+            loan_start=returned - datetime.timedelta(weeks=3), return_due=returned,
+            date_returned=returned)
+        token = self.sync(self.test_user)['token']
+        list(archive.archive_loans(archive.default_cutoff()))
+
+        changes = self.sync(self.test_user, token)['changes']
+        self.assertEqual(changes['loans']['deleted'], [str(old_loan.pk)])
+        # A client starting afresh ends up with the same loans
+        changes = self.sync(self.test_user)['changes']
+        self.assertEqual([row[0] for row in changes['loans']['rows']], [self.loan.pk])
+
+    @override_settings(LIBRARY_SYNC_BATCH_SIZE=3)
+    def test_batches(self):
+        data = self.sync(self.test_librarian)
+        self.assertTrue(data['more'])
+        copies = [row[0] for row in data['changes']['copies']['rows']]
+        while data['more']:
+            data = self.sync(self.test_librarian, data['token'])
+            self.assertFalse(data['reset'])
+            copies += [row[0] for row in data['changes'].get('copies', {'rows': []})['rows']]
+        self.assertEqual(sorted(copies), [copy.pk for copy in self.copies])
+        self.assertEqual(self.sync(self.test_librarian, data['token'])['changes'], {})
+
+    def test_stale_and_invalid_tokens(self):
+        token = self.sync(self.test_user)['token']
+        with override_settings(LIBRARY_SYNC_TOMBSTONE_DAYS=0):
+            self.assertTrue(self.sync(self.test_user, token)['reset'])
+
+        client = APIClient()
+        client.force_authenticate(self.test_user)
+        response = client.get('/library/api/v1/sync/', {'since': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(APIClient().get('/library/api/v1/sync/').status_code, 401)
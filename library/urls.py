@@ -10,6 +10,14 @@ router.register('loans', views.LoanViewSet, basename='loan')
 router.register('users', views.UserViewSet)
 router.register('usermicrobits', views.UserMicrobitViewSet)
 router.register('categories', views.CategoryViewSet)
+router.register('microbitreadings', views.MicrobitReadingViewSet, basename='microbitreading')
+router.register('checkouts', views.CheckoutViewSet, basename='checkout')
+router.register('returns', views.ReturnViewSet, basename='return')
+router.register('renewals', views.RenewalViewSet, basename='renewal')
+router.register('tokens', views.TokenViewSet, basename='token')
+router.register('authmetrics', views.AuthenticationMetricsViewSet, basename='authmetrics')
+router.register('exports', views.ExportViewSet, basename='export')
+router.register('sync', views.SyncViewSet, basename='sync')
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -31,6 +39,8 @@ urlpatterns = [
     path('loan/<uuid:pk>/delete/', views.LoanDelete.as_view(), name='loan_delete'),
     path('issue/', views.issue_find_user, name='issue_find_user'),
     path('issue-to/<int:user_pk>', views.issue_to_user, name='issue_to_user'),
+    path('lookup/copies/', views.copy_lookup, name='copy_lookup'),
+    path('lookup/users/', views.user_lookup, name='user_lookup'),
     path('api/v1/', include(router.urls)),
     path('api/v1/api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
@@ -1,19 +1,35 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets, filters, serializers, status
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import (
     DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, 
-    IsAuthenticated, IsAdminUser, BasePermission,
+    IsAuthenticated, IsAdminUser, BasePermission, SAFE_METHODS,
     )
 from django_filters.rest_framework import DjangoFilterBackend
+from library.caching import CachedResponseMixin
+from library.filters import FullTextSearchFilter
+from library.pagination import KeysetPagination
+from library.renderers import CSVRenderer, NDJSONRenderer
 from library.serializers import (
     BookSerializer, CopySerializer, LoanSerializer, 
     UserSerializer, UserMicrobitSerializer, CategorySerializer,
+    MicrobitReadingSerializer, LoanBatchSerializer, requested_names,
     )
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
+from collections import OrderedDict
 import datetime
 
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
 
-from library.models import Book, Copy, Loan, UserMicrobit, Category
+from library import authentication, configuration, export, loans, sync, telemetry
+from library.authentication import MeasuredBasicAuthentication, MeasuredSessionAuthentication
+from library.models import ArchivedLoan, Book, Copy, Loan, UserMicrobit, Category
 # from library.models import Configuration
 
 # import the logging library
@@ -23,54 +39,173 @@ import logging
 logger = logging.getLogger('library.views')
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class FieldSelectionViewMixin:
+    """
+    For ModelViewSets whose serializers take ?fields= and ?expand= (see
+    library.serializers.FieldSelectionMixin): load only what the requested
+    fields need. field_querysets maps a field to a function applied to the
+    queryset when the field is returned, and expand_querysets to one applied
+    instead when it is expanded.
+    """
+    field_querysets = {}
+    expand_querysets = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        selected = requested_names(self.request, 'fields')
+        expanded = requested_names(self.request, 'expand') or ()
+        for name in set(self.field_querysets) | set(self.expand_querysets):
+            if selected is not None and name not in selected:
+                continue
+            if name in expanded and name in self.expand_querysets:
+                queryset = self.expand_querysets[name](queryset)
+            elif name in self.field_querysets:
+                queryset = self.field_querysets[name](queryset)
+        return queryset
+
+class BookViewSet(FieldSelectionViewMixin, CachedResponseMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows books to be viewed or edited.
     """
-    queryset = Book.objects.all().order_by('title')
+    cache_scope = 'book'
+    representation_version = 2
+    queryset = Book.objects.order_by('title')
+    # Annotate availability and prefetch just the copy IDs needed for the
+    # copy hyperlinks, so a page costs the same few queries however long it is
+    field_querysets = {
+        'copy_available': lambda books: books.with_availability(),
+        'copies': lambda books: books.prefetch_related(
+            Prefetch('copies', queryset=Copy.objects.only('id', 'book_id'))),
+    }
+    expand_querysets = {
+        'copies': lambda books: books.prefetch_related(
+            Prefetch('copies', queryset=Copy.objects.with_loan_state())),
+        'category': lambda books: books.select_related('category'),
+    }
     serializer_class = BookSerializer
     permission_classes = (DjangoModelPermissionsOrAnonReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
+    filter_backends = (DjangoFilterBackend, FullTextSearchFilter,)
     # filter_backends = (filters.SearchFilter,)
     filterset_fields = ('author', 'title')
-    search_fields = ('author', 'title')
 
 
-class CopyViewSet(viewsets.ModelViewSet):
+def with_loan_state(copies):
+    # Both on_loan and available read the one annotation
+    if 'loan_open' in copies.query.annotations:
+        return copies
+    return copies.with_loan_state()
+
+class CopyViewSet(FieldSelectionViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows copies to be viewed or edited.
     """
     queryset = Copy.objects.all()
+    field_querysets = {
+        'on_loan': lambda copies: with_loan_state(copies),
+        'available': lambda copies: with_loan_state(copies),
+    }
+    expand_querysets = {
+        'book': lambda copies: copies.select_related('book').prefetch_related(
+            Prefetch('book__copies', queryset=Copy.objects.only('id', 'book_id'))),
+    }
     serializer_class = CopySerializer
     permission_classes = (DjangoModelPermissionsOrAnonReadOnly,)
 
-class MyLoanViewSet(viewsets.ModelViewSet):
+class LoanServiceMixin:
+    """
+    Lends, returns and edits loans through library.loans, so that the API
+    keeps to the same rules as the librarians' pages, even under concurrent
+    requests.
+    """
+
+    def call_service(self, function, *args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except ValidationError as error:
+            raise serializers.ValidationError(
+                error.message_dict if hasattr(error, 'error_dict') else error.messages)
+
+    def perform_create(self, serializer):
+        if serializer.validated_data.get('date_returned') is not None:
+            # Recording a past loan, not lending a copy
+            serializer.save()
+        else:
+            data = dict(serializer.validated_data)
+            # A loan may be recorded without a borrower
+            borrower = data.pop('borrower', None)
+            serializer.instance = self.call_service(loans.issue, borrower=borrower, **data)
+
+    def perform_update(self, serializer):
+        serializer.instance = self.call_service(
+            loans.update, serializer.instance, **serializer.validated_data)
+
+class LoanHistoryMixin:
+    """
+    With ?closed=true, lists the archived loans (see library.archive) along
+    with the closed loans still in Loan, as one list, and finds archived
+    loans by ID. Archived loans can't be changed.
+    """
+
+    def showing_closed(self):
+        return self.request.query_params.get('closed', 'false').lower() in ['true', 't', 'yes']
+
+    def get_archived_queryset(self):
+        return ArchivedLoan.objects.order_by('-date_returned')
+
+    def paginate_queryset(self, queryset):
+        if self.showing_closed():
+            queryset = [queryset, self.filter_queryset(self.get_archived_queryset())]
+        return super().paginate_queryset(queryset)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if not self.showing_closed() or self.request.method not in SAFE_METHODS:
+                raise
+        loan = get_object_or_404(self.filter_queryset(self.get_archived_queryset()),
+            pk=self.kwargs[self.lookup_field])
+        self.check_object_permissions(self.request, loan)
+        return loan
+
+class MyLoanViewSet(FieldSelectionViewMixin, LoanHistoryMixin, LoanServiceMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows loans to be viewed or edited.
     """
     # queryset = Loan.objects.all()
     def get_queryset(self):
-        return_closed_loans = self.request.query_params.get('closed', 'false')
-        if return_closed_loans.lower() in ['true', 't', 'yes']:
-            return Loan.objects.filter(borrower=self.request.user).filter(date_returned__isnull=False).order_by('return_due')
+        if self.showing_closed():
+            return Loan.objects.filter(borrower=self.request.user).filter(date_returned__isnull=False).order_by('-date_returned')
         else:
             return Loan.objects.filter(borrower=self.request.user).filter(date_returned__isnull=True).order_by('return_due')
 
+    def get_archived_queryset(self):
+        return super().get_archived_queryset().filter(borrower=self.request.user)
+
     serializer_class = LoanSerializer
     permission_classes = (DjangoModelPermissions,)
+    pagination_class = KeysetPagination
+    expand_querysets = {
+        'loaned_copy': lambda loans: loans.select_related('loaned_copy'),
+        'borrower': lambda loans: loans.select_related('borrower'),
+    }
 
-class LoanViewSet(viewsets.ModelViewSet):
+class LoanViewSet(FieldSelectionViewMixin, LoanHistoryMixin, LoanServiceMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows loans to be viewed or edited.
     """
     # queryset = Loan.objects.all()
     def get_queryset(self):
-        return_closed_loans = self.request.query_params.get('closed', 'false')
-        if return_closed_loans.lower() in ['true', 't', 'yes']:
-            queryset = Loan.objects.filter(date_returned__isnull=False)
+        if self.showing_closed():
+            queryset = Loan.objects.filter(date_returned__isnull=False).order_by('-date_returned')
         else:
-            queryset = Loan.objects.filter(date_returned__isnull=True)
+            queryset = Loan.objects.filter(date_returned__isnull=True).order_by('return_due')
+        return self.filter_borrower(queryset)
+
+    def get_archived_queryset(self):
+        return self.filter_borrower(super().get_archived_queryset())
 
+    def filter_borrower(self, queryset):
         if 'borrower' in self.request.query_params:
             try:
                 query_borrower_id = int(self.request.query_params['borrower'])
@@ -78,12 +213,17 @@ class LoanViewSet(viewsets.ModelViewSet):
             except ValueError:
                 pass
 
-        return queryset.order_by('return_due')
+        return queryset
 
     serializer_class = LoanSerializer
     permission_classes = (DjangoModelPermissions,)
+    pagination_class = KeysetPagination
+    expand_querysets = {
+        'loaned_copy': lambda loans: loans.select_related('loaned_copy'),
+        'borrower': lambda loans: loans.select_related('borrower'),
+    }
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(FieldSelectionViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows loans to be viewed or edited.
     """
@@ -91,7 +231,7 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = (IsAdminUser,)
 
-class UserMicrobitViewSet(viewsets.ModelViewSet):
+class UserMicrobitViewSet(FieldSelectionViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows loans to be viewed or edited.
     """
@@ -99,10 +239,176 @@ class UserMicrobitViewSet(viewsets.ModelViewSet):
     serializer_class = UserMicrobitSerializer
     permission_classes = (DjangoModelPermissions,) 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(FieldSelectionViewMixin, CachedResponseMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows loans to be viewed or edited.
     """
+    cache_scope = 'category'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    permission_classes = (DjangoModelPermissions,)     
\ No newline at end of file
+    permission_classes = (DjangoModelPermissions,)
+
+class CanRecordMicrobitReadings(BasePermission):
+    """Users who can update the micro:bit fields of copies, loans and users."""
+
+    def has_permission(self, request, view):
+        return request.user.has_perms([
+            'library.change_copy', 'library.change_loan', 'library.change_usermicrobit'])
+
+class MicrobitReadingViewSet(viewsets.ViewSet):
+    """
+    API endpoint that accepts a batch of micro:bit heartbeats.
+    """
+    permission_classes = (CanRecordMicrobitReadings,)
+    max_readings = 1000
+
+    def create(self, request):
+        if len(request.data) > self.max_readings:
+            raise serializers.ValidationError(
+                'Send at most {} readings at a time.'.format(self.max_readings))
+        serializer = MicrobitReadingSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        result = telemetry.record_readings([(reading['microbit_id'], reading['timestamp'])
+            for reading in serializer.validated_data])
+        return Response(result._asdict(), status=status.HTTP_202_ACCEPTED)
+
+class HasViewPermissions(BasePermission):
+    """Users with all the view's required_permissions."""
+
+    def has_permission(self, request, view):
+        return request.user.has_perms(view.required_permissions)
+
+class LoanBatchViewSet(viewsets.ViewSet):
+    """
+    Base for the API endpoints that lend, return or renew a stack of scanned
+    copies in one request, answering with the outcome for each copy.
+    """
+    permission_classes = (HasViewPermissions,)
+    required_permissions = ('library.change_loan',)
+    succeeded = None
+
+    def create(self, request):
+        serializer = LoanBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        by_microbit = 'microbit_ids' in data
+        try:
+            items = self.apply(data,
+                copy_ids=None if by_microbit else data['copies'],
+                microbit_ids=data['microbit_ids'] if by_microbit else None)
+        except ValidationError as error:
+            raise serializers.ValidationError(error.messages)
+
+        results = []
+        for item in items:
+            result = OrderedDict([('microbit_id' if by_microbit else 'copy', item.key)])
+            if item.ok:
+                result['status'] = self.succeeded
+                result['loan'] = reverse('loan-detail', args=[item.loan.pk], request=request)
+                result['return_due'] = item.loan.return_due
+            else:
+                result['status'] = 'failed'
+                result['error'] = item.error
+            results.append(result)
+        return Response({
+            'succeeded': sum(item.ok for item in items),
+            'failed': sum(not item.ok for item in items),
+            'results': results,
+            })
+
+class CheckoutViewSet(LoanBatchViewSet):
+    """
+    API endpoint that lends a stack of scanned copies to one borrower.
+    """
+    required_permissions = ('library.add_loan',)
+    succeeded = 'issued'
+
+    def apply(self, data, **scanned):
+        if 'borrower' not in data:
+            raise serializers.ValidationError({'borrower': 'Say who is borrowing the copies.'})
+        return_due = data.get('return_due', configuration.get().default_return_due())
+        return loans.issue_batch(data['borrower'], return_due, **scanned)
+
+class ReturnViewSet(LoanBatchViewSet):
+    """
+    API endpoint that returns a stack of scanned copies.
+    """
+    succeeded = 'returned'
+
+    def apply(self, data, **scanned):
+        return loans.return_batch(data.get('date_returned'), borrower=data.get('borrower'), **scanned)
+
+class RenewalViewSet(LoanBatchViewSet):
+    """
+    API endpoint that renews the loans of a stack of scanned copies.
+    """
+    succeeded = 'renewed'
+
+    def apply(self, data, **scanned):
+        if 'return_due' not in data:
+            raise serializers.ValidationError({'return_due': 'Say when the loans are now due.'})
+        return loans.renew_batch(data['return_due'], borrower=data.get('borrower'), **scanned)
+
+class TokenViewSet(viewsets.ViewSet):
+    """
+    API endpoint that trades a user's credentials for a short-lived signed
+    token, to send as `Authorization: Bearer <token>` instead.
+    """
+    # Not a signed token, which could otherwise be renewed for ever
+    authentication_classes = (MeasuredBasicAuthentication, MeasuredSessionAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def create(self, request):
+        return Response(OrderedDict([
+            ('token', authentication.issue_token(request.user)),
+            ('expires_in', authentication.token_seconds()),
+            ]), status=status.HTTP_201_CREATED)
+
+class AuthenticationMetricsViewSet(viewsets.ViewSet):
+    """
+    API endpoint that shows how often each authentication scheme has been
+    used by this server process, and the CPU time it took.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        return Response(authentication.metrics())
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    API endpoint that streams all the loans, books or copies as CSV or, with
+    ?format=ndjson, as one JSON object per line.
+    """
+    permission_classes = (HasViewPermissions,)
+    renderer_classes = (CSVRenderer, NDJSONRenderer)
+
+    @property
+    def required_permissions(self):
+        if self.kwargs.get('pk') not in export.EXPORTS:
+            return ()
+        return export.EXPORTS[self.kwargs['pk']].permissions
+
+    def retrieve(self, request, pk=None, format=None):
+        if pk not in export.EXPORTS:
+            raise NotFound('There is no {} export.'.format(pk))
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(export.stream(pk, renderer.format),
+            content_type='{}; charset={}'.format(renderer.media_type, renderer.charset))
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(pk, renderer.format)
+        return response
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    API endpoint that sends the categories, books, copies and loans changed
+    since the sync that gave out the ?since= token, or all of them without
+    one, for clients that keep their own copy.
+    """
+    permission_classes = (IsAuthenticated,)
+    # The rows are compact already
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+
+    def list(self, request):
+        try:
+            return Response(sync.changes(request.user, request.query_params.get('since')))
+        except sync.InvalidToken:
+            raise ParseError('Invalid sync token.')
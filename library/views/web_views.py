@@ -1,21 +1,21 @@
-from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.decorators import permission_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 
+from collections import namedtuple
 import datetime
-from functools import reduce
-import operator
-
-from library.forms import RenewLoanForm, ReturnLoanForm, IssueFindUserForm, IssueToUserForm, BookSearchForm
+from library.forms import RenewLoanForm, ReturnLoanForm, IssueFindUserForm, IssueToUserForm, BookSearchForm, LoanForm
 from library.models import Book, Copy, Loan
-from library.models import Configuration
+from library import archive, caching, configuration, loans, statistics
+from library.pagination import KeysetPaginationMixin, paginate_by_keyset
+from library.search import search_books
 
 # import the logging library
 import logging
@@ -28,22 +28,28 @@ logger = logging.getLogger('library.views')
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    num_copies = Copy.objects.filter(condition__in='MGWD').count()
-
-    # Available books (status = 'a')
-    num_copies_available = len([c for c in Copy.objects.all() if c.available])
+    # Counts of some of the main objects, kept up to date as they change
+    library_statistics = statistics.current()
 
     context = {
-        'num_books': num_books,
-        'num_copies': num_copies,
-        'num_copies_available': num_copies_available,
+        'num_books': library_statistics.total_books,
+        'num_copies': library_statistics.circulating_copies,
+        'num_copies_available': library_statistics.available_copies,
+        'num_open_loans': library_statistics.open_loans,
+        'num_overdue_loans': library_statistics.overdue_loans,
     }
 
     # Render the HTML template index.html with the data in the context variable
     return render(request, 'index.html', context=context)
 
+BookCard = namedtuple('BookCard', 'id version book')
+
+def book_cards(books):
+    """The page's books, each with the version its card is cached under."""
+    books = list(books)
+    versions = caching.book_versions(book.pk for book in books)
+    return [BookCard(book.pk, versions[book.pk], book) for book in books]
+
 def book_list(request):
     """View function for book search."""
 
@@ -52,7 +58,8 @@ def book_list(request):
     # If the form is invalid, use these definitions of what to display
     book_list = Book.objects.all()
     order_term = 'title'
-    default_order = '3'
+    search_order = '5'
+    q = None
 
     # Complex logic as this view can be accessed in three different ways: 
     #   1. as the standard "all books" list ('q' not set, 'order' not set)
@@ -69,8 +76,8 @@ def book_list(request):
             # Case 2: use the given sort order
             form_fields['order'] = request.GET['order']
         else:
-            # Case 3: use the default sort order
-            form_fields['order'] = default_order
+            # Case 3: use the default sort order for searches, by relevance
+            form_fields['order'] = search_order
         form = BookSearchForm(form_fields)
     else:
         # standard "all books" search, case 1 above
@@ -82,18 +89,14 @@ def book_list(request):
         if 'q' in form.cleaned_data:
             q = form.cleaned_data['q']
             if q:
-                query_list = q.split()
-                book_list = Book.objects.filter(
-                    reduce(operator.and_,
-                        (Q(title__icontains=term) for term in query_list)) 
-                    |
-                    reduce(operator.and_,
-                        (Q(author__icontains=term) for term in query_list))
-                    )
+                book_list = search_books(Book.objects.all(), q.split())
         
         if 'order' in form.cleaned_data:
             order = form.cleaned_data['order']
-            if order == "1":
+            if order == "5" and q:
+                # Relevance: keep the ranking from search_books
+                order_term = None
+            elif order == "1":
                 order_term = 'author'
             elif order == "2":
                 order_term = '-author'
@@ -103,7 +106,8 @@ def book_list(request):
                 order_term = '-title'
 
     page = request.GET.get('page', 1)
-    book_list = book_list.order_by(order_term)
+    if order_term:
+        book_list = book_list.order_by(order_term)
 
     paginator = Paginator(book_list, 10)
     try:
@@ -113,9 +117,13 @@ def book_list(request):
     except EmptyPage:
         books = paginator.page(paginator.num_pages)
 
+    cards = book_cards(books)
+
     context = {
         'book_search_form': form,
         'book_list': books,
+        'book_cards': cards,
+        'fragment_timeout': caching.fragment_timeout(),
         # is_a_search_result used to select the message displayed if book_list is empty
         'is_a_search_result': form.is_valid(),
         }
@@ -126,6 +134,13 @@ def book_list(request):
 class BookDetailView(generic.DetailView):
     model = Book
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # The list of copies is cached under the book's version
+        context['book_version'] = caching.book_versions([self.object.pk])[self.object.pk]
+        context['fragment_timeout'] = caching.fragment_timeout()
+        return context
+
 class BookCreate(PermissionRequiredMixin, CreateView):
     model = Book
     fields = '__all__'
@@ -174,29 +189,40 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     def get_queryset(self):
         return Loan.objects.filter(borrower=self.request.user).filter(date_returned__isnull=True).order_by('return_due')
 
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, KeysetPaginationMixin, generic.ListView):
     """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission."""
     model = Loan
     permission_required = 'library.can_view_all_loans'
     template_name ='library/loan_list_all.html'
     paginate_by = 10
+    # Each loan is listed with its copy's book and its borrower
+    related = ('loaned_copy__book', 'borrower')
 
     def get_queryset(self):
-        return Loan.objects.filter(date_returned__isnull=True).order_by('return_due')
+        return (Loan.objects.filter(date_returned__isnull=True).order_by('return_due')
+            .select_related(*self.related))
 
-class LoanedBooksAllOpenClosedListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllOpenClosedListView(PermissionRequiredMixin, KeysetPaginationMixin, generic.ListView):
     """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission."""
     model = Loan
     permission_required = 'library.can_view_all_loans'
     template_name ='library/loan_list_all_open_closed.html'
     paginate_by = 10
+    # Each loan is listed with its copy's book and its borrower
+    related = ('loaned_copy__book', 'borrower')
 
     def get_queryset(self):
-        return Loan.objects.filter(date_returned__isnull=True).order_by('return_due')
+        return (Loan.objects.filter(date_returned__isnull=True).order_by('return_due')
+            .select_related(*self.related))
 
     def get_context_data(self, *args, **kwargs):
         context = super(LoanedBooksAllOpenClosedListView, self).get_context_data(*args, **kwargs)
-        context['closed_loan_list'] = Loan.objects.filter(date_returned__isnull=False).order_by('-date_returned')
+        # Including the archived loans
+        closed_loans = paginate_by_keyset(self.request,
+            [loans.select_related(*self.related) for loans in archive.closed_loans()],
+            self.paginate_by, cursor_param='closed_cursor')
+        context['closed_loan_list'] = closed_loans.object_list
+        context['closed_page_obj'] = closed_loans
         return context
 
 @permission_required('library.can_mark_returned')
@@ -215,16 +241,17 @@ def renew_loan_librarian(request, pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            loan.return_due = form.cleaned_data['renewal_date']
-            loan.save()
-
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all_loans') )
+            try:
+                loans.renew(loan, form.cleaned_data['renewal_date'])
+            except ValidationError as error:
+                form.add_error(None, error.messages)
+            else:
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all_loans') )
 
     # If this is a GET (or any other method) create the default form.
     else:
-        proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
+        proposed_renewal_date = configuration.get().default_return_due()
         form = RenewLoanForm(initial={'renewal_date': proposed_renewal_date})
 
     context = {
@@ -250,12 +277,13 @@ def return_loan_librarian(request, pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            loan.date_returned = form.cleaned_data['return_date']
-            loan.save()
-
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all_loans') )
+            try:
+                loans.return_loan(loan, form.cleaned_data['return_date'])
+            except ValidationError as error:
+                form.add_error(None, error.messages)
+            else:
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all_loans') )
 
     # If this is a GET (or any other method) create the default form.
     else:
@@ -270,21 +298,40 @@ def return_loan_librarian(request, pk):
 
 class LoanCreate(PermissionRequiredMixin, CreateView):
     model = Loan
-    fields = '__all__'
+    form_class = LoanForm
     permission_required = 'library.add_loan'
 
     def get_initial(self):
         initial = super(LoanCreate, self).get_initial()
         initial['loan_start'] = datetime.date.today()
-        initial['return_due'] = datetime.date.today() + datetime.timedelta(weeks=3)
+        initial['return_due'] = configuration.get().default_return_due()
         return initial
 
+    def form_valid(self, form):
+        if form.cleaned_data['date_returned'] is not None:
+            # Recording a past loan, not lending a copy
+            return super().form_valid(form)
+        try:
+            self.object = loans.issue(**form.cleaned_data)
+        except ValidationError as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
 
 class LoanUpdate(PermissionRequiredMixin, UpdateView):
     model = Loan
-    fields = '__all__'
+    form_class = LoanForm
     permission_required = 'library.change_loan'
 
+    def form_valid(self, form):
+        try:
+            self.object = loans.update(self.object, **form.cleaned_data)
+        except ValidationError as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
 class LoanDelete(PermissionRequiredMixin, DeleteView):
     model = Loan
     success_url = reverse_lazy('all_loans')
@@ -322,7 +369,7 @@ def issue_to_user(request, user_pk):
     open_loans = user_loans.filter(date_returned__isnull=True).order_by('return_due')
     returned_loans = user_loans.filter(date_returned__isnull=False).order_by('date_returned')
 
-    configuration = get_object_or_404(Configuration)
+    policies = configuration.get()
 
     # If this is a POST request then process the Form data
     if request.method == 'POST':
@@ -332,27 +379,62 @@ def issue_to_user(request, user_pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            loan = Loan(loaned_copy = Copy.objects.get(pk=form.cleaned_data['selected_copy']),
-                borrower = user,
-                loan_start = datetime.date.today(),
-                return_due = form.cleaned_data['return_due'],
-                )
-            loan.save()
+            try:
+                loans.issue(form.cleaned_data['selected_copy'], user, form.cleaned_data['return_due'])
+            except ValidationError as error:
+                form.add_error(None, error.messages)
 
             # redirect to a new URL:
             # return HttpResponseRedirect(reverse('all-loans'))
 
     # If this is a GET (or any other method) create the default form.
     else:
-        form = IssueToUserForm(initial={'return_due': datetime.date.today() + datetime.timedelta(weeks=3)})
+        form = IssueToUserForm(initial={'return_due': policies.default_return_due()})
 
     context = {
         'form': form,
         'user': user,
         'open_loans': open_loans,
         'returned_loans': returned_loans,
-        'configuration': configuration,
+        'configuration': policies,
     }
 
     return render(request, 'library/issue_to_user.html', context)
+
+
+# Number of suggestions returned by the typeahead lookups
+LOOKUP_LIMIT = 20
+# The permissions of the views whose forms use the lookups: issuing, and
+# adding or changing a loan
+LOOKUP_PERMISSIONS = ('library.can_mark_loaned', 'library.add_loan', 'library.change_loan')
+
+def can_use_lookups(user):
+    return any(user.has_perm(permission) for permission in LOOKUP_PERMISSIONS)
+
+@user_passes_test(can_use_lookups)
+def copy_lookup(request):
+    """Typeahead lookup of available copies, by copy ID or the start of the book title."""
+    q = request.GET.get('q', '').strip()
+    copies = Copy.objects.available().select_related('book')
+    if not q:
+        copies = copies.none()
+    elif q.isdigit():
+        copies = copies.filter(pk=int(q))
+    else:
+        copies = copies.filter(book__title__istartswith=q).order_by('book__title', 'copy_number')
+
+    results = [{'id': copy.pk, 'text': str(copy)} for copy in copies[:LOOKUP_LIMIT]]
+    return JsonResponse({'results': results})
+
+@user_passes_test(can_use_lookups)
+def user_lookup(request):
+    """Typeahead lookup of library users, by the start of their username."""
+    q = request.GET.get('q', '').strip()
+    users = User.objects.none()
+    if q:
+        users = (User.objects
+            .filter(groups__name='Library user', username__istartswith=q)
+            .order_by('username'))
+
+    results = [{'id': user.pk, 'text': user.get_username()} for user in users[:LOOKUP_LIMIT]]
+    return JsonResponse({'results': results})
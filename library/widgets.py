@@ -0,0 +1,45 @@
+from django import forms
+from django.urls import reverse
+
+
+class LookupWidget(forms.TextInput):
+    """
+    Widget for a ModelChoiceField with too many choices for a <select>.
+
+    Renders a search box that suggests matches from a JSON lookup view as the
+    user types, and a hidden input holding the chosen primary key. The field's
+    queryset is only used to validate the submitted key and to label the
+    current value, never to list the choices.
+
+    The lookup view takes the search text in `q` and returns
+    {"results": [{"id": ..., "text": ...}, ...]}.
+    """
+    template_name = 'library/widgets/lookup.html'
+    input_type = 'hidden'
+
+    def __init__(self, lookup_url_name, attrs=None):
+        super().__init__(attrs)
+        self.lookup_url_name = lookup_url_name
+
+    @property
+    def is_hidden(self):
+        # The key input is hidden, but the search box is not
+        return False
+
+    def label_for_value(self, value):
+        if value in (None, ''):
+            return ''
+        queryset = getattr(self.choices, 'queryset', None)
+        if queryset is None:
+            return str(value)
+        try:
+            instance = queryset.filter(pk=value).first()
+        except (ValueError, TypeError):
+            return ''
+        return str(instance) if instance is not None else ''
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['lookup_url'] = reverse(self.lookup_url_name)
+        context['widget']['label'] = self.label_for_value(value)
+        return context